@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the vector tile compression
+
+Writes the tiles of an .mbtiles or .pmtiles archive uncompressed, with gzip level 6, with plain zstd and with zstd
+and a dictionary trained on the archive (tilesdict), then reports for each the archive size (the dictionary is part
+of the metadata) and the speed of decoding every stored tile, the best of a few rounds.
+
+Usage:
+    python benchmarks/bench_codecs.py input.mbtiles [-l 3] [-s 112640] [-n 10000] [-r 3]
+    python benchmarks/bench_codecs.py input.pmtiles
+"""
+import os
+import time
+import sqlite3
+import argparse
+import tempfile
+from vtiles.utils import codec
+from vtiles.utils.pmtiles.reader import Reader, MmapSource, all_runs
+from vtiles.utils.pmtiles.convert import recompress_pmtiles
+from vtiles.mbtiles.mbtilescompress import compress_mbtiles
+from vtiles.mbtiles.mbtilesdecompress import decompress_mbtiles
+from vtiles.mbtiles.tilesdict import dictionary_compress
+
+
+def read_mbtiles(path):
+    """
+    Stored tile contents and declared codec of an MBTiles, its dictionary is registered
+    """
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        metadata = dict(conn.execute('SELECT name, value FROM metadata').fetchall())
+        tiles = [row[0] for row in conn.execute('SELECT tile_data FROM tiles')]
+    finally:
+        conn.close()
+    codec.load_dictionary(metadata)
+    return tiles, metadata.get('compression')
+
+
+def read_pmtiles(path):
+    """
+    Stored tile contents and codec of a PMTiles, its dictionary is registered
+    """
+    with open(path, 'rb') as f:
+        source = MmapSource(f)
+        reader = Reader(source)
+        reader.tile_dictionary()
+        tile_codec = reader.header()['tile_compression']
+        offsets = set()
+        tiles = []
+        for tile_id, run_length, offset, tile_data in all_runs(source):
+            if offset not in offsets:
+                offsets.add(offset)
+                tiles.append(bytes(tile_data))
+    return tiles, tile_codec
+
+
+def decode_speed(tiles, tile_codec, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        started = time.perf_counter()
+        decoded = sum(len(codec.decode(tile_data, tile_codec)) for tile_data in tiles)
+        best = min(best, time.perf_counter() - started)
+    return decoded, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the archive size and decode speed of gzip, zstd and zstd with a trained dictionary.')
+    parser.add_argument('input', help='Input vector .mbtiles or .pmtiles file')
+    parser.add_argument('-l', '--level', type=int, help='zstd compression level (default: 3)')
+    parser.add_argument('-s', '--size', type=int, default=codec.DICTIONARY_SIZE, help=f'Dictionary size in bytes (default: {codec.DICTIONARY_SIZE})')
+    parser.add_argument('-n', '--samples', type=int, default=codec.DICTIONARY_SAMPLES, help=f'Tiles the dictionary is trained on (default: {codec.DICTIONARY_SAMPLES})')
+    parser.add_argument('-r', '--rounds', type=int, default=3, help='Decode rounds, the best one is reported (default: 3)')
+    args = parser.parse_args()
+
+    ext = os.path.splitext(args.input)[1]
+    with tempfile.TemporaryDirectory() as tmp:
+        def path(name):
+            return os.path.join(tmp, name + ext)
+
+        # Every variant is written from the uncompressed tiles
+        raw = path('none')
+        if ext == '.pmtiles':
+            recompress_pmtiles(args.input, raw, 'none')
+            recompress_pmtiles(raw, path('gzip-6'), 'gzip', 6)
+            recompress_pmtiles(raw, path('zstd'), 'zstd', args.level)
+            read = read_pmtiles
+        else:
+            decompress_mbtiles(args.input, raw)
+            compress_mbtiles(raw, path('gzip-6'), 'gzip', 6)
+            compress_mbtiles(raw, path('zstd'), 'zstd', args.level)
+            read = read_mbtiles
+        dictionary_compress(raw, path('zstd+dictionary'), args.size, args.samples, args.level)
+
+        print()
+        print(f"{'compression':<18} {'archive MB':>11} {'vs gzip-6':>10} {'tiles':>8} {'decode ms':>10} {'tiles/s':>10} {'MB/s':>8}")
+        gzip_size = os.path.getsize(path('gzip-6'))
+        for name in ('none', 'gzip-6', 'zstd', 'zstd+dictionary'):
+            size = os.path.getsize(path(name))
+            tiles, tile_codec = read(path(name))
+            decoded, seconds = decode_speed(tiles, tile_codec, args.rounds)
+            print(f"{name:<18} {size / 1e6:>11.2f} {size / gzip_size:>9.1%} {len(tiles):>8} {seconds * 1000:>10.1f} "
+                  f"{len(tiles) / seconds:>10.0f} {decoded / 1e6 / seconds:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
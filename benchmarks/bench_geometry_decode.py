@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the vector tile geometry decoding
+
+Decodes every tile of a vector .mbtiles with mapbox_vector_tile.decode (nested lists of [x, y], built in Python) and
+with the NumPy geometry arrays of TileView, alone and turned into shapely geometries or GeoJSON, the best of a few
+rounds.
+
+Usage:
+    python benchmarks/bench_geometry_decode.py input.mbtiles [-n 2000] [-r 3]
+"""
+import time
+import sqlite3
+import argparse
+from vtiles.utils import codec
+from vtiles.utils.geopreocessing import get_tile_codec, get_tile_dictionary
+from vtiles.utils.mapbox_vector_tile import decode, TileView
+from vtiles.utils.vt2geojson.tools import vt_bytes_to_geojson
+
+
+def read_tiles(path, limit):
+    """
+    Uncompressed contents and (z, x, y) of up to limit tiles of an MBTiles
+    """
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        cursor = conn.cursor()
+        tile_codec = get_tile_codec(cursor)
+        get_tile_dictionary(cursor)
+        rows = cursor.execute('SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles LIMIT ?', (limit,)).fetchall()
+    finally:
+        conn.close()
+    return [(z, x, (1 << z) - 1 - y, codec.decode(tile_data, tile_codec)) for z, x, y, tile_data in rows]
+
+
+def shapes(tile_data):
+    tile = TileView(tile_data)
+    return [tile[name].shapes(geometry_arrays=arrays) for name, arrays in tile.geometry_arrays().items()]
+
+
+def best_time(fn, tiles, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn(tiles)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare decode() with the NumPy geometry arrays of TileView.')
+    parser.add_argument('input', help='Input vector .mbtiles file')
+    parser.add_argument('-n', '--tiles', type=int, default=2000, help='Number of tiles to decode (default: 2000)')
+    parser.add_argument('-r', '--rounds', type=int, default=3, help='Rounds, the best one is reported (default: 3)')
+    args = parser.parse_args()
+
+    tiles = read_tiles(args.input, args.tiles)
+    size = sum(len(tile_data) for z, x, y, tile_data in tiles)
+    print(f"{len(tiles)} tiles, {size / 1e6:.1f} MB uncompressed")
+    print(f"{'decoder':<28} {'seconds':>8} {'tiles/s':>10} {'MB/s':>8}")
+    variants = [
+        ('decode', lambda tiles: [decode(tile_data) for z, x, y, tile_data in tiles]),
+        ('geometry arrays', lambda tiles: [TileView(tile_data).geometry_arrays() for z, x, y, tile_data in tiles]),
+        ('geometry arrays -> shapely', lambda tiles: [shapes(tile_data) for z, x, y, tile_data in tiles]),
+        ('vt2geojson', lambda tiles: [vt_bytes_to_geojson(tile_data, x, y, z) for z, x, y, tile_data in tiles]),
+    ]
+    for name, fn in variants:
+        seconds = best_time(fn, tiles, args.rounds)
+        print(f"{name:<28} {seconds:>8.2f} {len(tiles) / seconds:>10.0f} {size / 1e6 / seconds:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the PMTiles directory codec
+
+Compares the NumPy directory codec of vtiles.utils.pmtiles.tile with the previous implementation, which read and
+wrote varints one byte at a time and built one Entry per tile (kept below as the reference).
+
+Usage:
+    python benchmarks/bench_pmtiles_directory.py [input.pmtiles] [-n 65536] [-r 5]
+Without an input file, a random directory of n entries is used.
+"""
+import io
+import gzip
+import time
+import random
+import argparse
+from vtiles.utils.pmtiles.tile import (
+    Entry,
+    read_varint,
+    write_varint,
+    find_tile,
+    deserialize_directory,
+    serialize_directory,
+    zxy_to_tileid,
+)
+from vtiles.utils.pmtiles.reader import Reader, MmapSource
+
+
+def reference_deserialize_directory(buf):
+    b_io = io.BytesIO(gzip.decompress(buf))
+    entries = []
+    num_entries = read_varint(b_io)
+
+    last_id = 0
+    for i in range(num_entries):
+        tmp = read_varint(b_io)
+        entries.append(Entry(last_id + tmp, 0, 0, 0))
+        last_id += tmp
+    for i in range(num_entries):
+        entries[i].run_length = read_varint(b_io)
+    for i in range(num_entries):
+        entries[i].length = read_varint(b_io)
+    for i in range(num_entries):
+        tmp = read_varint(b_io)
+        if i > 0 and tmp == 0:
+            entries[i].offset = entries[i - 1].offset + entries[i - 1].length
+        else:
+            entries[i].offset = tmp - 1
+    return entries
+
+
+def reference_serialize_directory(entries):
+    b_io = io.BytesIO()
+    write_varint(b_io, len(entries))
+    last_id = 0
+    for e in entries:
+        write_varint(b_io, e.tile_id - last_id)
+        last_id = e.tile_id
+    for e in entries:
+        write_varint(b_io, e.run_length)
+    for e in entries:
+        write_varint(b_io, e.length)
+    for i, e in enumerate(entries):
+        if i > 0 and e.offset == entries[i - 1].offset + entries[i - 1].length:
+            write_varint(b_io, 0)
+        else:
+            write_varint(b_io, e.offset + 1)
+    return gzip.compress(b_io.getvalue())
+
+
+def random_directory(n):
+    entries = []
+    tile_id = zxy_to_tileid(12, 0, 0)
+    offset = 0
+    for _ in range(n):
+        tile_id += random.choice((1, 1, 1, 2, 7))
+        length = random.randrange(50, 200000)
+        if random.random() < 0.1:
+            # Deduplicated tile pointing back into the data section
+            entries.append(Entry(tile_id, random.randrange(0, offset + 1), length, random.choice((1, 1, 4))))
+        else:
+            entries.append(Entry(tile_id, offset, length, 1))
+            offset += length
+    return [reference_serialize_directory(entries)]
+
+
+def directories_of(path):
+    with open(path, 'rb') as f:
+        source = MmapSource(f)
+        header = Reader(source).header()
+        root_bytes = source(header['root_offset'], header['root_length'])
+        root = deserialize_directory(root_bytes)
+        leaves = [source(header['leaf_directory_offset'] + e.offset, e.length) for e in root if e.run_length == 0]
+    return leaves or [root_bytes]
+
+
+def timed(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the PMTiles directory codec.')
+    parser.add_argument('input', nargs='?', help='PMTiles file whose leaf directories are decoded (default: random directory)')
+    parser.add_argument('-n', '--entries', type=int, default=65536, help='Entries of the random directory (default: 65536)')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Repetitions, the best time is reported (default: 5)')
+    args = parser.parse_args()
+
+    random.seed(0)
+    buffers = directories_of(args.input) if args.input else random_directory(args.entries)
+
+    ref_decode, ref_dirs = timed(lambda: [reference_deserialize_directory(b) for b in buffers], args.repeat)
+    new_decode, new_dirs = timed(lambda: [deserialize_directory(b) for b in buffers], args.repeat)
+    ref_encode, _ = timed(lambda: [reference_serialize_directory(d) for d in ref_dirs], args.repeat)
+    new_encode, _ = timed(lambda: [serialize_directory(d) for d in new_dirs], args.repeat)
+
+    num_entries = sum(len(d) for d in new_dirs)
+    queries = [random.randrange(ref_dirs[0][0].tile_id, ref_dirs[-1][-1].tile_id + 1) for _ in range(100000)]
+    ref_find, _ = timed(lambda: [find_tile(ref_dirs[0], q) for q in queries], args.repeat)
+    new_find, _ = timed(lambda: [find_tile(new_dirs[0], q) for q in queries], args.repeat)
+
+    print(f'{len(buffers)} directories, {num_entries} entries')
+    print(f"{'':<22} {'byte-at-a-time':>15} {'numpy':>10} {'speedup':>8}")
+    for name, ref, new in (('decode (ms)', ref_decode, new_decode), ('encode (ms)', ref_encode, new_encode),
+                           ('find_tile x100k (ms)', ref_find, new_find)):
+        print(f'{name:<22} {ref * 1000:>15.1f} {new * 1000:>10.1f} {ref / new:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
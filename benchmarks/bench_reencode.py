@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the vector tile re-encoding
+
+Decodes every tile of a vector .mbtiles and encodes it again, as mbtilessplit and mbtilesmerge do: through shapely
+(the geometries are loaded, oriented and validated) and as trusted geometry arrays (encoded without shapely), the best
+of a few rounds.
+
+Usage:
+    python benchmarks/bench_reencode.py input.mbtiles [-n 2000] [-r 3]
+"""
+import argparse
+from vtiles.utils.geopreocessing import decode_tile_layers
+from vtiles.utils.mapbox_vector_tile import encode, TileView
+from bench_geometry_decode import read_tiles, best_time
+
+
+def reencode(tiles, trusted):
+    for z, x, y, tile_data in tiles:
+        layers, extents = decode_tile_layers(TileView(tile_data), trusted=trusted)
+        encode(layers, per_layer_options={name: {"extents": extent} for name, extent in extents.items()})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare re-encoding tiles through shapely and as trusted geometry arrays.')
+    parser.add_argument('input', help='Input vector .mbtiles file')
+    parser.add_argument('-n', '--tiles', type=int, default=2000, help='Number of tiles to re-encode (default: 2000)')
+    parser.add_argument('-r', '--rounds', type=int, default=3, help='Rounds, the best one is reported (default: 3)')
+    args = parser.parse_args()
+
+    tiles = read_tiles(args.input, args.tiles)
+    size = sum(len(tile_data) for z, x, y, tile_data in tiles)
+    print(f"{len(tiles)} tiles, {size / 1e6:.1f} MB uncompressed")
+    print(f"{'re-encoding':<28} {'seconds':>8} {'tiles/s':>10} {'MB/s':>8}")
+    for name, trusted in (('shapely', False), ('trusted geometry arrays', True)):
+        seconds = best_time(lambda tiles: reencode(tiles, trusted), tiles, args.rounds)
+        print(f"{name:<28} {seconds:>8.2f} {len(tiles) / seconds:>10.0f} {size / 1e6 / seconds:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
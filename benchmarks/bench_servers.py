@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Load test of the tile servers
+
+Converts an .mbtiles file to .pmtiles and a tiles folder, starts every server on it and requests random
+existing tiles from concurrent keep-alive clients, then reports requests/s and latency percentiles:
+    servembtiles, servepmtiles, servefolder      (blocking wsgiref/http.server, one thread per connection)
+    servetiles                                   (ASGI on uvicorn, one process for the three tilesets)
+
+Usage:
+    python benchmarks/bench_servers.py input.mbtiles [-c 32] [-d 10]
+"""
+import os
+import sys
+import time
+import random
+import socket
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from vtiles.mbtiles.mbtiles2pmtiles import mbtiles_to_pmtiles
+from vtiles.mbtiles.mbtiles2folder import convert_mbtiles_to_folder
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Server on port {port} did not start')
+
+
+def tile_paths(mbtiles, ext='pbf'):
+    conn = sqlite3.connect(mbtiles)
+    try:
+        rows = conn.execute('SELECT zoom_level, tile_column, tile_row FROM tiles;').fetchall()
+    finally:
+        conn.close()
+    return [f'{z}/{x}/{(1 << z) - 1 - y}.{ext}' for z, x, y in rows]
+
+
+def run_load(port, prefix, paths, concurrency, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop = time.perf_counter() + duration
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local = []
+        failed = 0
+        rnd = random.Random()
+        while time.perf_counter() < stop:
+            path = prefix + rnd.choice(paths)
+            start = time.perf_counter()
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    failed += 1
+                if response.getheader('Connection', '').lower() == 'close' or response.version == 10:
+                    conn.close()
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+                continue
+            local.append(time.perf_counter() - start)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    def percentile(p):
+        return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000 if latencies else float('nan')
+    return {'requests': len(latencies), 'rps': len(latencies) / elapsed, 'p50': percentile(0.50),
+            'p99': percentile(0.99), 'errors': errors[0]}
+
+
+def bench(name, cmd, port, prefix, paths, args, cwd=None):
+    proc = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        run_load(port, prefix, paths, args.concurrency, 1)  # warm up
+        result = run_load(port, prefix, paths, args.concurrency, args.duration)
+    finally:
+        proc.terminate()
+        proc.wait()
+    print(f"{name:<28} {result['requests']:>9} {result['rps']:>10.1f} {result['p50']:>9.2f} {result['p99']:>9.2f} {result['errors']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test servembtiles, servepmtiles, servefolder and servetiles.')
+    parser.add_argument('input', help='Input vector .mbtiles file')
+    parser.add_argument('-c', '--concurrency', type=int, default=32, help='Concurrent client connections (default: 32)')
+    parser.add_argument('-d', '--duration', type=float, default=10, help='Seconds of load per server (default: 10)')
+    args = parser.parse_args()
+
+    python = sys.executable
+    env_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    os.environ['PYTHONPATH'] = os.pathsep.join(p for p in (env_path, os.environ.get('PYTHONPATH')) if p)
+    paths = tile_paths(args.input)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        mbtiles = os.path.join(tmp, 'bench.mbtiles')
+        with open(args.input, 'rb') as src, open(mbtiles, 'wb') as dst:
+            dst.write(src.read())
+        pmtiles = os.path.join(tmp, 'bench.pmtiles')
+        folder = os.path.join(tmp, 'bench')
+        mbtiles_to_pmtiles(mbtiles, pmtiles)
+        os.makedirs(folder)
+        convert_mbtiles_to_folder(mbtiles, folder, flipy=True)
+
+        print(f'{len(paths)} tiles, {args.concurrency} connections, {args.duration}s per server')
+        print(f"{'server':<28} {'requests':>9} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+
+        port = free_port()
+        bench('servembtiles', [python, '-m', 'vtiles.server.servembtiles', '--serve', '-a', '127.0.0.1',
+                               '-p', str(port), '-f', mbtiles], port, '/', paths, args)
+        port = free_port()
+        bench('servepmtiles', [python, '-m', 'vtiles.server.servepmtiles', pmtiles, '-host', '127.0.0.1',
+                               '-port', str(port)], port, '/', paths, args)
+        # servefolder always listens on port 8000 and serves the current directory
+        bench('servefolder', [python, '-m', 'vtiles.server.servefolder'], 8000, '/', paths, args, cwd=folder)
+
+        for name in ('mbtiles', 'pmtiles', 'folder'):
+            port = free_port()
+            bench(f'servetiles ({name})', [python, '-m', 'vtiles.server.servetiles', '-a', '127.0.0.1', '-p', str(port),
+                                           f'mbtiles={mbtiles}', f'pmtiles={pmtiles}', f'folder={folder}'],
+                  port, f'/{name}/', paths, args)
+
+
+if __name__ == '__main__':
+    main()
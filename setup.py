@@ -12,6 +12,7 @@ requirements = [
     'fiona~=1.10.0',
     'shapely~=2.0.1',
     'protobuf~=5.26.1',
+    'numpy>=1.21.0',
     'pillow~=10.0.1'
 ],
 
@@ -35,7 +36,7 @@ setup(
     long_description=open('README.md').read(),
     long_description_content_type='text/markdown',
     requires_python=">=3.0",
-    packages=find_packages(),
+    packages=find_packages(exclude=["tests", "tests.*"]),
     include_package_data=True,  # Include package data specified in MANIFEST.in
     entry_points={
         'console_scripts': [
@@ -43,6 +44,7 @@ setup(
             'mbtilesinfo = vtiles.mbtiles.mbtilesinfo:main',
             'mbtilesinspect = vtiles.mbtiles.mbtilesinspect:main',
             'mbtilesdelduplicate = vtiles.mbtiles.mbtilesdelduplicate:main',           
+            'mbtilesdedup = vtiles.mbtiles.mbtilesdedup:main',
 
             'mbtiles2folder = vtiles.mbtiles.mbtiles2folder:main',
             'folder2mbtiles = vtiles.mbtiles.folder2mbtiles:main',
@@ -57,6 +59,7 @@ setup(
             'mbtilesmerge = vtiles.mbtiles.mbtilesmerge:main',
             'mbtilesdecompress = vtiles.mbtiles.mbtilesdecompress:main',
             'mbtilescompress = vtiles.mbtiles.mbtilescompress:main',
+            'tilesdict = vtiles.mbtiles.tilesdict:main',
             'mbtilesfixmeta = vtiles.mbtiles.mbtilesfixmeta:main',
            
             'tileinfo = vtiles.mbtiles.tileinfo:main',
@@ -70,6 +73,7 @@ setup(
             'serverastermbtiles=vtiles.server.serverastermbtiles:main',
             'servevectormbtiles=vtiles.server.servevectormbtiles:main',       
             'servepmtiles=vtiles.server.servepmtiles:main',                   
+            'servetiles=vtiles.server.servetiles:main',
             'tilesinspect=vtiles.server.tilesinspect.tilesinspect:main',   
             'pmtilesinspect=vtiles.server.pmtilesinspect.pmtilesinspect:main',   
 
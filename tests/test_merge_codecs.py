@@ -0,0 +1,79 @@
+"""
+mbtilesmerge on inputs that are not gzipped
+
+Two small vector MBTiles with overlapping tiles, a gzipped one merged with copies of the other compressed with a zstd
+dictionary (tilesdict), with brotli and uncompressed. The merged output declares gzip and has no dictionary, so every
+tile must be gzipped and the features of both inputs must all be found.
+"""
+import sqlite3
+import pytest
+from shapely.geometry import LineString, Point
+from vtiles.utils import codec
+from vtiles.utils.mapbox_vector_tile import encode, TileView
+from vtiles.mbtiles.mbtilescompress import compress_mbtiles
+from vtiles.mbtiles.mbtilesdecompress import decompress_mbtiles
+from vtiles.mbtiles.mbtilesmerge import merge_mbtiles
+from vtiles.mbtiles.tilesdict import dictionary_compress
+
+
+def write_mbtiles(path, layer, max_zoom, feature_count):
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute('CREATE TABLE metadata (name TEXT, value TEXT)')
+        conn.execute('CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)')
+        conn.execute('CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)')
+        conn.executemany('INSERT INTO metadata (name, value) VALUES (?, ?)',
+                         [('name', layer), ('format', 'pbf'), ('compression', 'gzip'), ('minzoom', '0'),
+                          ('maxzoom', str(max_zoom)), ('bounds', '-180,-85,180,85')])
+        rows = []
+        for z in range(max_zoom + 1):
+            for x in range(1 << z):
+                for y in range(1 << z):
+                    features = [{'geometry': LineString([(i * 40, x * 7 % 4096), (i * 40 + 30, y * 11 % 4096)])
+                                 if i % 2 else Point(i * 40, (x + y) % 4096),
+                                 'properties': {'name': f'{layer} {z}/{x}/{y} {i}', 'rank': i}}
+                                for i in range(feature_count)]
+                    tile = encode([{'name': layer, 'features': features}])
+                    rows.append((z, x, y, codec.encode(tile, 'gzip')))
+        conn.executemany('INSERT INTO tiles VALUES (?, ?, ?, ?)', rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def feature_count(path):
+    """
+    Features of all the tiles, which must all be gzipped: their dictionary or codec does not need to be known
+    """
+    conn = sqlite3.connect(path)
+    try:
+        total = 0
+        for z, x, y, tile_data in conn.execute('SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles'):
+            assert codec.sniff(tile_data) is codec.get_codec('gzip'), f'{path}: tile {z}/{x}/{y} is not gzipped'
+            total += sum(layer.feature_count for layer in TileView(codec.decode(tile_data, 'gzip')))
+        return total
+    finally:
+        conn.close()
+
+
+@pytest.fixture(scope='module')
+def inputs(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp('merge')
+    paths = {name: str(tmp / f'{name}.mbtiles') for name in ('a', 'b', 'b-dictionary', 'b-brotli', 'b-none')}
+    # The inputs overlap from zoom 0 to 3, the second one alone has zoom 4
+    write_mbtiles(paths['a'], 'roads', 3, 5)
+    write_mbtiles(paths['b'], 'water', 4, 5)
+    expected = feature_count(paths['a']) + feature_count(paths['b'])
+    dictionary_compress(paths['b'], paths['b-dictionary'], size=4096)
+    compress_mbtiles(paths['b'], paths['b-brotli'], 'brotli')
+    decompress_mbtiles(paths['b'], paths['b-none'])
+    return paths, expected
+
+
+@pytest.mark.parametrize('first', [True, False])
+@pytest.mark.parametrize('name', ['b', 'b-dictionary', 'b-brotli', 'b-none'])
+def test_merge_with_gzip(inputs, tmp_path, name, first):
+    paths, expected = inputs
+    output = str(tmp_path / 'merged.mbtiles')
+    merge_mbtiles([paths[name], paths['a']] if first else [paths['a'], paths[name]], output)
+    assert feature_count(output) == expected
@@ -0,0 +1,172 @@
+"""
+PMTiles RangeSource against a local HTTP server
+
+A .pmtiles of random tiles with leaf directories is served from a local http.server that answers Range requests with
+an ETag. Every tile read through RangeSource with small blocks must match the MmapSource of the same file, runs of
+missing blocks are merged into single requests, a second source with the same cache directory reads the blocks of
+the first one from disk, and a file changing while it is read or a server ignoring Range raise a ValueError.
+"""
+import os
+import re
+import random
+import shutil
+import threading
+import http.server
+from functools import partial
+import pytest
+from vtiles.utils.pmtiles.convert import mbtiles_to_header_json
+from vtiles.utils.pmtiles.reader import Reader, MmapSource, RangeSource, all_tiles
+from vtiles.utils.pmtiles.writer import write
+
+BLOCK_SIZE = 1024
+TILE_COUNT = 20000
+
+
+class RangeHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serves single byte ranges of the files with an ETag made of their size and modification time
+    """
+    requests = 0
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        stat = os.stat(path)
+        match = re.fullmatch(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        RangeHandler.requests += 1
+        if match is None:
+            self.send_error(400, 'Only single byte ranges are served')
+            return
+        start, end = int(match.group(1)), min(int(match.group(2)), len(data) - 1)
+        if start >= len(data):
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{len(data)}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(206)
+        self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('ETag', f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"')
+        self.end_headers()
+        self.wfile.write(data[start : end + 1])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class NoRangeHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Ignores Range headers and answers with the whole file, as some static servers do
+    """
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(directory, handler):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), partial(handler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def write_pmtiles(path):
+    # Only the bytes are compared: random tiles of random sizes, every third one the same (deduplicated) content
+    rng = random.Random(0)
+    metadata = {'minzoom': '0', 'maxzoom': '8', 'bounds': '-180,-85,180,85', 'center': '0,0,0', 'format': 'png'}
+    with write(path) as writer:
+        for tile_id in range(TILE_COUNT):
+            writer.write_tile(tile_id, b'ocean' if tile_id % 3 == 0 else rng.randbytes(rng.randint(20, 200)))
+        writer.finalize(*mbtiles_to_header_json(metadata))
+
+
+@pytest.fixture(scope='module')
+def served(tmp_path_factory):
+    """
+    Directory of the served tiles.pmtiles and its base URL
+    """
+    directory = tmp_path_factory.mktemp('served')
+    write_pmtiles(str(directory / 'tiles.pmtiles'))
+    server, url = serve(str(directory), RangeHandler)
+    yield directory, url
+    server.shutdown()
+    server.server_close()
+
+
+def read_all_tiles(url, pmtiles, cache_dir=None):
+    """
+    Compare every tile read through RangeSource with the MmapSource of the file, returns the RangeSource
+    """
+    source = RangeSource(url, block_size=BLOCK_SIZE, cache_dir=cache_dir)
+    reader = Reader(source)
+    with open(pmtiles, 'rb') as f:
+        local = MmapSource(f)
+        local_reader = Reader(local)
+        assert reader.header() == local_reader.header()
+        assert reader.metadata() == local_reader.metadata()
+        assert reader.header()['leaf_directory_length'] > 0, 'the archive should have leaf directories'
+        count = 0
+        for (z, x, y), tile_data in all_tiles(local):
+            assert reader.get(z, x, y) == tile_data, f'tile {z}/{x}/{y} differs'
+            count += 1
+        assert count == TILE_COUNT
+        # Reads past the end of the archive are answered with 416
+        assert source(source.size + BLOCK_SIZE, 10) == b''
+    return source
+
+
+def test_tiles_match_mmap_source_and_cache_is_reused(served, tmp_path):
+    directory, url = served
+    url, pmtiles = f'{url}/tiles.pmtiles', str(directory / 'tiles.pmtiles')
+    cache_dir = str(tmp_path / 'cache')
+    first = read_all_tiles(url, pmtiles, cache_dir)
+    assert first.disk_hits == 0
+
+    # Same ETag: the blocks are read from the cache directory, only the first read goes to the server
+    requests = RangeHandler.requests
+    second = read_all_tiles(url, pmtiles, cache_dir)
+    assert second.info()['block_dir'] == first.info()['block_dir']
+    assert second.disk_hits > 0 and second.requests < first.requests, second.info()
+    assert RangeHandler.requests - requests == second.requests
+
+
+def test_missing_blocks_are_merged(served):
+    directory, url = served
+    source = RangeSource(f'{url}/tiles.pmtiles', block_size=BLOCK_SIZE, merge_gap=2)
+    # Five missing blocks in one read: one request
+    source(0, 5 * BLOCK_SIZE)
+    assert source.requests == 1, source.info()
+    # Blocks 7 and 10 are missing around the cached 8 and 9 (merge_gap=2): still one request
+    source(9 * BLOCK_SIZE, BLOCK_SIZE)
+    source(8 * BLOCK_SIZE, BLOCK_SIZE)
+    requests = source.requests
+    source(7 * BLOCK_SIZE, 4 * BLOCK_SIZE)
+    assert source.requests == requests + 1, source.info()
+    # Three cached blocks (19 to 21) are more than merge_gap: two requests, for 16 to 18 and 22 to 25
+    source(19 * BLOCK_SIZE, 3 * BLOCK_SIZE)
+    requests = source.requests
+    source(16 * BLOCK_SIZE, 10 * BLOCK_SIZE)
+    assert source.requests == requests + 2, source.info()
+
+
+def test_changed_file_raises(served):
+    directory, url = served
+    # A copy, so the ETag of the file read by the other tests does not change
+    shutil.copyfile(directory / 'tiles.pmtiles', directory / 'changed.pmtiles')
+    source = RangeSource(f'{url}/changed.pmtiles', block_size=BLOCK_SIZE)
+    source(0, 10)
+    os.utime(directory / 'changed.pmtiles', ns=(0, 0))
+    with pytest.raises(ValueError, match='changed while reading'):
+        source(10 * BLOCK_SIZE, 10)
+
+
+def test_server_without_range_raises(served):
+    directory, url = served
+    server, url = serve(str(directory), NoRangeHandler)
+    try:
+        source = RangeSource(f'{url}/tiles.pmtiles', block_size=BLOCK_SIZE)
+        with pytest.raises(ValueError, match='does not support HTTP Range requests'):
+            source(0, 10)
+    finally:
+        server.shutdown()
+        server.server_close()
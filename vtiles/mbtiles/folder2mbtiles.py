@@ -1,94 +1,89 @@
-import sqlite3, argparse, sys, logging, os, json
+import argparse, sys, logging, os, json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from vtiles.utils.geopreocessing import flip_y, check_vector
 from vtiles.mbtiles.mbtilesfixmeta import fix_rastermetadata, fix_vectormetadata,determine_tileformat
+from vtiles.utils.mbtileswriter import MBTilesWriter
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def mbtiles_connect(mbtiles_file):
-  try:
-    conn = sqlite3.connect(mbtiles_file)
-    return conn
-  except Exception as e:
-    logger.error("Could not connect to MBTiles file")
-    logger.exception(e)
-    sys.exit(1)
-
-def mbtiles_init(cur):
-  cur.execute("""
-    create table tiles (
-      zoom_level integer,
-      tile_column integer,
-      tile_row integer,
-      tile_data blob);
-      """)
-  cur.execute("""create unique index tile_index on tiles(zoom_level, tile_column, tile_row);""")
-
-def optimize_connection(cur):
-  cur.execute("""PRAGMA synchronous=0""")
-  # cur.execute("""PRAGMA locking_mode=EXCLUSIVE""")
-  cur.execute("""PRAGMA journal_mode=DELETE""")
-
-def import_metadata(input_mbtiles, metadata_json):
-  conn = sqlite3.connect(input_mbtiles)       
-  cur = conn.cursor()
-  cur.execute('CREATE TABLE metadata (name TEXT, value TEXT);')
-  cur.execute('CREATE UNIQUE INDEX name on metadata (name);')
-  for name, value in metadata_json.items():
-    cur.execute('insert into metadata (name, value) values (?, ?)',(name, value))
-  
-
-def get_dirs(path):
-  return [name for name in os.listdir(path)
-    if os.path.isdir(os.path.join(path, name))]
-
-def folder2mbtiles(input_folder, mbtiles_file, flipy=0):
-  # logger.debug("%s --> %s" % (input_folder, mbtiles_file))
-  con = mbtiles_connect(mbtiles_file)
-  cur = con.cursor()
-  optimize_connection(cur)
-  mbtiles_init(cur)  
-
-  with tqdm(desc="Coverting tiles", unit=" tiles") as pbar:
-    for zoom_dir in get_dirs(input_folder):   
-      z = int(zoom_dir)
-      for row_dir in get_dirs(os.path.join(input_folder, zoom_dir)):
-        x = int(row_dir)
-        for current_file in os.listdir(os.path.join(input_folder, zoom_dir, row_dir)):
-          if current_file == ".DS_Store":
+# Default settings
+FOLDER2MBTILES_READERS = min(32, (os.cpu_count() or 4) * 4)
+FOLDER2MBTILES_CHUNK_SIZE = 1024
+TILE_EXTENSIONS = ('.png','.jpg','.jpeg','.webp','.pbf','.mvt')
+
+def scan_dirs(path):
+  with os.scandir(path) as entries:
+    for entry in entries:
+      if entry.is_dir():
+        if entry.name.isdigit():
+          yield int(entry.name), entry.path
+        else:
+          logger.warning(f"The directory {entry.path} will be ignored.")
+
+def scan_tiles(input_folder, flipy=0):
+  """
+  Yield (zoom_level, tile_column, tile_row, file path) of every tile file, with one os.scandir per directory
+  """
+  for z, zoom_path in scan_dirs(input_folder):
+    for x, column_path in scan_dirs(zoom_path):
+      with os.scandir(column_path) as entries:
+        for entry in entries:
+          if entry.name == ".DS_Store":
             logger.warning("The .DS_Store file will be ignored.")
-          else:
-            # file_name, ext = current_file.split('.',1)
-            file_name, ext = os.path.splitext(current_file)       
-            if ext in ('.png','.jpg','.jpeg','.webp','.pbf','.mvt'):
-              f = open(os.path.join(input_folder, zoom_dir, row_dir, current_file), 'rb')
-              file_content = f.read()
-              f.close()
-              if flipy == 1:
-                y = flip_y(int(z), int(file_name))
-              else:
-                y = int(file_name)
-              logger.debug(' Read tile from Zoom (z): %i\tCol (x): %i\tRow (y): %i' % (z, x, y))
-              cur.execute("""insert into tiles (zoom_level,
-                  tile_column, tile_row, tile_data) values
-                  (?, ?, ?, ?);""",
-                  # (z, x, y, file_content))
-                  (z, x, y, sqlite3.Binary(file_content)))
-              pbar.update(1)
-
-  cur.close()
-  con.commit()
-  con.close()    
+            continue
+          file_name, ext = os.path.splitext(entry.name)
+          if ext in TILE_EXTENSIONS and file_name.isdigit():
+            y = flip_y(z, int(file_name)) if flipy == 1 else int(file_name)
+            yield (z, x, y, entry.path)
+
+def read_chunk(chunk):
+  tiles = []
+  for z, x, y, path in chunk:
+    with open(path, 'rb') as f:
+      tiles.append((z, x, y, f.read()))
+  return tiles
+
+def read_tiles(input_folder, flipy=0, readers=FOLDER2MBTILES_READERS, chunk_size=FOLDER2MBTILES_CHUNK_SIZE):
+  """
+  Yield (zoom_level, tile_column, tile_row, tile_data) of every tile file. Chunks of files are read by a pool of
+  threads while the folder is still being scanned, at most 2 * readers chunks are in flight.
+  """
+  if readers <= 1:
+    for tile in scan_tiles(input_folder, flipy):
+      yield from read_chunk([tile])
+    return
+
+  with ThreadPoolExecutor(max_workers=readers) as executor:
+    pending = deque()
+    chunk = []
+    for tile in scan_tiles(input_folder, flipy):
+      chunk.append(tile)
+      if len(chunk) >= chunk_size:
+        pending.append(executor.submit(read_chunk, chunk))
+        chunk = []
+        if len(pending) >= 2 * readers:
+          yield from pending.popleft().result()
+    if chunk:
+      pending.append(executor.submit(read_chunk, chunk))
+    while pending:
+      yield from pending.popleft().result()
+
+def folder2mbtiles(input_folder, mbtiles_file, flipy=0, dedup=False, readers=FOLDER2MBTILES_READERS):
+  # logger.debug("%s --> %s" % (input_folder, mbtiles_file))
+  metadata = os.path.join(input_folder, 'metadata.json')
+  with MBTilesWriter(mbtiles_file, dedup=dedup) as writer:
+    if os.path.exists(metadata):
+      writer.write_metadata(json.load(open(metadata, 'r')))
+      logger.info('Converting metadata done.') 
+    with tqdm(desc="Coverting tiles", unit=" tiles") as pbar:
+      writer.write_tiles(read_tiles(input_folder, flipy, readers), progress=pbar.update)
   logger.info('Converting Folder to MBTiles done.')
 
-  # converting or fixing metadata
-  metadata = os.path.join(input_folder, 'metadata.json')
-  if os.path.exists(metadata):
-    metadata_json = json.load(open(metadata, 'r'))
-    import_metadata(mbtiles_file, metadata_json)
-    logger.info('Converting metadata done.') 
-  else:
+  # fixing metadata
+  if not os.path.exists(metadata):
     is_vector, compression_type = check_vector(mbtiles_file) 
     tile_format = determine_tileformat(mbtiles_file)
     desc = 'MBtiles created by vtiles.mbtiles.folder2mbtiles and metadata updated by mbtilesfixmeta' 
@@ -104,6 +99,8 @@ def main():
   parser.add_argument('input', help='Input folder')
   parser.add_argument('-o','--output', default=None, help='Output mbtiles file name (optional)')
   parser.add_argument('-flipy', type=int, default=0,choices=[0, 1], help='TMS <--> XYZ tiling scheme (optional): 1 or 0, default is 0')
+  parser.add_argument('-dedup', action='store_true', help='Store identical tiles once, in the images/map layout (optional)')
+  parser.add_argument('-readers', type=int, default=FOLDER2MBTILES_READERS, help=f'Number of threads reading tile files (optional), default is {FOLDER2MBTILES_READERS}')
 
   args = parser.parse_args()
 
@@ -129,7 +126,7 @@ def main():
 
   # Inform the user of the conversion
   logging.info(f'Converting {input_folder_abspath} to {output_file_abspath}.') 
-  folder2mbtiles(input_folder_abspath, output_file_abspath, args.flipy)
+  folder2mbtiles(input_folder_abspath, output_file_abspath, args.flipy, args.dedup, args.readers)
 
 if __name__ == "__main__":
   main()
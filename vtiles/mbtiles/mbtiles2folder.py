@@ -4,11 +4,18 @@ import sqlite3
 import json
 import argparse
 from tqdm import tqdm
-from vtiles.utils.geopreocessing import flip_y, safe_makedir,determine_tileformat
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from vtiles.utils.geopreocessing import flip_y, determine_tileformat
+from vtiles.utils.codec import load_dictionary, without_dictionary, DICTIONARY_METADATA
 
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 logger = logging.getLogger(__name__)
 
+# Default settings
+MBTILES2FOLDER_WORKERS = min(32, (os.cpu_count() or 4) * 4)
+MBTILES2FOLDER_CHUNK_SIZE = 1000
+
 def extract_metadata(mbtiles):
     """Extract metadata from MBTiles file."""
     try:
@@ -42,7 +49,35 @@ def get_max_zoom(mbtiles):
         cursor.close()
         conn.close()
 
-def convert_mbtiles_to_folder(mbtiles, output_folder, flipy, min_zoom=0, max_zoom=None):
+def write_tiles(tiles, skip_existing=False):
+    """
+    Write a chunk of (tile_path, tile_data), returns the number of tiles written and skipped
+    """
+    written = skipped = 0
+    for tile_path, tile_data in tiles:
+        if skip_existing:
+            try:
+                if os.stat(tile_path).st_size == len(tile_data):
+                    skipped += 1
+                    continue
+            except FileNotFoundError:
+                pass
+        try:
+            with open(tile_path, 'wb') as tile_file:
+                tile_file.write(tile_data)
+            written += 1
+        except Exception as e:
+            logging.error(f"Error writing tile at {tile_path}: {e}")
+    return written, skipped
+
+def convert_mbtiles_to_folder(mbtiles, output_folder, flipy, min_zoom=0, max_zoom=None, workers=MBTILES2FOLDER_WORKERS,
+                              chunk_size=MBTILES2FOLDER_CHUNK_SIZE, skip_existing=False):
+    """
+    Tiles are read in chunks ordered by zoom_level and tile_column, so each column directory is created once, and the
+    files are written by a pool of worker threads, with at most 2 * workers chunks in memory.
+    With skip_existing, tiles whose file already exists with the same size are not written again, which resumes an
+    interrupted export.
+    """
     conn = sqlite3.connect(mbtiles)
     cursor = conn.cursor()
     
@@ -52,30 +87,57 @@ def convert_mbtiles_to_folder(mbtiles, output_folder, flipy, min_zoom=0, max_zoo
     max_zoom = max_zoom if max_zoom is not None and max_zoom <= mbtiles_max_zoom else mbtiles_max_zoom
 
     metadata = extract_metadata(mbtiles)
+    # Tiles compressed with the zstd dictionary of the MBTiles are written recompressed with gzip, files are served
+    # as they are to clients which do not have the dictionary
+    dictionary = load_dictionary(metadata)
+    if dictionary is not None:
+        metadata.pop(DICTIONARY_METADATA)
+        metadata['compression'] = 'gzip'
     if metadata:
         write_metadata_to_json(metadata, output_folder)
-    
-    cursor.execute('SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles WHERE zoom_level BETWEEN ? AND ? ORDER BY zoom_level', (min_zoom, max_zoom))
-    tiles = cursor.fetchall()
-
-    for zoom, col, row, tile_data in tqdm(tiles, unit=' tiles ', desc='Processing tiles'):
-        # Flip the Y coordinate if flipy is True
-        y = flip_y(zoom, row) if flipy else row
-
-        # Construct the directory path
-        tile_dir = os.path.join(output_folder, str(zoom), str(col))
-        safe_makedir(tile_dir)
-
-        # Construct the file path
-        tile_path = os.path.join(tile_dir, f'{y}.{tile_format}')
-
-        # Write the tile data to the file
-        try:
-            with open(tile_path, 'wb') as tile_file:
-                tile_file.write(tile_data)
-        except Exception as e:
-            print(f"Error writing tile at {tile_path}: {e}")
 
+    cursor.execute('SELECT COUNT(*) FROM tiles WHERE zoom_level BETWEEN ? AND ?', (min_zoom, max_zoom))
+    total = cursor.fetchone()[0]
+    cursor.execute('SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles WHERE zoom_level BETWEEN ? AND ? ORDER BY zoom_level, tile_column', (min_zoom, max_zoom))
+
+    workers = max(int(workers), 1)
+    written = skipped = 0
+    column = None
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            tqdm(total=total, unit=' tiles ', desc='Processing tiles') as pbar:
+
+        def collect(future):
+            nonlocal written, skipped
+            chunk_written, chunk_skipped = future.result()
+            written += chunk_written
+            skipped += chunk_skipped
+            pbar.update(chunk_written + chunk_skipped)
+
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            tiles = []
+            for zoom, col, row, tile_data in rows:
+                if (zoom, col) != column:
+                    # Rows come ordered by column: create its directory once
+                    column = (zoom, col)
+                    tile_dir = os.path.join(output_folder, str(zoom), str(col))
+                    os.makedirs(tile_dir, exist_ok=True)
+                # Flip the Y coordinate if flipy is True
+                y = flip_y(zoom, row) if flipy else row
+                if dictionary is not None:
+                    tile_data = without_dictionary(tile_data, dictionary=dictionary)
+                tiles.append((os.path.join(tile_dir, f'{y}.{tile_format}'), tile_data))
+            pending.append(executor.submit(write_tiles, tiles, skip_existing))
+            if len(pending) >= 2 * workers:
+                collect(pending.popleft())
+        while pending:
+            collect(pending.popleft())
+
+    if skip_existing:
+        logging.info(f'{written} tiles written, {skipped} existing tiles skipped.')
     logging.info('Converting MBTiles to folder done!')
     
     cursor.close()
@@ -88,6 +150,8 @@ def main():
     parser.add_argument('-flipy', type=int, default=0, choices=[0, 1], help='TMS <--> XYZ tiling scheme (optional): 1 or 0, default is 0')
     parser.add_argument('-minzoom', type=int, default=0, help='Min zoom to export (optional, default is 0)')
     parser.add_argument('-maxzoom', type=int, default=None, help='Max zoom to export (optional, default is the maxzoom of the input MBTiles)')
+    parser.add_argument('-workers', type=int, default=MBTILES2FOLDER_WORKERS, help=f'Number of threads writing tile files (optional, default is {MBTILES2FOLDER_WORKERS})')
+    parser.add_argument('--skip-existing', action='store_true', help='Resume an interrupted export into an existing folder: tiles already written with the same size are skipped')
 
     args = parser.parse_args()
 
@@ -105,13 +169,14 @@ def main():
     # Create output folder if it doesn't exist
     if not os.path.exists(output_folder_abspath):
         os.makedirs(output_folder_abspath)
-    else:         
+    elif not args.skip_existing:
         logging.error(f'Output folder {output_folder_abspath} already existed. Please provide a valid folder with -o.')
         sys.exit(1)
 
     # Inform the user of the conversion
     logging.info(f'Converting {input_filename_abspath} to {output_folder_abspath} folder.')
-    convert_mbtiles_to_folder(input_filename_abspath, output_folder_abspath, args.flipy, args.minzoom, args.maxzoom)
+    convert_mbtiles_to_folder(input_filename_abspath, output_folder_abspath, args.flipy, args.minzoom, args.maxzoom,
+                              args.workers, skip_existing=args.skip_existing)
 
 if __name__ == "__main__":
     main()
@@ -3,8 +3,7 @@ import argparse
 import sqlite3
 import argparse, sys, os
 from vtiles.utils.vt2geojson.tools import vt_bytes_to_geojson
-import gzip
-import zlib
+from vtiles.utils.codec import decode
 import logging
 from tqdm import tqdm
 from vtiles.utils.geopreocessing import check_vector
@@ -32,13 +31,9 @@ def tile_data_to_geojson(tile_data, x, y, z, layers):
         logging.error(f"Error converting tile data to GeoJSON at tile ({x}, {y}, {z}): {e}")
         return None
 
-def decompress_tile_data(tile_data):  
+def decompress_tile_data(tile_data, codec=None):  
     try:
-        if tile_data[:2] == b'\x1f\x8b':  # Check for gzip magic number
-            return gzip.decompress(tile_data)
-        elif tile_data[:2] in {b'\x78\x9c', b'\x78\x01', b'\x78\xda'}:
-            return zlib.decompress(tile_data)
-        return tile_data
+        return decode(tile_data, codec)
     except Exception as e:
         logging.error(f"Failed to decompress tile data: {e}")
         return tile_data
@@ -61,7 +56,7 @@ def mbtiles_to_geojson(input_mbtiles, output_geojson, compression_type, zoom_lev
     Args:
         input_mbtiles (str): Path to the input MBTiles file.
         output_geojson (str): Path to the output GeoJSON file.
-        compression_type (str): Compression type (GZIP or ZLIB).
+        compression_type (str): Compression type (GZIP, ZLIB, BROTLI or ZSTD).
         zoom_level (int): The zoom level of tiles to extract.
         flip_y (bool): Whether to flip the y coordinate (TMS format).
         layers (list): List of layer names to include in the output.
@@ -93,8 +88,8 @@ def mbtiles_to_geojson(input_mbtiles, output_geojson, compression_type, zoom_lev
                     if flip_y:
                         y = (1 << zoom_level) - 1 - y
 
-                    if compression_type == 'GZIP' or compression_type == 'ZLIB':
-                        tile_data = decompress_tile_data(tile_data)
+                    if compression_type:
+                        tile_data = decompress_tile_data(tile_data, compression_type)
 
                     features = tile_data_to_geojson(tile_data, x, y, zoom_level, layers)
                     if features:
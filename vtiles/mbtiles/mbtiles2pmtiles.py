@@ -1,114 +1,48 @@
 import argparse, sys, os
-import gzip
-from vtiles.utils.pmtiles.writer import write
-from vtiles.utils.pmtiles.tile import TileType, zxy_to_tileid, tileid_to_zxy, Compression
+from vtiles.utils.pmtiles.convert import mbtiles_to_pmtiles as convert_mbtiles_to_pmtiles
 import sqlite3
 from tqdm import tqdm
 import logging
 
 from vtiles.utils.geopreocessing import check_vector, determine_tileformat
+from vtiles.utils.codec import get_codec, PMTILES_CODEC_NAMES
+from vtiles.utils.checkpoint import CheckpointError
 from vtiles.mbtiles.mbtilesfixmeta import fix_rastermetadata, fix_vectormetadata
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def mbtiles_to_header_json(mbtiles_metadata):
-    header = {}
-
-    header["min_zoom"] = int(mbtiles_metadata["minzoom"])
-
-    header["max_zoom"] = int(mbtiles_metadata["maxzoom"])
-
-    bounds = mbtiles_metadata["bounds"].split(",")
-    header["min_lon_e7"] = int(float(bounds[0]) * 10000000)
-    header["min_lat_e7"] = int(float(bounds[1]) * 10000000)
-    header["max_lon_e7"] = int(float(bounds[2]) * 10000000)
-    header["max_lat_e7"] = int(float(bounds[3]) * 10000000)
-
-    center = mbtiles_metadata["center"].split(",")
-    header["center_lon_e7"] = int(float(center[0]) * 10000000)
-    header["center_lat_e7"] = int(float(center[1]) * 10000000)
-    header["center_zoom"] = int(center[2])
-
-    tile_format = mbtiles_metadata["format"]
-    if tile_format == "pbf":
-        header["tile_type"] = TileType.MVT
-    elif tile_format == "png":
-        header["tile_type"] = TileType.PNG
-    elif tile_format == "jpeg":
-        header["tile_type"] = TileType.JPEG
-    elif tile_format == "webp":
-        header["tile_type"] = TileType.WEBP
-    elif tile_format == "avif":
-        header["tile_type"] = TileType.AVIF
-    else:
-        header["tile_type"] = TileType.UNKNOWN
-
-    if tile_format == "pbf" or mbtiles_metadata.get("compression") == "gzip":
-        header["tile_compression"] = Compression.GZIP
-    else:
-        header["tile_compression"] = Compression.NONE
-
-    return header, mbtiles_metadata
-
-def mbtiles_to_pmtiles(input, output):
-    try: 
-        conn = sqlite3.connect(input)
-        cursor = conn.cursor()
-        with write(output) as writer:
-            # collect a set of all tile IDs
-            tileid_set = []
-            # for row in cursor.execute(
-            #     "SELECT zoom_level,tile_column,tile_row FROM tiles WHERE zoom_level <= ?",
-            #     (maxzoom or 99,),
-            # ):
-            for row in cursor.execute(
-                "SELECT zoom_level,tile_column,tile_row FROM tiles"
-            ):
-                flipped = (1 << row[0]) - 1 - row[2]
-                tileid_set.append(zxy_to_tileid(row[0], row[1], flipped))
-
-            tileid_set.sort()
-
-            mbtiles_metadata = {}
-            for row in cursor.execute("SELECT name,value FROM metadata"):
-                mbtiles_metadata[row[0]] = row[1]
-            is_pbf = mbtiles_metadata["format"] == "pbf"
-
-            # query the db in ascending tile order
-            for tileid in tqdm(tileid_set, desc="Converting tiles"):
-                z, x, y = tileid_to_zxy(tileid)
-                flipped = (1 << z) - 1 - y
-                res = cursor.execute(
-                    "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
-                    (z, x, flipped),
-                )
-                data = res.fetchone()[0]
-                # force gzip compression only for vector
-                if is_pbf and data[0:2] != b"\x1f\x8b":
-                    data = gzip.compress(data)
-                writer.write_tile(tileid, data)
-
-            pmtiles_header, pmtiles_metadata = mbtiles_to_header_json(mbtiles_metadata)
-            # if maxzoom:
-            #     pmtiles_header["max_zoom"] = int(maxzoom)
-            #     mbtiles_metadata["maxzoom"] = maxzoom
-            writer.finalize(pmtiles_header, pmtiles_metadata)
-        
+def mbtiles_to_pmtiles(input, output, dedup_max_size=None, resume=False, codec='gzip'):
+    try:
+        stats = convert_mbtiles_to_pmtiles(input, output, progress=tqdm, dedup_max_size=dedup_max_size, resume=resume,
+                                           codec=codec)
+        if stats is None:
+            logging.info(f"{output} is already complete, nothing to resume.")
+            return
         logging.info(f"Converting MBTiles to PMTile done!")
-        cursor.close()
-        conn.close()
+        logging.info(f"{stats['addressed_tiles']} tiles, {stats['tile_contents']} unique contents, "
+                     f"dedup ratio {stats['dedup_ratio']:.2f}, {stats['bytes_saved']} bytes saved.")
+    except CheckpointError as e:
+        logging.error(f"Cannot resume {output}: {e}")
+        logging.error(f"Run without --resume to convert {input} again.")
+        sys.exit(1)
     except sqlite3.Error as e:
         logging.error(f"Failed to read MBTiles file {input}: {e}")
+        sys.exit(1)
     except Exception as e:
         logging.error(f"Failed to convert {input} to PMTiles: {e}")
+        logging.error(f"Run again with --resume to continue from the last checkpoint.")
+        sys.exit(1)
 
 
 def main():
     parser = argparse.ArgumentParser(description='Convert MBTiles to PMTiles.')
     parser.add_argument('input', help='Path to the input MBTiles file.')
     parser.add_argument('-o', '--output', help='Path to the output PMTiles file.')
+    parser.add_argument('--resume', action='store_true', help='Continue an interrupted conversion from its checkpoint (kept in <output>.work).')
+    parser.add_argument('-c', '--codec', default='gzip', choices=['none'] + PMTILES_CODEC_NAMES, help='Compression of the vector tiles in the PMTiles (default: gzip).')
+    parser.add_argument('--dedup-max-size', type=int, default=None, help='Only deduplicate tiles up to this size in bytes, which bounds the memory used for deduplication (default: 1024, 0: no deduplication).')
     
     args = parser.parse_args()
     if not os.path.exists(args.input):
@@ -119,7 +53,7 @@ def main():
     # Determine the output filename
     if args.output:
         output_file_abspath = os.path.abspath(args.output)
-        if os.path.exists(output_file_abspath):
+        if os.path.exists(output_file_abspath) and not args.resume:
             logger.error(f'Output PMTiles  {output_file_abspath} already exists!. Please recheck and input a correct one. Ex: -o tiles.pmtiles')
             sys.exit(1)
         elif not output_file_abspath.endswith('pmtiles'):
@@ -129,10 +63,17 @@ def main():
         output_file_name = os.path.basename(input_file_abspath).replace('.mbtiles', '.pmtiles')
         output_file_abspath = os.path.join(os.path.dirname(input_file_abspath), output_file_name)
  
-        if os.path.exists(output_file_abspath): 
+        if os.path.exists(output_file_abspath) and not args.resume: 
             logger.error(f'Output PMTiles  {output_file_abspath} already exists! Please recheck and input a correct one. Ex: -o tiles.pmtiles')
             sys.exit(1)          
 
+    if args.codec != 'none':
+        try:
+            get_codec(args.codec).check()
+        except ValueError as e:
+            logger.error(e)
+            sys.exit(1)
+
     is_vector, compression_type = check_vector(input_file_abspath) 
     tile_format = determine_tileformat(input_file_abspath)
     desc = 'Update metadata by vtiles.mbtiles.fixmeta' 
@@ -142,7 +83,7 @@ def main():
         fix_rastermetadata(input_file_abspath, tile_format,desc)        
 
     logging.info(f'Converting {input_file_abspath} to {output_file_abspath}.')
-    mbtiles_to_pmtiles(input_file_abspath, output_file_abspath)
+    mbtiles_to_pmtiles(input_file_abspath, output_file_abspath, args.dedup_max_size, args.resume, args.codec)
 
 if __name__ == "__main__":
     main()
@@ -13,9 +13,14 @@ from urllib.parse import urlparse
 import boto3
 import click
 
+from vtiles.utils.codec import content_encoding, without_dictionary, DICTIONARY_METADATA
+from vtiles.utils.geopreocessing import get_tile_codec, get_tile_dictionary
+from vtiles.utils.checkpoint import FileCheckpoint, CheckpointError, checkpoint_signature, after_key, TILE_KEY_ORDER
+
 # import utils
 
 upload_progress_interval = 100
+checkpoint_interval = 1000
 tile_count = 0
 upload_count = 0
 
@@ -23,17 +28,20 @@ upload_count = 0
 class MBTilesGenerator(object):
     """Generator that returns tiles from an mbtiles file"""
 
-    def __init__(self, mbtiles):
+    def __init__(self, mbtiles, start=None):
         super(MBTilesGenerator, self).__init__()
         self.db = sqlite3.connect(mbtiles)
         self.cursor = self.db.cursor()
+        # Tiles after start (zoom_level, tile_column, tile_row), in a stable order so uploads can be resumed
+        self.condition, self.params = after_key(start)
         self.cursor.execute(
-            "SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles order by zoom_level"
+            f"SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles WHERE {self.condition} {TILE_KEY_ORDER}",
+            self.params,
         )
 
     def len(self):
         c = self.db.cursor()
-        c.execute("SELECT count(1) from tiles")
+        c.execute(f"SELECT count(1) from tiles WHERE {self.condition}", self.params)
         return c.fetchone()[0]
 
     def __iter__(self):
@@ -61,6 +69,9 @@ def get_tile_json(mbtiles, bucket, key_template):
         if key == "json":
             data = json.loads(value)
             tilejson.update(data)
+        elif key == DICTIONARY_METADATA:
+            # Tiles compressed with the dictionary are uploaded recompressed with gzip
+            tilejson["compression"] = "gzip"
         else:
             if key in ("center", "bounds"):
                 value = [float(s) for s in value.split(",")]
@@ -71,26 +82,30 @@ def get_tile_json(mbtiles, bucket, key_template):
 
 
 def upload_tile(
-    s3, bucket, key_template, headers, tile_stuff, progress=True, retries=0
+    s3, bucket, key_template, headers, tile_stuff, progress=True, retries=0, tile_codec=None
 ):
     try:
         zoom, x, y, tile = tile_stuff
+        # Clients do not have the zstd dictionary of the archive
+        tile = without_dictionary(tile, tile_codec)
         s3.put_object(
             Body=tile,
             Bucket=bucket,
             Key=key_template.format(z=zoom, x=x, y=y),
             ContentType=headers.get("Content-Type", ""),
-            ContentEncoding=headers.get("Content-Encoding", ""),
+            # Content-Encoding of the tile codec unless given with --header
+            ContentEncoding=headers.get("Content-Encoding") or content_encoding(tile, tile_codec) or "",
             CacheControl=headers.get("Cache-Control", ""),
         )
         global upload_count
         upload_count += 1
         if progress and upload_count % upload_progress_interval == 0:
             print("%i/%i" % (upload_count, tile_count))
+        return zoom, x, y
     except Exception as e:
         logging.error(str(e))
         if retries < 2:
-            upload_tile(
+            return upload_tile(
                 s3,
                 bucket,
                 key_template,
@@ -98,6 +113,7 @@ def upload_tile(
                 tile_stuff,
                 progress=progress,
                 retries=retries + 1,
+                tile_codec=tile_codec,
             )
         else:
             raise Exception("Too Many upload failures")
@@ -113,14 +129,20 @@ def upload_tile(
     "--progress", "-p", default=False, is_flag=True, help="Show upload progress"
 )
 @click.option("--debug", "-d", default=False, help="Debug level logging", is_flag=True)
+@click.option(
+    "--resume", default=False, is_flag=True, help="Continue an interrupted upload from its checkpoint"
+)
 
-def main(mbtiles, s3_url, threads, extension, header, progress, debug):
+def main(mbtiles, s3_url, threads, extension, header, progress, debug, resume):
     """Upload tiles from an MBTiles file to S3.
 
     \b
     PARAMS:
         mbtiles: Path to an MBTiles file
         s3_url: url to an s3 bucket to upload tiles to
+
+    Every 1000 tiles, the last tile uploaded with all the tiles before it is saved in MBTILES.s3-checkpoint,
+    --resume continues the upload after it.
     """
     logging.basicConfig(level=logging.DEBUG if debug else logging.INFO)
     logging.getLogger("botocore.credentials").setLevel(logging.getLevelName("ERROR"))
@@ -146,7 +168,6 @@ def main(mbtiles, s3_url, threads, extension, header, progress, debug):
     if extension == ".pbf" or extension == ".mvt":
         headers.update(
             {
-                "Content-Encoding": "gzip",
                 "Content-Type": "application/vnd.mapbox-vector-tile",
                 "Content-Type": "application/x-protobuf",
             }
@@ -158,15 +179,37 @@ def main(mbtiles, s3_url, threads, extension, header, progress, debug):
     elif extension == ".jpg" or extension == ".jpeg":
         headers.update({"Content-Type": "image/jpeg"})
 
-    tiles = MBTilesGenerator(mbtiles)
+    checkpoint = FileCheckpoint(
+        os.path.abspath(mbtiles) + ".s3-checkpoint",
+        checkpoint_signature([mbtiles], task="mbtiles2s3", s3_url=s3_url, extension=extension),
+    )
+    state = None
+    if resume:
+        try:
+            state = checkpoint.load()
+        except CheckpointError as e:
+            raise click.ClickException(str(e))
+    if state is None:
+        state = {"key": None}
+        checkpoint.start(state)
+    else:
+        logging.info(f"resuming the upload after tile {state['key']}")
+
+    tiles = MBTilesGenerator(mbtiles, state["key"])
     global tile_count
     tile_count = tiles.len()
 
     key_template = key_prefix + "/{z}/{x}/{y}" + extension
     logging.info(f"uploading tiles from {mbtiles} to s3://{bucket}/{key_template}")
     pool = ThreadPool(threads)
-    func = partial(upload_tile, s3, bucket, key_template, headers, progress=progress)
-    pool.map(func, tiles)
+    get_tile_dictionary(tiles.db.cursor())
+    func = partial(upload_tile, s3, bucket, key_template, headers, progress=progress, tile_codec=get_tile_codec(tiles.db.cursor()))
+    # imap returns the results in order: once a tile is returned, all the tiles before it are uploaded too
+    for count, (zoom, x, y) in enumerate(pool.imap(func, tiles, chunksize=16), 1):
+        if count % checkpoint_interval == 0:
+            state["key"] = [zoom, x, (1 << zoom) - 1 - y]
+            checkpoint.save(state)
+    pool.close()
 
     tilejson_key = "{}/tile.json".format(key_prefix.strip("/"))
     logging.info(f"uploading tile.json to s3://{bucket}/{tilejson_key}")
@@ -178,6 +221,7 @@ def main(mbtiles, s3_url, threads, extension, header, progress, debug):
         Key=tilejson_key,
         ContentType="application/json",
     )
+    checkpoint.clear()
 
 
 if __name__ == "__main__":
@@ -1,115 +1,251 @@
 import argparse, sys, os
+import re
 import sqlite3
-import gzip, zlib
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from tqdm import tqdm
 import logging
-import shutil
-from vtiles.utils.geopreocessing import check_vector
+from vtiles.utils.geopreocessing import check_vector, get_tile_codec, get_tile_dictionary
+from vtiles.utils.codec import recode, get_codec, codec_name, dictionary_metadata, CODEC_NAMES, DICTIONARY_METADATA
+from vtiles.utils.checkpoint import MBTilesCheckpoint, CheckpointError, checkpoint_signature, after_key, TILE_KEY_ORDER, \
+    CHECKPOINT_TABLE
+from vtiles.utils.mbtileswriter import METADATA_SCHEMA, TILES_SCHEMA, TILES_INDEX
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def compress_tile_data(tile_data):
-    try: 
-        if tile_data[:2] != b'\x1f\x8b':  # check if not GZIP    
-            if tile_data[:2] == b'\x78\x9c' or tile_data[:2] == b'\x78\x01' or tile_data[:2] == b'\x78\xda': # Check if ZLIB
-                tile_data = zlib.decompress(tile_data)           
-            tile_data = gzip.compress(tile_data)
-    except Exception as e:
-        logger.error(f"Failed to compress tile data: {e}")
-        return tile_data
-    return tile_data          
-
-def compress_mbtiles(input_mbtiles, output_mbtiles, batch_size=10000):
-    shutil.copyfile(input_mbtiles, output_mbtiles)
-    
-    # Open the copied MBTiles file
+# Default settings
+MBTILESCOMPRESS_WORKERS = os.cpu_count() or 1
+MBTILESCOMPRESS_CHUNK_SIZE = 1000
+MBTILESCOMPRESS_CODEC = 'gzip'
+
+def compress_tile_data(tile_data, codec=MBTILESCOMPRESS_CODEC, level=None, dictionary=None, source_codec=None,
+                       source_dictionary=None):
+    # Tiles compressed with another codec (or dictionary) are decompressed first, tiles already compressed with
+    # codec and dictionary are kept unless a level is given. Errors are left to transform_chunk, which drops the tile:
+    # keeping its bytes would mix codecs under the declared compression
+    return recode(tile_data, codec, level, dictionary, source_codec, source_dictionary)
+
+def transform_chunk(transform, chunk):
+    """
+    Run in the worker processes: apply transform to the tile_data of a chunk of tiles.
+    Returns the transformed tiles and the errors of the tiles that were dropped.
+    """
+    tiles, errors = [], []
+    for zoom_level, tile_column, tile_row, tile_data in chunk:
+        try:
+            tiles.append((zoom_level, tile_column, tile_row, transform(tile_data)))
+        except Exception as e:
+            errors.append(f"Error processing tile {zoom_level}/{tile_column}/{tile_row}: {e}")
+    return tiles, errors
+
+def read_chunks(cursor, start, chunk_size):
+    condition, params = after_key(start)
+    cursor.execute(
+        f"SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles WHERE {condition} {TILE_KEY_ORDER}", params
+    )
+    while True:
+        chunk = cursor.fetchmany(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+def copy_auxiliary_tables(conn_in, conn):
+    """
+    Copy the tables and views of the input that are not its tiles (UTFGrid grids and grid_data, custom tables), with
+    their indexes and triggers. The images table of a deduplicated input is left out, its map table is only kept
+    when a copied view still reads it.
+    """
+    skipped = {'metadata', 'tiles', 'images', CHECKPOINT_TABLE}
+    schema = conn_in.execute(
+        "SELECT type, name, tbl_name, sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'"
+    ).fetchall()
+    views = [(name, sql) for kind, name, table, sql in schema if kind == 'view' and name not in skipped]
+    if not any(re.search(r'\bmap\b', sql, re.IGNORECASE) for name, sql in views):
+        skipped.add('map')
+    tables = [(name, sql) for kind, name, table, sql in schema if kind == 'table' and name not in skipped]
+    copied = {name for name, sql in tables}
+    for name, sql in tables:
+        conn.execute(sql)
+        cursor = conn_in.execute(f'SELECT * FROM "{name}"')
+        placeholders = ', '.join('?' * len(cursor.description))
+        conn.executemany(f'INSERT INTO "{name}" VALUES ({placeholders})', cursor)
+    for kind, name, table, sql in schema:
+        if kind in ('index', 'trigger') and table in copied:
+            conn.execute(sql)
+    for name, sql in views:
+        conn.execute(sql)
+
+def create_output(input_mbtiles, output_mbtiles, checkpoint_args, metadata=None):
+    """
+    Create output_mbtiles with the metadata and auxiliary tables of input_mbtiles (metadata updated with metadata),
+    an empty indexed tiles table and a checkpoint. It is built as output_mbtiles.tmp and renamed once the checkpoint is committed: an existing output
+    without checkpoint is complete.
+    """
+    tmp_mbtiles = output_mbtiles + '.tmp'
+    if os.path.exists(tmp_mbtiles):
+        os.remove(tmp_mbtiles)
+    conn = sqlite3.connect(tmp_mbtiles)
+    # Tiles are inserted in key order, maintaining the index while writing them is cheap
+    for statement in METADATA_SCHEMA + TILES_SCHEMA + [TILES_INDEX]:
+        conn.execute(statement)
+    conn_in = sqlite3.connect(f"file:{input_mbtiles}?mode=ro", uri=True)
+    conn.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+                     conn_in.execute("SELECT name, value FROM metadata").fetchall())
+    copy_auxiliary_tables(conn_in, conn)
+    conn_in.close()
+    if metadata:
+        # None removes a metadata entry
+        conn.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+                         [(name, value) for name, value in metadata.items() if value is not None])
+        conn.executemany("DELETE FROM metadata WHERE name = ?", [(name,) for name, value in metadata.items() if value is None])
+    state = {'key': None}
+    MBTilesCheckpoint(conn, checkpoint_args).start(state)
+    conn.commit()
+    conn.close()
+    os.replace(tmp_mbtiles, output_mbtiles)
+    return state
+
+def rewrite_tiles(input_mbtiles, output_mbtiles, transform, task, desc, workers=MBTILESCOMPRESS_WORKERS,
+                  chunk_size=MBTILESCOMPRESS_CHUNK_SIZE, resume=False, metadata=None, **options):
+    """
+    Write output_mbtiles with the metadata of input_mbtiles (updated with metadata, None values are removed) and every
+    tile_data replaced by transform(tile_data).
+    The input (tiles table or view) is read in (zoom_level, tile_column, tile_row) order in chunks of chunk_size
+    tiles, transformed in a pool of worker processes (transform must be picklable) and written in the same order
+    into a fresh tiles table with executemany. The unique index exists from the start, so duplicate keys in the input
+    (see mbtilesdelduplicate) keep the last tile instead of failing once every tile is written.
+    Each chunk is committed together with a checkpoint holding its last tile, so with resume an interrupted run
+    continues after it. options are the transform settings recorded in the checkpoint.
+    Returns the number of tiles, the bytes read and written and the elapsed seconds, or None if resume finds the
+    output already complete.
+    """
+    checkpoint_args = checkpoint_signature([input_mbtiles], task=task, metadata=metadata, **options)
+    state = None
+    if resume and os.path.exists(output_mbtiles):
+        conn = sqlite3.connect(output_mbtiles)
+        try:
+            state = MBTilesCheckpoint(conn, checkpoint_args).load()
+        except CheckpointError as e:
+            logger.error(f"Cannot resume {output_mbtiles}: {e}")
+            logger.error(f"Run without --resume to write {output_mbtiles} again.")
+            sys.exit(1)
+        finally:
+            conn.close()
+        if state is None:
+            logger.info(f"{output_mbtiles} is already complete, nothing to resume.")
+            return None
+        logger.info(f"Resuming {output_mbtiles} after tile {state['key']}.")
+    if state is None:
+        state = create_output(input_mbtiles, output_mbtiles, checkpoint_args, metadata)
+
     conn = sqlite3.connect(output_mbtiles)
-    cursor = conn.cursor()
-
-    # Check if the tiles table is a view
-    cursor.execute("SELECT type FROM sqlite_master WHERE name='tiles'")
-    result = cursor.fetchone()
-
-    def process_tiles(tiles):
-        batch = []
-        for zoom_level, tile_column, tile_row, tile_data in tiles:
-            try:
-                compressed_tile = compress_tile_data(tile_data)
-                batch.append((compressed_tile, zoom_level, tile_column, tile_row))
-            except Exception as e:
-                logger.error(f"Error compressing tile {zoom_level}/{tile_column}/{tile_row}: {e}")
-            # Commit batch once it reaches the batch_size
-            if len(batch) >= batch_size:
-                cursor.executemany(
-                    "UPDATE tiles SET tile_data = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
-                    batch
-                )
-                conn.commit()  # Commit batch
-                batch.clear()  # Clear batch
-
-        # Commit any remaining tiles in the batch
-        if batch:
-            cursor.executemany(
-                "UPDATE tiles SET tile_data = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
-                batch
-            )
-            conn.commit()
-
-    if result and result[0] == 'view':
-        # Create a new table named tiles_new
-        cursor.execute("CREATE TABLE tiles_new (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
-        
-        # Select data from the view
-        cursor.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles order by zoom_level")
-        tiles = cursor.fetchall()
-        
-        batch = []
-        for zoom_level, tile_column, tile_row, tile_data in tqdm(tiles, desc="Compressing tiles", unit="tile"):
-            try:
-                compressed_tile = compress_tile_data(tile_data)
-                batch.append((zoom_level, tile_column, tile_row, compressed_tile))
-            except Exception as e:
-                logger.error(f"Error compressing tile {zoom_level}/{tile_column}/{tile_row}: {e}")
-            
-            # Insert in batches
-            if len(batch) >= batch_size:
-                cursor.executemany(
-                    "INSERT INTO tiles_new (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
-                    batch
-                )
-                conn.commit()  # Commit batch
-                batch.clear()  # Clear batch
-
-        # Commit remaining tiles in the batch
-        if batch:
-            cursor.executemany(
-                "INSERT INTO tiles_new (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
-                batch
-            )
-            conn.commit()
-
-        # Drop the view and rename the new table to tiles
-        cursor.execute("DROP VIEW tiles")
-        cursor.execute("ALTER TABLE tiles_new RENAME TO tiles")
-        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)")
-    
-    else:
-        # Decompress tile data in the existing tiles table
-        cursor.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles order by zoom_level")
-        tiles = cursor.fetchall()
-        
-        # Process the tiles in batches
-        process_tiles(tqdm(tiles, desc="Compressing tiles", unit="tile"))
-    
-    # Commit and close connections
+    # WAL makes the commit of every chunk cheap, the output is switched back to a single file at the end
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    checkpoint = MBTilesCheckpoint(conn, checkpoint_args)
+    conn_in = sqlite3.connect(f"file:{input_mbtiles}?mode=ro", uri=True)
+    cursor_in = conn_in.cursor()
+    condition, params = after_key(state['key'])
+    total = cursor_in.execute(f"SELECT COUNT(*) FROM tiles WHERE {condition}", params).fetchone()[0]
+
+    stats = {'tiles': 0, 'dropped': 0, 'bytes_in': 0, 'bytes_out': 0}
+    def write(chunk, result):
+        tiles, errors = result
+        for error in errors:
+            logger.error(error)
+        conn.executemany("INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)", tiles)
+        state['key'] = list(chunk[-1][:3])
+        checkpoint.save(state)
+        conn.commit()  # Commit chunk and checkpoint
+        stats['tiles'] += len(chunk)
+        stats['dropped'] += len(errors)
+        stats['bytes_in'] += sum(len(tile[3]) for tile in chunk)
+        stats['bytes_out'] += sum(len(tile[3]) for tile in tiles)
+        pbar.update(len(chunk))
+
+    started = time.perf_counter()
+    chunks = read_chunks(cursor_in, state['key'], chunk_size)
+    with tqdm(total=total, desc=desc, unit=" tiles") as pbar:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # Results are written in submission order, at most 2 chunks per worker in flight
+                pending = deque()
+                for chunk in chunks:
+                    pending.append((chunk, executor.submit(transform_chunk, transform, chunk)))
+                    if len(pending) >= 2 * workers:
+                        chunk, future = pending.popleft()
+                        write(chunk, future.result())
+                while pending:
+                    chunk, future = pending.popleft()
+                    write(chunk, future.result())
+        else:
+            for chunk in chunks:
+                write(chunk, transform_chunk(transform, chunk))
+    conn_in.close()
+
+    checkpoint.clear()
     conn.commit()
+    conn.execute("PRAGMA journal_mode=DELETE;")
     conn.close()
 
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+def log_throughput(stats):
+    seconds = max(stats['seconds'], 1e-9)
+    logger.info(f"{stats['tiles']} tiles, {stats['bytes_in'] / 1e6:.1f} MB -> {stats['bytes_out'] / 1e6:.1f} MB "
+                f"in {stats['seconds']:.1f}s: {stats['tiles'] / seconds:.0f} tiles/s, "
+                f"{stats['bytes_in'] / 1e6 / seconds:.1f} MB/s.")
+    if stats['dropped']:
+        logger.warning(f"{stats['dropped']} tiles could not be processed and were dropped, see the errors above.")
+
+def read_tile_codec(mbtiles):
+    conn = sqlite3.connect(f"file:{mbtiles}?mode=ro", uri=True)
+    try:
+        return codec_name(get_tile_codec(conn.cursor()))
+    finally:
+        conn.close()
+
+def read_tile_dictionary(mbtiles):
+    conn = sqlite3.connect(f"file:{mbtiles}?mode=ro", uri=True)
+    try:
+        return get_tile_dictionary(conn.cursor())
+    finally:
+        conn.close()
+
+def compress_mbtiles(input_mbtiles, output_mbtiles, codec=MBTILESCOMPRESS_CODEC, level=None,
+                     workers=MBTILESCOMPRESS_WORKERS, chunk_size=MBTILESCOMPRESS_CHUNK_SIZE, resume=False,
+                     dictionary=None):
+    """
+    Compress the tiles of input_mbtiles with codec (gzip, zlib, brotli or zstd) at level (the codec default if None),
+    the codec is recorded in the "compression" metadata of output_mbtiles.
+    zstd tiles are compressed with dictionary, by default the zstd dictionary of input_mbtiles if it has one, which is
+    then stored in the metadata of output_mbtiles.
+    """
+    source_dictionary = read_tile_dictionary(input_mbtiles)
+    if codec_name(codec) == 'zstd' and dictionary is None:
+        dictionary = source_dictionary
+    elif codec_name(codec) != 'zstd' and dictionary is not None:
+        raise ValueError("Only zstd tiles are compressed with a dictionary")
+    get_codec(codec).check(level, dictionary)
+    transform = partial(compress_tile_data, codec=codec, level=level, dictionary=dictionary,
+                        source_codec=read_tile_codec(input_mbtiles), source_dictionary=source_dictionary)
+    metadata = {'compression': codec_name(codec),
+                DICTIONARY_METADATA: dictionary_metadata(dictionary) if dictionary is not None else None}
+    return rewrite_tiles(input_mbtiles, output_mbtiles, transform, 'mbtilescompress', "Compressing tiles", workers,
+                         chunk_size, resume, metadata, level=level)
+
 def main():
-    parser = argparse.ArgumentParser(description='Compress Vector MBTiles file with GZIP.')
+    parser = argparse.ArgumentParser(description='Compress Vector MBTiles file with GZIP, ZLIB, Brotli or Zstandard.')
     parser.add_argument('input', help='Path to the input MBTiles file.')
     parser.add_argument('-o', '--output', help='Path to the output MBTiles file.')
+    parser.add_argument('-c', '--codec', default=MBTILESCOMPRESS_CODEC, choices=CODEC_NAMES, help=f'Compression codec (default: {MBTILESCOMPRESS_CODEC}).')
+    parser.add_argument('-l', '--level', type=int, help='Compression level (default: 9 for gzip, 6 for zlib, 11 for brotli, 3 for zstd).')
+    parser.add_argument('-w', '--workers', type=int, default=MBTILESCOMPRESS_WORKERS, help=f'Number of compressing processes (default: {MBTILESCOMPRESS_WORKERS}).')
+    parser.add_argument('--resume', action='store_true', help='Continue an interrupted run from its checkpoint in the output file.')
 
     args = parser.parse_args()
     if not os.path.exists(args.input):
@@ -120,7 +256,7 @@ def main():
     # Determine the output filename
     if args.output:
         output_file_abspath = os.path.abspath(args.output)
-        if os.path.exists(output_file_abspath):
+        if os.path.exists(output_file_abspath) and not args.resume:
             logger.error(f'Output MBTiles file {output_file_abspath} already exists!. Please recheck and input a correct one. Ex: -o tiles.mbtiles')
             sys.exit(1)
         elif not output_file_abspath.endswith('mbtiles'):
@@ -130,15 +266,23 @@ def main():
         output_file_name = os.path.basename(input_file_abspath).replace('.mbtiles', '_compressed.mbtiles')
         output_file_abspath = os.path.join(os.path.dirname(input_file_abspath), output_file_name)
  
-        if os.path.exists(output_file_abspath): 
+        if os.path.exists(output_file_abspath) and not args.resume: 
             logger.error(f'Output MBTiles file {output_file_abspath} already exists! Please recheck and input a correct one. Ex: -o tiles.mbtiles')
             sys.exit(1)          
 
+    try:
+        get_codec(args.codec).check(args.level)
+    except ValueError as e:
+        logger.error(e)
+        sys.exit(1)
+
     # Inform the user of the conversion
     is_vector, _ = check_vector(args.input)
     if is_vector:
         logging.info(f'Compressing {input_file_abspath} to {output_file_abspath}.') 
-        compress_mbtiles(input_file_abspath, output_file_abspath)
+        stats = compress_mbtiles(input_file_abspath, output_file_abspath, args.codec, args.level, args.workers, resume=args.resume)
+        if stats:
+            log_throughput(stats)
     else:
         logging.warning(f'mbtilescompress only supports vector MBTiles. {input_file_abspath} is not a vector MBTiles.')
         sys.exit(1)
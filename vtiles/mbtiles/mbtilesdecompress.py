@@ -1,118 +1,32 @@
 import argparse, sys, os
-import sqlite3
-import zlib
-import gzip
 import logging
-import shutil
-from tqdm import tqdm
+from functools import partial
 from vtiles.utils.geopreocessing import check_vector
+from vtiles.utils.codec import decode, DICTIONARY_METADATA
+from vtiles.mbtiles.mbtilescompress import rewrite_tiles, read_tile_codec, read_tile_dictionary, log_throughput, MBTILESCOMPRESS_WORKERS, MBTILESCOMPRESS_CHUNK_SIZE
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def decompress_tile_data(tile_data):
-    try:
-        if tile_data[:2] == b'\x1f\x8b':  # Check for gzip magic number
-            tile_data = gzip.decompress(tile_data)
-        elif tile_data[:2] == b'\x78\x9c' or tile_data[:2] == b'\x78\x01' or tile_data[:2] == b'\x78\xda':
-            tile_data = zlib.decompress(tile_data) 
-    except Exception as e:
-        logging.error(f"Failed to decompress tile data: {e}")
-        return tile_data
-    return tile_data          
+def decompress_tile_data(tile_data, codec=None, dictionary=None):
+    # codec is the declared codec, only needed for brotli which cannot be sniffed. Errors are left to transform_chunk,
+    # which drops the tile instead of keeping compressed bytes in an uncompressed output
+    return decode(tile_data, codec, dictionary)
 
-def decompress_mbtiles(input_mbtiles, output_mbtiles, batch_size=10000):
-    shutil.copyfile(input_mbtiles, output_mbtiles)
-    
-    # Open the copied MBTiles file
-    conn = sqlite3.connect(output_mbtiles)
-    cursor = conn.cursor()
-
-    # Check if the tiles table is a view
-    cursor.execute("SELECT type FROM sqlite_master WHERE name='tiles'")
-    result = cursor.fetchone()
-
-    def process_tiles(tiles):
-        batch = []
-        for zoom_level, tile_column, tile_row, tile_data in tiles:
-            try:
-                decompressed_tile = decompress_tile_data(tile_data)
-                batch.append((decompressed_tile, zoom_level, tile_column, tile_row))
-            except Exception as e:
-                logging.error(f"Error decompressing tile {zoom_level}/{tile_column}/{tile_row}: {e}")
-            
-            # Commit batch once it reaches the batch_size
-            if len(batch) >= batch_size:
-                cursor.executemany(
-                    "UPDATE tiles SET tile_data = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
-                    batch
-                )
-                conn.commit()  # Commit the batch
-                batch.clear()  # Clear batch
-
-        # Commit any remaining tiles in the batch
-        if batch:
-            cursor.executemany(
-                "UPDATE tiles SET tile_data = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
-                batch
-            )
-            conn.commit()
-
-    if result and result[0] == 'view':
-        # Create a new table named tiles_new
-        cursor.execute("CREATE TABLE tiles_new (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
-        
-        # Select data from the view
-        cursor.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles ORDER BY zoom_level")
-        tiles = cursor.fetchall()
-        
-        batch = []
-        for zoom_level, tile_column, tile_row, tile_data in tqdm(tiles, desc="Decompressing tiles", unit="tile"):
-            try:
-                decompressed_tile = decompress_tile_data(tile_data)
-                batch.append((zoom_level, tile_column, tile_row, decompressed_tile))
-            except Exception as e:
-                logging.error(f"Error decompressing tile {zoom_level}/{tile_column}/{tile_row}: {e}")
-            
-            # Insert decompressed data in batches
-            if len(batch) >= batch_size:
-                cursor.executemany(
-                    "INSERT INTO tiles_new (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
-                    batch
-                )
-                conn.commit()  # Commit batch
-                batch.clear()  # Clear batch
-
-        # Commit remaining tiles in the batch
-        if batch:
-            cursor.executemany(
-                "INSERT INTO tiles_new (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
-                batch
-            )
-            conn.commit()
-
-        # Drop the view and rename the new table to tiles
-        cursor.execute("DROP VIEW tiles")
-        cursor.execute("ALTER TABLE tiles_new RENAME TO tiles")
-        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)")
-
-    else:
-        # Decompress tile data in the existing tiles table
-        cursor.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles ORDER BY zoom_level")
-        tiles = cursor.fetchall()
-        
-        # Process the tiles in batches
-        process_tiles(tqdm(tiles, desc="Decompressing tiles", unit="tile"))
-
-    # Commit and close connections
-    conn.commit()
-    conn.close()
+def decompress_mbtiles(input_mbtiles, output_mbtiles, workers=MBTILESCOMPRESS_WORKERS,
+                       chunk_size=MBTILESCOMPRESS_CHUNK_SIZE, resume=False):
+    transform = partial(decompress_tile_data, codec=read_tile_codec(input_mbtiles),
+                        dictionary=read_tile_dictionary(input_mbtiles))
+    return rewrite_tiles(input_mbtiles, output_mbtiles, transform, 'mbtilesdecompress', "Decompressing tiles",
+                         workers, chunk_size, resume, {'compression': 'none', DICTIONARY_METADATA: None})
 
 
 def main():
-    parser = argparse.ArgumentParser(description='Decompress an MBTiles file.')
+    parser = argparse.ArgumentParser(description='Decompress an MBTiles file (GZIP, ZLIB, Brotli or Zstandard).')
     parser.add_argument('input', help='Path to the input MBTiles file.')
     parser.add_argument('-o', '--output', help='Path to the output MBTiles file.')
+    parser.add_argument('-w', '--workers', type=int, default=MBTILESCOMPRESS_WORKERS, help=f'Number of decompressing processes (default: {MBTILESCOMPRESS_WORKERS}).')
+    parser.add_argument('--resume', action='store_true', help='Continue an interrupted run from its checkpoint in the output file.')
 
     args = parser.parse_args()
     if not os.path.exists(args.input):
@@ -123,7 +37,7 @@ def main():
     # Determine the output filename
     if args.output:
         output_file_abspath = os.path.abspath(args.output)
-        if os.path.exists(output_file_abspath):
+        if os.path.exists(output_file_abspath) and not args.resume:
             logger.error(f'Output MBTiles file {output_file_abspath} already exists!. Please recheck and input a correct one. Ex: -o tiles.mbtiles')
             sys.exit(1)
         elif not output_file_abspath.endswith('mbtiles'):
@@ -133,7 +47,7 @@ def main():
         output_file_name = os.path.basename(input_file_abspath).replace('.mbtiles', '_decompressed.mbtiles')
         output_file_abspath = os.path.join(os.path.dirname(input_file_abspath), output_file_name)
  
-        if os.path.exists(output_file_abspath): 
+        if os.path.exists(output_file_abspath) and not args.resume: 
             logger.error(f'Output MBTiles file {output_file_abspath} already exists! Please recheck and input a correct one. Ex: -o tiles.mbtiles')
             sys.exit(1)          
 
@@ -141,7 +55,9 @@ def main():
     is_vector, _ = check_vector(args.input)
     if is_vector:
         logging.info(f'Decompressing {input_file_abspath} to {output_file_abspath}.') 
-        decompress_mbtiles(input_file_abspath, output_file_abspath)
+        stats = decompress_mbtiles(input_file_abspath, output_file_abspath, args.workers, resume=args.resume)
+        if stats:
+            log_throughput(stats)
     else:
         logging.warning(f'mbtilesdecompress only supports vector MBTiles. {input_file_abspath} is not a vector MBTiles.')
         sys.exit(1)
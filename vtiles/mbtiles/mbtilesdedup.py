@@ -0,0 +1,75 @@
+import argparse, sys, os
+import sqlite3
+import logging
+from tqdm import tqdm
+from vtiles.utils.mbtileswriter import MBTilesWriter, MBTILESWRITER_WORKERS, MBTILESWRITER_BATCH_SIZE
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def read_tiles(cursor, batch_size):
+    cursor.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles")
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield from rows
+
+def dedup_mbtiles(input_mbtiles, output_mbtiles, workers=MBTILESWRITER_WORKERS, batch_size=MBTILESWRITER_BATCH_SIZE):
+    """
+    Copy an MBTiles (tiles table or view) into a new one in the images/map layout, where identical tile contents
+    (ocean, empty tiles...) are stored once. Returns the MBTilesWriter stats.
+    """
+    conn = sqlite3.connect(f"file:{input_mbtiles}?mode=ro", uri=True)
+    cursor = conn.cursor()
+    total = cursor.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+    metadata = dict(cursor.execute("SELECT name, value FROM metadata").fetchall())
+
+    writer = MBTilesWriter(output_mbtiles, dedup=True, workers=workers, batch_size=batch_size)
+    try:
+        writer.write_metadata(metadata)
+        with tqdm(total=total, desc="Deduplicating tiles", unit=" tiles") as pbar:
+            writer.write_tiles(read_tiles(cursor, batch_size), progress=pbar.update)
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        conn.close()
+    return writer.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Store identical tile contents of an MBTiles once, in the images/map layout.')
+    parser.add_argument('input', help='Path to the input MBTiles file.')
+    parser.add_argument('-o', '--output', help='Path to the output MBTiles file.')
+    parser.add_argument('-w', '--workers', type=int, default=MBTILESWRITER_WORKERS, help=f'Number of threads hashing tile contents (default: {MBTILESWRITER_WORKERS}).')
+
+    args = parser.parse_args()
+    if not os.path.exists(args.input):
+        logging.error('Input MBTiles file does not exist! Please recheck and input a correct file path.')
+        sys.exit(1)
+
+    input_file_abspath = os.path.abspath(args.input)
+    # Determine the output filename
+    if args.output:
+        output_file_abspath = os.path.abspath(args.output)
+        if os.path.exists(output_file_abspath):
+            logger.error(f'Output MBTiles file {output_file_abspath} already exists!. Please recheck and input a correct one. Ex: -o tiles.mbtiles')
+            sys.exit(1)
+        elif not output_file_abspath.endswith('mbtiles'):
+            logger.error(f'Output MBTiles file {output_file_abspath} must end with .mbtiles. Please recheck and input a correct one. Ex: -o tiles.mbtiles')
+            sys.exit(1)
+    else:
+        output_file_name = os.path.basename(input_file_abspath).replace('.mbtiles', '_dedup.mbtiles')
+        output_file_abspath = os.path.join(os.path.dirname(input_file_abspath), output_file_name)
+
+        if os.path.exists(output_file_abspath):
+            logger.error(f'Output MBTiles file {output_file_abspath} already exists! Please recheck and input a correct one. Ex: -o tiles.mbtiles')
+            sys.exit(1)
+
+    logging.info(f'Deduplicating {input_file_abspath} to {output_file_abspath}.')
+    stats = dedup_mbtiles(input_file_abspath, output_file_abspath, args.workers)
+    logging.info(f"{stats['tiles']} tiles stored as {stats['images']} distinct contents, "
+                 f"{stats['tile_bytes']} bytes of tile data stored in {stats['stored_bytes']} bytes.")
+
+if __name__ == '__main__':
+    main()
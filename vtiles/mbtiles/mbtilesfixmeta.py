@@ -4,7 +4,8 @@
 
 import os,sys, sqlite3, json
 from vtiles.utils.geopreocessing import check_vector, determine_tileformat,\
-                                         get_zoom_levels,get_bounds_center, decode_tile_data
+                                         get_zoom_levels,get_bounds_center, view_tile_data, get_tile_dictionary
+from vtiles.utils.codec import register_dictionaries, loaded_dictionaries
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 import logging
@@ -12,28 +13,25 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def extract_layer_fields(layer_data):
-    """Extract field types from layer data."""
-    fields = {}
-    for feature in layer_data['features']:
-        for key, value in feature['properties'].items():
-            if key not in fields:  # Only add if not already present
-                fields[key] = type(value).__name__  # Store the type of each field
-    return fields
-
-def decode_tile_batch(tile_batch, zoom_level):
-    """Decode a batch of tiles and extract layer information."""
+def extract_layer_fields(layer_view):
+    """Extract field types from the key and value tables of a layer view."""
+    return dict(layer_view.fields)
+
+def decode_tile_batch(tile_batch, zoom_level, tile_codec=None):
+    """Inspect a batch of tiles and extract layer information, without decoding the geometries.
+    tile_codec is the declared codec of the tiles, brotli cannot be detected from their bytes."""
     layers = {}
     
     for tile_data_tuple in tile_batch:
         tile_data = tile_data_tuple[0]  # Extract tile data from the tuple
-        decoded_tile = decode_tile_data(tile_data)
-        if decoded_tile:  # Ensure decoded_tile is valid
-            for layer_name, layer_data in decoded_tile.items():
+        tile_view = view_tile_data(tile_data, tile_codec)
+        if tile_view:  # Ensure the tile is valid and has layers
+            for layer_view in tile_view:
+                layer_name = layer_view.name
                 if layer_name not in layers:
                     # Initialize minzoom and maxzoom
                     layers[layer_name] = {
-                        "fields": extract_layer_fields(layer_data),
+                        "fields": extract_layer_fields(layer_view),
                         "minzoom": zoom_level,
                         "maxzoom": zoom_level,
                     }
@@ -55,10 +53,11 @@ def merge_layer_dicts(layers_accumulated, new_layers):
             layers_accumulated[name]['minzoom'] = min(layers_accumulated[name]['minzoom'], layer['minzoom'])
             layers_accumulated[name]['maxzoom'] = max(layers_accumulated[name]['maxzoom'], layer['maxzoom'])
 
-def get_layers_from_all_tiles_parallel(mbtiles_file, batch_size=10000, workers=4):
+def get_layers_from_all_tiles_parallel(mbtiles_file, batch_size=10000, workers=4, tile_codec=None):
     """Extract layer information from all tiles in the MBTiles file."""
     conn = sqlite3.connect(mbtiles_file)
     cursor = conn.cursor()
+    get_tile_dictionary(cursor)
 
     # Query the total number of tiles to set up progress tracking
     cursor.execute("SELECT COUNT(*) FROM tiles")
@@ -68,7 +67,9 @@ def get_layers_from_all_tiles_parallel(mbtiles_file, batch_size=10000, workers=4
     offset = 0
 
     with tqdm(total=total_tiles, desc="Processing tiles") as pbar:
-        with ProcessPoolExecutor(max_workers=workers) as executor:
+        # The workers decode the tiles compressed with the zstd dictionary of the MBTiles
+        with ProcessPoolExecutor(max_workers=workers, initializer=register_dictionaries,
+                                 initargs=(loaded_dictionaries(),)) as executor:
             futures = []
             # Process tiles in parallel batches
             while offset < total_tiles:
@@ -76,7 +77,7 @@ def get_layers_from_all_tiles_parallel(mbtiles_file, batch_size=10000, workers=4
                 tile_batch = cursor.fetchall()
                 # Submit a batch for parallel decoding, along with the zoom level
                 zoom_level = tile_batch[0][1] if tile_batch else None  # Get the zoom level from the first tile in the batch
-                futures.append(executor.submit(decode_tile_batch, tile_batch, zoom_level))
+                futures.append(executor.submit(decode_tile_batch, tile_batch, zoom_level, tile_codec))
                 
                 # Update offset for the next batch
                 offset += batch_size
@@ -138,7 +139,7 @@ def fix_vectormetadata(input_mbtiles, compression_type, desc):
     print('Updating json vector_layers')
     batch_size=10000
     workers=4
-    layers_json = get_layers_from_all_tiles_parallel(input_mbtiles,batch_size,workers)
+    layers_json = get_layers_from_all_tiles_parallel(input_mbtiles,batch_size,workers,compression_type)
     layers_json_str = json.dumps(layers_json)
     if layers_json_str:
         cursor.execute("INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)", ('json', layers_json_str))
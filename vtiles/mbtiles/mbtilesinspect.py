@@ -3,7 +3,8 @@ import os, sys, argparse, textwrap
 from vtiles.utils.geopreocessing import check_vector, determine_tileformat,\
                                         count_tiles, count_tiles_for_each_zoom,\
                                         get_zoom_levels,get_bounds_center,find_duplicates,\
-                                        get_standard_tile_count, decode_tile_data
+                                        get_standard_tile_count, view_tile_data, get_tile_dictionary
+from vtiles.utils.codec import register_dictionaries, loaded_dictionaries
 from concurrent.futures import ProcessPoolExecutor, as_completed
 import logging
 from tqdm import tqdm
@@ -67,10 +68,11 @@ def inspect_mbtiles(mbtiles):
 def process_tile_batch(tile_batch):
     layers = set()
     for tile_column, tile_row, tile_data in tile_batch:
-        # Decode the vector tile using mapbox_vector_tile
-        decoded_tile = decode_tile_data(tile_data)
+        # Only the layer names are read, the features are not decoded
+        tile_view = view_tile_data(tile_data)
         # Add all the layer names to the set
-        layers.update(decoded_tile.keys())
+        if tile_view is not None:
+            layers.update(tile_view.layer_names)
     
     return layers
 
@@ -79,6 +81,7 @@ def list_layers_for_all_zoom_levels_parallel(mbtiles_file, batch_size=10000, wor
     # Connect to the MBTiles file (SQLite database)
     conn = sqlite3.connect(mbtiles_file)
     cursor = conn.cursor()
+    get_tile_dictionary(cursor)
 
     # Query distinct zoom levels from the tiles table
     cursor.execute("SELECT DISTINCT zoom_level FROM tiles ORDER BY zoom_level")
@@ -102,7 +105,9 @@ def list_layers_for_all_zoom_levels_parallel(mbtiles_file, batch_size=10000, wor
         layers = set()
 
         # Use ProcessPoolExecutor for parallel processing
-        with ProcessPoolExecutor(max_workers=workers) as executor:
+        # The workers decode the tiles compressed with the zstd dictionary of the MBTiles
+        with ProcessPoolExecutor(max_workers=workers, initializer=register_dictionaries,
+                                 initargs=(loaded_dictionaries(),)) as executor:
             futures = {executor.submit(process_tile_batch, batch): batch for batch in batches}
 
             # Use tqdm for progress tracking
@@ -1,18 +1,32 @@
 import sqlite3
 import os, sys
-import shutil
-from vtiles.utils.mapbox_vector_tile import encode, decode
-from vtiles.utils.geopreocessing import fix_wkt, check_vector
+import numpy as np
+import shapely
+import heapq
+from collections import deque
+from itertools import groupby
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from vtiles.utils.mapbox_vector_tile import encode, merge, concat_arrays, TileView
+from vtiles.utils.geopreocessing import decode_tile_layers, check_vector, get_tile_dictionary
 import argparse
-import gzip, zlib
+from vtiles.utils import codec
 import json
 import logging
 from tqdm import tqdm
 from vtiles.mbtiles.mbtilesfixmeta import fix_vectormetadata
+from vtiles.utils.checkpoint import MBTilesCheckpoint, CheckpointError, checkpoint_signature, after_key, TILE_KEY_ORDER
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def extend_layer(layer, other):
+    # The geometry arrays of trusted layers follow their features
+    if 'geometry_arrays' in layer:
+        layer['geometry_arrays'] = concat_arrays([layer['geometry_arrays'], other['geometry_arrays']],
+                                                 [len(layer['features']), len(other['features'])])
+    layer['features'].extend(other['features'])
+
 def merge_json_layers(layer1, layer2):
     # Create a dictionary to combine features by layer name
     combined_layer = {}
@@ -23,7 +37,7 @@ def merge_json_layers(layer1, layer2):
         if name not in combined_layer:
             combined_layer[name] = layer
         else:
-            combined_layer[name]['features'].extend(layer['features'])
+            extend_layer(combined_layer[name], layer)
 
     # Add features from the second JSON data
     for layer in layer2:
@@ -31,51 +45,56 @@ def merge_json_layers(layer1, layer2):
         if name not in combined_layer:
             combined_layer[name] = layer
         else:
-            combined_layer[name]['features'].extend(layer['features'])
+            extend_layer(combined_layer[name], layer)
 
     # Convert combined data to a list
     merged_layer= list(combined_layer.values())
     
     return merged_layer
 
-def merge_tiles(tile1, tile2,z=None, x=None, y=None):
+def rescale_features(features, factor):
+    # Scale the geometries of a layer to the extent of the layer they are merged into, in bulk
+    shapes = np.empty(len(features), dtype=object)
+    shapes[:] = [feature['geometry'] for feature in features]
+    for feature, shape in zip(features, shapely.transform(shapes, lambda coords: coords * factor)):
+        feature['geometry'] = shape
+
+def merge_tiles(tile1, tile2,z=None, x=None, y=None, reencode=False, codec1=None, codec2=None):
+    # codec1 and codec2 are the codecs declared by the inputs of the tiles, brotli cannot be detected from the bytes
     try:        
         if tile1 and tile2:
-            if tile1[:2] == b'\x1f\x8b':
-                tile1 = gzip.decompress(tile1)
-            elif tile1[:2] == b'\x78\x9c' or tile1[:2] == b'\x78\x01' or tile1[:2] == b'\x78\xda':
-                tile1 = zlib.decompress(tile1)
-            decoded_tile1 = decode(tile1)
-            decoded_tile1_fixed = fix_wkt(decoded_tile1)
-
-            if tile2[:2] == b'\x1f\x8b':
-                tile2 = gzip.decompress(tile2)
-            elif tile2[:2] == b'\x78\x9c' or tile2[:2] == b'\x78\x01' or tile2[:2] == b'\x78\xda':
-                tile2 = zlib.decompress(tile2)
-            decoded_tile2 = decode(tile2)
-            decoded_tile2_fixed = fix_wkt(decoded_tile2)
-
-            merged_layer = merge_json_layers(decoded_tile1_fixed,decoded_tile2_fixed)
+            tile1 = codec.decode(tile1, codec1)
+            tile2 = codec.decode(tile2, codec2)
+
+            if not reencode:
+                # Concatenate layers at the protobuf level, geometries are copied untouched
+                try:
+                    return codec.encode(merge([tile1, tile2]), 'gzip')
+                except ValueError as e:
+                    logger.debug(f"Falling back to decode/encode for tile {z}/{x}/{y}: {e}")
+
+            tile1, tile2 = TileView(tile1), TileView(tile2)
+            # Decoded geometries are trusted and encoded again without shapely, unless a layer has to be rescaled
+            trusted = all(tile1[layer.name].extent == layer.extent for layer in tile2 if layer.name in tile1)
+            decoded_tile1, extents1 = decode_tile_layers(tile1, trusted=trusted)
+            decoded_tile2, extents2 = decode_tile_layers(tile2, trusted=trusted)
+            # A layer keeps the extent it has in the first tile
+            for layer in decoded_tile2:
+                extent = extents1.setdefault(layer['name'], extents2[layer['name']])
+                if extent != extents2[layer['name']]:
+                    rescale_features(layer['features'], extent / extents2[layer['name']])
+
+            merged_layer = merge_json_layers(decoded_tile1, decoded_tile2)
             # print (merged_tiles)
-            merged_tile_encoded = encode(merged_layer)
-            merged_tile_encoded_gzip = gzip.compress(merged_tile_encoded)   
+            merged_tile_encoded = encode(merged_layer, per_layer_options={name: {"extents": extent} for name, extent in extents1.items()})
+            merged_tile_encoded_gzip = codec.encode(merged_tile_encoded, 'gzip')   
             return merged_tile_encoded_gzip
                 
         elif tile1:
-            if tile1[:2] == b'\x1f\x8b':
-                return tile1
-            elif tile1[:2] == b'\x78\x9c' or tile1[:2] == b'\x78\x01' or tile1[:2] == b'\x78\xda':
-                tile1_decompressed_zlib = zlib.decompress(tile1)
-                return gzip.compress(tile1_decompressed_zlib)
-            else: return  gzip.compress(tile1)   
+            return codec.recode(tile1, 'gzip', source_codec=codec1)
         
         elif tile2:
-            if tile2[:2] == b'\x1f\x8b':
-                return tile2
-            elif tile2[:2] == b'\x78\x9c' or tile2[:2] == b'\x78\x01' or tile2[:2] == b'\x78\xda':
-                tile2_decompressed_zlib = zlib.decompress(tile2)
-                return gzip.compress(tile2_decompressed_zlib)     
-            else: return  gzip.compress(tile2) 
+            return codec.recode(tile2, 'gzip', source_codec=codec2)
     except Exception as e:
         return None
 
@@ -131,6 +150,8 @@ def merge_metadata(metadata_dicts):
     merged_metadata = {}
     for metadata in metadata_dicts:
         for name, value in metadata.items():
+            if value is None:
+                continue
             if name in merged_metadata:
                 if name.strip() =='json':  # Check if the metadata name suggests JSON content
                     merged_metadata[name] = merge_json_metadata(merged_metadata[name], value)
@@ -207,157 +228,391 @@ def get_center_of_bound(bounds_str):
         logging.error(f"Get center of bound error: {e}")
         return ''
         
-def merge_mbtiles(input_mbtiles, output_mbtiles):   
-    is_vector, compression_type = check_vector(input_mbtiles[0]) 
-    if is_vector:
-        fix_vectormetadata(input_mbtiles[0], compression_type,'')   
-        shutil.copyfile(input_mbtiles[0], output_mbtiles)
-        try:
-            conn_out = sqlite3.connect(output_mbtiles)       
-            cur_out = conn_out.cursor()
-            cur_out.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)')
-            cur_out.execute('DROP TABLE IF EXISTS tiles_new;')
-            cur_out.execute('CREATE TABLE tiles_new (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB, PRIMARY KEY (zoom_level, tile_column, tile_row))')
-            cur_out.execute('''
-                INSERT INTO tiles_new (zoom_level, tile_column, tile_row, tile_data)
-                SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles;
-                ''')
-            
-            cur_out.execute("SELECT type FROM sqlite_master WHERE name='tiles'")  
-            result = cur_out.fetchone()
-            if result:
-                if result[0] == 'view':
-                    cur_out.execute('DROP VIEW tiles')
-                elif result[0] == 'table':
-                    cur_out.execute('DROP TABLE tiles')
-            cur_out.execute('ALTER TABLE tiles_new RENAME TO tiles')
-            cur_out.execute('CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)')
-            
-            # Merging tiles   
-            cur_out.execute('SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles ORDER BY zoom_level')          
-            output_rows = cur_out.fetchall()
-            tiles = {}
-
-            for (z, x, y, tile) in output_rows:
-                key = (z, x, y)
-                tiles[key] = tile
-            
-            connections = [sqlite3.connect(mbtiles) for mbtiles in input_mbtiles]
-            cursors_in = [conn.cursor() for conn in connections]
-            for i, cursor in enumerate(cursors_in):
-                if i == 0:
-                    continue  # Skip the cursor for the first MBTiles file     
-                is_vector, compression_type = check_vector(input_mbtiles[0]) 
-                if is_vector:
-                    fix_vectormetadata(input_mbtiles[i], compression_type,'')
-                    mbtiles_name = os.path.basename(input_mbtiles[i])
-                    cursor.execute('SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles ORDER BY zoom_level')
-                    rows = cursor.fetchall()
-                    for (z, x, y, tile) in tqdm(rows, desc=f"Processing tiles from {mbtiles_name}"):
-                        key = (z, x, y)
-                        if key in tiles:
-                            tiles[key] = merge_tiles(tiles[key], tile, z, x, y)
-                        else:
-                            tiles[key] = tile
-
-            for key, tile in tqdm(tiles.items(), desc="Inserting merged tiles"):
-                cur_out.execute('INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)', (key[0], key[1], key[2], tile))
-            conn_out.commit()
-            print(f"Successfully merged MBTiles files into {output_mbtiles}")
-        except Exception as e:
-            logging.error(f"Error Merging tile_data {mbtiles_name}: {e}")
-        
-        try: 
-            # Merging metadata
-            metadata_dicts = []
-            for i, cursor in enumerate(cursors_in):
-                mbtiles_name = os.path.basename(input_mbtiles[i])  
-                cursor.execute('SELECT name, value FROM metadata')
-                metadata_dicts.append({name: value for name, value in cursor.fetchall()})
-
-            merged_metadata = merge_metadata(metadata_dicts)
-
-            for name, value in tqdm(merged_metadata.items(), desc=f"Inserting merged metadata"):
-                cur_out.execute('INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)', (name, value))
-
-            # Update format
-            cur_out.execute(''' UPDATE metadata SET value = 'pbf' where name = 'format' ''')
-            
-            # Update minzoom
-            cur_out.execute("SELECT value FROM metadata WHERE name = 'minzoom'")
-            zoom_levels = cur_out.fetchone()[0]  # Fetch the value
-            if zoom_levels:
-                min_zoom = get_min_zoom(zoom_levels)
+def iter_sorted_tiles(mbtiles, start=None, inclusive=False):
+    """Yield ((zoom_level, tile_column, tile_row), tile_data) from an MBTiles file in key order, after start if given."""
+    conn = sqlite3.connect(f'file:{mbtiles}?mode=ro', uri=True)
+    try:
+        condition, params = after_key(start, inclusive)
+        cursor = conn.execute(f'SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles WHERE {condition} {TILE_KEY_ORDER}', params)
+        for z, x, y, tile_data in cursor:
+            yield (z, x, y), tile_data
+    finally:
+        conn.close()
+
+def iter_tile_groups(input_mbtiles, start=None, inclusive=False, codecs=None):
+    """
+    K-way merge of all inputs: yield (key, [(tile_data, tile_codec), ...]) once per key, tiles in input order.
+    tile_codec is the codec declared by the input in codecs, None without codecs.
+    """
+    def with_codec(mbtiles, tile_codec):
+        for key, tile_data in iter_sorted_tiles(mbtiles, start, inclusive):
+            yield key, (tile_data, tile_codec)
+
+    codecs = codecs or [None] * len(input_mbtiles)
+    streams = [with_codec(mbtiles, tile_codec) for mbtiles, tile_codec in zip(input_mbtiles, codecs)]
+    merged = heapq.merge(*streams, key=itemgetter(0))
+    for key, group in groupby(merged, key=itemgetter(0)):
+        yield key, [tile for _, tile in group]
+
+def merge_tile_batch(batch, reencode=False):
+    """
+    Merge a batch of (key, [(tile_data, tile_codec), ...]) groups into gzipped tiles, the tile of a group found in a
+    single input is only recompressed to gzip. Runs in a worker process.
+    """
+    rows = []
+    for (z, x, y), tiles in batch:
+        merged, merged_codec = tiles[0]
+        if len(tiles) == 1:
+            merged = codec.recode(merged, 'gzip', source_codec=merged_codec)
+        for tile, tile_codec in tiles[1:]:
+            merged = merge_tiles(merged, tile, z, x, y, reencode, merged_codec, tile_codec)
+            merged_codec = 'gzip'
+            if merged is None:
+                logger.error(f"Failed to merge tile {z}/{x}/{y}, keeping the tile from the first input")
+                merged = codec.recode(tiles[0][0], 'gzip', source_codec=tiles[0][1])
+                break
+        rows.append((z, x, y, merged))
+    return rows
+
+def merge_tiles_streaming(input_mbtiles, conn_out, workers=None, batch_size=10000, chunk_size=256, reencode=False,
+                          checkpoint=None, state=None, codecs=None):
+    """
+    Stream all input tiles as a k-way merge in (zoom_level, tile_column, tile_row) order.
+    Gzipped tiles of keys found in a single input are written as-is. Colliding keys are merged in a process pool,
+    where the other tiles found in a single input are recompressed to gzip: the output is gzipped, without the
+    dictionaries of the inputs.
+    codecs are the codecs declared by the inputs, to decode the tiles that cannot be sniffed (brotli).
+    Output rows are written with executemany in transactions of batch_size rows.
+    With a checkpoint, each transaction saves the key the merge has to restart from: the first collision still being
+    merged, or the key after the last one read. Tiles written past it are rewritten identically on resume.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 2
+    cur_out = conn_out.cursor()
+    rows = []
+    collisions = []
+    futures = {}
+    merged_count = 0
+    state = state if state is not None else {'key': None, 'inclusive': False}
+    last_key = state['key']
+    gzip_codec = codec.get_codec('gzip')
+
+    def flush(rows):
+        cur_out.executemany('INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)', rows)
+        if checkpoint is not None:
+            pending = [batch_key for batch_key in futures.values()] + ([collisions[0][0]] if collisions else [])
+            if pending:
+                checkpoint.save({'key': list(min(pending)), 'inclusive': True})
+            elif last_key is not None:
+                checkpoint.save({'key': list(last_key), 'inclusive': False})
+        conn_out.commit()
+        rows.clear()
+
+    # The workers decode the tiles compressed with the zstd dictionaries of the inputs, registered by check_vector
+    with ProcessPoolExecutor(max_workers=workers, initializer=codec.register_dictionaries,
+                             initargs=(codec.loaded_dictionaries(),)) as executor, \
+            tqdm(desc="Merging tiles", unit=" tiles") as pbar:
+        for key, tiles in iter_tile_groups(input_mbtiles, state['key'], state['inclusive'], codecs):
+            last_key = key
+            # Gzipped tiles found in a single input are copied, the others are recompressed in the pool
+            if len(tiles) == 1 and gzip_codec.match(tiles[0][0]):
+                rows.append((*key, tiles[0][0]))
+            else:
+                collisions.append((key, tiles))
+                merged_count += len(tiles) > 1
+                if len(collisions) >= chunk_size:
+                    futures[executor.submit(merge_tile_batch, collisions, reencode)] = collisions[0][0]
+                    collisions = []
+                    # Bound the number of chunks in flight so memory stays flat
+                    if len(futures) >= max_in_flight:
+                        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            del futures[future]
+                            rows.extend(future.result())
+            pbar.update(1)
+            if len(rows) >= batch_size:
+                flush(rows)
+
+        if collisions:
+            futures[executor.submit(merge_tile_batch, collisions, reencode)] = collisions[0][0]
+            collisions = []
+        for future in list(futures):
+            del futures[future]
+            rows.extend(future.result())
+        if rows or checkpoint is not None:
+            flush(rows)
+
+    return merged_count
+
+def merge_tiles_passthrough(input_mbtiles, conn_out, workers=None, batch_size=10000, chunk_size=256, reencode=False,
+                            checkpoint=None, state=None):
+    """
+    Byte-level pass-through merge. Each input is attached to the output database and tiles that do not
+    exist in the output yet are copied straight across with INSERT ... SELECT ... WHERE NOT EXISTS.
+    Only the key intersection with the output is read into Python and merged in a process pool.
+    Merging an overlapping tile twice would duplicate its features, so merged chunks are written in order and, with a
+    checkpoint, every transaction saves the input and the last overlap row it covers.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 2
+    cur_out = conn_out.cursor()
+    merged_count = 0
+    state = state if state is not None else {'input': 0, 'overlap': 0}
+
+    def flush(rows, input_index, overlap_rowid):
+        cur_out.executemany('UPDATE tiles SET tile_data = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+                            [(tile_data, z, x, y) for z, x, y, tile_data in rows])
+        if checkpoint is not None:
+            checkpoint.save({'input': input_index, 'overlap': overlap_rowid})
+        conn_out.commit()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=codec.register_dictionaries,
+                             initargs=(codec.loaded_dictionaries(),)) as executor:
+        for input_index, mbtiles in enumerate(input_mbtiles):
+            if input_index < state['input']:
+                continue
+            resume_rowid = state['overlap'] if input_index == state['input'] else 0
+            mbtiles_name = os.path.basename(mbtiles)
+            cur_out.execute("ATTACH DATABASE ? AS src", (f'file:{mbtiles}?mode=ro',))
+            try:
+                # Keys present in both the output and this input are the only tiles Python has to touch
+                cur_out.execute('DROP TABLE IF EXISTS temp.overlap')
                 cur_out.execute('''
-                    UPDATE metadata 
-                    SET value = ? 
-                    WHERE name = 'minzoom'
-                ''', (min_zoom,))
-
-            # Update maxzoom
-            cur_out.execute("SELECT value FROM metadata WHERE name = 'maxzoom'")
-            zoom_levels = cur_out.fetchone()[0]  # Fetch the value
-
-            max_zoom = 0
-            if zoom_levels:
-                max_zoom = get_max_zoom(zoom_levels)
+                    CREATE TEMP TABLE overlap AS
+                    SELECT t.zoom_level, t.tile_column, t.tile_row FROM src.tiles t
+                    WHERE EXISTS (SELECT 1 FROM main.tiles m
+                                  WHERE m.zoom_level = t.zoom_level AND m.tile_column = t.tile_column AND m.tile_row = t.tile_row)
+                    ORDER BY t.zoom_level, t.tile_column, t.tile_row
+                ''')
+                overlap_count = cur_out.execute('SELECT COUNT(*) FROM temp.overlap').fetchone()[0]
+
+                futures = deque()
+                with tqdm(total=overlap_count, initial=resume_rowid, desc=f"Merging overlapping tiles from {mbtiles_name}", unit=" tiles") as pbar:
+                    for start in range(resume_rowid + 1, overlap_count + 1, chunk_size):
+                        # fetchall() finishes the read before the UPDATEs below touch the same table
+                        rows = cur_out.execute('''
+                            SELECT o.zoom_level, o.tile_column, o.tile_row, m.tile_data, t.tile_data
+                            FROM temp.overlap o
+                            JOIN main.tiles m ON m.zoom_level = o.zoom_level AND m.tile_column = o.tile_column AND m.tile_row = o.tile_row
+                            JOIN src.tiles t ON t.zoom_level = o.zoom_level AND t.tile_column = o.tile_column AND t.tile_row = o.tile_row
+                            WHERE o.rowid BETWEEN ? AND ?
+                        ''', (start, start + chunk_size - 1)).fetchall()
+                        # Passthrough inputs are gzipped, like the tiles already in the output
+                        batch = [((z, x, y), [(tile_out, 'gzip'), (tile_in, 'gzip')]) for z, x, y, tile_out, tile_in in rows]
+                        end = min(start + chunk_size - 1, overlap_count)
+                        futures.append((end, executor.submit(merge_tile_batch, batch, reencode)))
+                        if len(futures) >= max_in_flight:
+                            end, future = futures.popleft()
+                            merged = future.result()
+                            flush(merged, input_index, end)
+                            merged_count += len(merged)
+                            pbar.update(len(merged))
+                    while futures:
+                        end, future = futures.popleft()
+                        merged = future.result()
+                        flush(merged, input_index, end)
+                        merged_count += len(merged)
+                        pbar.update(len(merged))
+
+                # Everything else is copied byte for byte without leaving SQLite
+                logger.info(f"Copying non-overlapping tiles from {mbtiles_name}")
                 cur_out.execute('''
-                    UPDATE metadata 
-                    SET value = ? 
-                    WHERE name = 'maxzoom'
-                ''', (max_zoom,))
-            
-            # Update max bounds
-            cur_out.execute("SELECT value FROM metadata WHERE name = 'bounds'")
-            bounds = cur_out.fetchone()[0]  # Fetch the value
-            if bounds:
-                min_bound = get_max_bound(bounds)
+                    INSERT INTO main.tiles (zoom_level, tile_column, tile_row, tile_data)
+                    SELECT t.zoom_level, t.tile_column, t.tile_row, t.tile_data FROM src.tiles t
+                    WHERE NOT EXISTS (SELECT 1 FROM main.tiles m
+                                      WHERE m.zoom_level = t.zoom_level AND m.tile_column = t.tile_column AND m.tile_row = t.tile_row)
+                    ORDER BY t.zoom_level, t.tile_column, t.tile_row
+                ''')
+                cur_out.execute('DROP TABLE temp.overlap')
+                if checkpoint is not None:
+                    checkpoint.save({'input': input_index + 1, 'overlap': 0})
+                conn_out.commit()
+            finally:
+                cur_out.execute('DETACH DATABASE src')
 
-                cur_out.execute('''
-                    UPDATE metadata 
-                    SET value = ? 
-                    WHERE name = 'bounds'
-                    ''', (min_bound,))
-
-            # Update center
-            cur_out.execute("SELECT value FROM metadata WHERE name = 'bounds'")
-            bound = cur_out.fetchone()[0]  
-            center = get_center_of_bound(bound)
-            center_of_bound = ''
-            if center != '':
-                center_of_bound = center +f',{max_zoom}'
+    return merged_count
 
+def has_dictionary(mbtiles):
+    conn = sqlite3.connect(f'file:{mbtiles}?mode=ro', uri=True)
+    try:
+        return get_tile_dictionary(conn.cursor()) is not None
+    finally:
+        conn.close()
+
+def merge_mbtiles(input_mbtiles, output_mbtiles, workers=None, batch_size=10000, passthrough=False, reencode=False, resume=False):
+    """
+    The output holds a checkpoint until the metadata is merged, with resume an interrupted merge continues from it.
+    """
+    codecs = []
+    for mbtiles in input_mbtiles:
+        is_vector, compression_type = check_vector(mbtiles)
+        if not is_vector:
+            logging.info(f'Only vector mbtiles is supported. {mbtiles} is not a vector MBTiles.')
+            return
+        fix_vectormetadata(mbtiles, compression_type, '')
+        codecs.append(compression_type)
+        if passthrough and has_dictionary(mbtiles):
+            logging.error(f'{mbtiles} is compressed with a zstd dictionary, its tiles cannot be copied byte for byte. '
+                          f'Merge without --passthrough.')
+            return
+        if passthrough and codec.codec_name(compression_type) != 'gzip':
+            logging.error(f'{mbtiles} is not gzipped ({codec.codec_name(compression_type)}), its tiles cannot be copied '
+                          f'byte for byte into a gzipped output. Merge without --passthrough.')
+            return
+
+    checkpoint_args = checkpoint_signature(input_mbtiles, task='mbtilesmerge', passthrough=passthrough, reencode=reencode)
+    if resume and os.path.exists(output_mbtiles):
+        conn_out = sqlite3.connect(output_mbtiles)
+        checkpoint = MBTilesCheckpoint(conn_out, checkpoint_args)
+        try:
+            state = checkpoint.load()
+        except CheckpointError as e:
+            logger.error(f'Cannot resume {output_mbtiles}: {e}')
+            logger.error(f'Run without --resume to merge into {output_mbtiles} again.')
+            conn_out.close()
+            sys.exit(1)
+        if state is None:
+            logger.info(f'{output_mbtiles} is already complete, nothing to resume.')
+            conn_out.close()
+            return
+        logger.info(f'Resuming {output_mbtiles} from {state}.')
+    else:
+        # The output gets its checkpoint before it is renamed into place: an existing output without checkpoint is complete
+        tmp_mbtiles = output_mbtiles + '.tmp'
+        if os.path.exists(tmp_mbtiles):
+            os.remove(tmp_mbtiles)
+        conn_out = sqlite3.connect(tmp_mbtiles)
+        cur_out = conn_out.cursor()
+        cur_out.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)')
+        cur_out.execute('CREATE UNIQUE INDEX IF NOT EXISTS name ON metadata (name)')
+        cur_out.execute('CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)')
+        cur_out.execute('CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)')
+        state = {'input': 0, 'overlap': 0} if passthrough else {'key': None, 'inclusive': False}
+        MBTilesCheckpoint(conn_out, checkpoint_args).start(state)
+        conn_out.commit()
+        conn_out.close()
+        os.replace(tmp_mbtiles, output_mbtiles)
+        conn_out = sqlite3.connect(output_mbtiles)
+        checkpoint = MBTilesCheckpoint(conn_out, checkpoint_args)
+
+    # The checkpoint is only as durable as the transactions it is saved in: WAL keeps every commit cheap without
+    # turning off the sync, the output is switched back to a single file at the end
+    conn_out.execute("PRAGMA journal_mode=WAL;")
+    conn_out.execute("PRAGMA synchronous=NORMAL;")
+    cur_out = conn_out.cursor()
+    try:
+        # Merging tiles
+        if passthrough:
+            merged_count = merge_tiles_passthrough(input_mbtiles, conn_out, workers, batch_size, reencode=reencode,
+                                                   checkpoint=checkpoint, state=state)
+        else:
+            merged_count = merge_tiles_streaming(input_mbtiles, conn_out, workers, batch_size, reencode=reencode,
+                                                 checkpoint=checkpoint, state=state, codecs=codecs)
+        print(f"Successfully merged MBTiles files into {output_mbtiles} ({merged_count} overlapping tiles merged)")
+    except Exception as e:
+        logging.error(f"Error Merging tile_data: {e}")
+        logging.error(f"Run again with --resume to continue the merge into {output_mbtiles}.")
+        conn_out.close()
+        return
+
+    try:
+        # Merging metadata
+        metadata_dicts = []
+        for mbtiles in input_mbtiles:
+            conn = sqlite3.connect(mbtiles)
+            try:
+                metadata_dicts.append({name: value for name, value in conn.execute('SELECT name, value FROM metadata')})
+            finally:
+                conn.close()
+
+        merged_metadata = merge_metadata(metadata_dicts)
+        # Merged tiles are gzipped, the dictionaries of the inputs do not apply
+        merged_metadata['compression'] = 'gzip'
+        merged_metadata.pop(codec.DICTIONARY_METADATA, None)
+
+        for name, value in tqdm(merged_metadata.items(), desc=f"Inserting merged metadata"):
+            cur_out.execute('INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)', (name, value))
+
+        # Update format
+        cur_out.execute(''' UPDATE metadata SET value = 'pbf' where name = 'format' ''')
+
+        # Update minzoom
+        cur_out.execute("SELECT value FROM metadata WHERE name = 'minzoom'")
+        zoom_levels = cur_out.fetchone()[0]  # Fetch the value
+        if zoom_levels:
+            min_zoom = get_min_zoom(zoom_levels)
             cur_out.execute('''
                 UPDATE metadata 
                 SET value = ? 
-                WHERE name = 'center'
-                ''', (center_of_bound,))
+                WHERE name = 'minzoom'
+            ''', (min_zoom,))
+
+        # Update maxzoom
+        cur_out.execute("SELECT value FROM metadata WHERE name = 'maxzoom'")
+        zoom_levels = cur_out.fetchone()[0]  # Fetch the value
 
-            # Update description
-            description = 'Merge multiple MBTiles files into a single MBTiles file using mbtilesmerge from vtiles'
+        max_zoom = 0
+        if zoom_levels:
+            max_zoom = get_max_zoom(zoom_levels)
             cur_out.execute('''
-                INSERT OR REPLACE INTO metadata (name, value)
-                VALUES ('description', ?)
-            ''', (description,))
+                UPDATE metadata 
+                SET value = ? 
+                WHERE name = 'maxzoom'
+            ''', (max_zoom,))
         
-            conn_out.commit()
-            print(f"Successfully merged metadata into {output_mbtiles}")
-            
-        except Exception as e:
-            logging.error(f"Error Merging metadata: {e}")
-
-        finally:
-            for conn in connections:
-                conn.close()   
-            conn_out.close()
-    else:
-        logging.info('Only vector mbtiles is supported.')
-        return
+        # Update max bounds
+        cur_out.execute("SELECT value FROM metadata WHERE name = 'bounds'")
+        bounds = cur_out.fetchone()[0]  # Fetch the value
+        if bounds:
+            min_bound = get_max_bound(bounds)
+
+            cur_out.execute('''
+                UPDATE metadata 
+                SET value = ? 
+                WHERE name = 'bounds'
+                ''', (min_bound,))
+
+        # Update center
+        cur_out.execute("SELECT value FROM metadata WHERE name = 'bounds'")
+        bound = cur_out.fetchone()[0]  
+        center = get_center_of_bound(bound)
+        center_of_bound = ''
+        if center != '':
+            center_of_bound = center +f',{max_zoom}'
+
+        cur_out.execute('''
+            UPDATE metadata 
+            SET value = ? 
+            WHERE name = 'center'
+            ''', (center_of_bound,))
+
+        # Update description
+        description = 'Merge multiple MBTiles files into a single MBTiles file using mbtilesmerge from vtiles'
+        cur_out.execute('''
+            INSERT OR REPLACE INTO metadata (name, value)
+            VALUES ('description', ?)
+        ''', (description,))
+    
+        checkpoint.clear()
+        conn_out.commit()
+        conn_out.execute("PRAGMA journal_mode=DELETE;")
+        print(f"Successfully merged metadata into {output_mbtiles}")
+        
+    except Exception as e:
+        logging.error(f"Error Merging metadata: {e}")
+
+    finally:
+        conn_out.close()
 
 def main():
     parser = argparse.ArgumentParser(description="Merge multiple vector MBTiles files into a single MBTiles file.")
     parser.add_argument('input', nargs='+', help='Paths to the input MBTiles files to merge.')
     parser.add_argument('-o', '--output', help='Output merged MBTiles file. Defaults to "merged.mbtiles" in the current directory.')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes merging overlapping tiles (default: number of CPUs).')
+    parser.add_argument('--batch-size', type=int, default=10000, help='Number of tiles written per transaction (default: 10000).')
+    parser.add_argument('--passthrough', action='store_true', help='Copy non-overlapping tiles byte for byte in SQL and only merge overlapping tiles in Python.')
+    parser.add_argument('--reencode', action='store_true', help='Decode and re-encode overlapping tiles instead of concatenating their layers at the protobuf level.')
+    parser.add_argument('--resume', action='store_true', help='Continue an interrupted merge from its checkpoint in the output file.')
 
     args = parser.parse_args()
     for file in args.input:
@@ -367,7 +622,7 @@ def main():
 
     if args.output:
         output_file = os.path.abspath(args.output)
-        if os.path.exists(output_file):
+        if os.path.exists(output_file) and not args.resume:
             logger.error(f'Output MBTiles file {output_file} already exists!. Please recheck and input a correct one. Ex: -o merged.mbtiles')
             sys.exit(1)
         elif not output_file.endswith('mbtiles'):
@@ -375,11 +630,11 @@ def main():
             sys.exit(1)
     else:
         output_file = os.path.join(os.getcwd(), 'merged.mbtiles')
-        if os.path.exists(output_file): 
+        if os.path.exists(output_file) and not args.resume: 
             logger.error(f'Output MBTiles file {output_file} already exists! Please recheck and input a correct one. Ex: -o merged.mbtiles')
             sys.exit(1)          
 
-    merge_mbtiles(args.input, output_file)
+    merge_mbtiles(args.input, output_file, args.workers, args.batch_size, args.passthrough, args.reencode, args.resume)
 
 
 if __name__ == '__main__':
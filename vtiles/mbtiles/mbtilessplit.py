@@ -1,14 +1,15 @@
 import sqlite3
 import shutil
-import gzip, zlib
+from vtiles.utils import codec
 import json
 import argparse, sys, os
 from tqdm import tqdm
-from vtiles.utils.mapbox_vector_tile import encode, decode
-from vtiles.utils.geopreocessing import fix_wkt
+from vtiles.utils.mapbox_vector_tile import encode, TileView
+from vtiles.utils.geopreocessing import decode_tile_layers
 import logging
 from vtiles.mbtiles.mbtilesfixmeta import fix_vectormetadata
 from vtiles.utils.geopreocessing import check_vector
+from vtiles.utils.checkpoint import MBTilesCheckpoint, CheckpointError, checkpoint_signature, after_key, TILE_KEY_ORDER
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -34,13 +35,56 @@ def process_metadata(metadata_json, layers_to_keep, exclude=False):
     return metadata_json
 
 
-def process_mbtiles(input_mbtiles, output_mbtiles, layers_to_keep, keep_layers=True):
+def split_tile(tile_data, layers_to_keep, keep_layers=True, tile_codec=None):
+    """
+    Return the gzipped tile with only the kept layers, or None if no layer is left.
+    tile_codec is the codec declared by the input, brotli tiles cannot be detected from their bytes.
+    """
+    tile = TileView(codec.decode(tile_data, tile_codec))
+
+    # Only the geometries of the kept layers are decoded
+    kept_layers = [name for name in tile.layer_names if (name in layers_to_keep) == keep_layers]
+    if not kept_layers:
+        return None
+    # Decoded geometries are trusted, they are encoded again without shapely
+    filtered_tile, extents = decode_tile_layers(tile, kept_layers, trusted=True)
+    encoded_tile = encode(filtered_tile, per_layer_options={name: {"extents": extent} for name, extent in extents.items()})
+    return codec.encode(encoded_tile, 'gzip')
+
+
+def process_mbtiles(input_mbtiles, output_mbtiles, layers_to_keep, keep_layers=True, batch_size=1000, resume=False):
+    """
+    Tiles are split in batches in (zoom_level, tile_column, tile_row) order, each batch is committed together with a
+    checkpoint holding its last tile, so with resume an interrupted run continues after it.
+    """
     is_vector, compression_type = check_vector(input_mbtiles) 
     desc = 'Update metadata by vtiles.mbtiles.mbtilesfixmeta' 
-    if is_vector:
-        fix_vectormetadata(input_mbtiles, compression_type,desc)    
-        shutil.copyfile(input_mbtiles, output_mbtiles)    
-        with sqlite3.connect(output_mbtiles) as conn:
+    if not is_vector:
+        return
+    fix_vectormetadata(input_mbtiles, compression_type,desc)    
+    checkpoint_args = checkpoint_signature([input_mbtiles], task='mbtilessplit', layers=sorted(layers_to_keep),
+                                           keep_layers=keep_layers)
+
+    if resume and os.path.exists(output_mbtiles):
+        conn = sqlite3.connect(output_mbtiles)
+        checkpoint = MBTilesCheckpoint(conn, checkpoint_args)
+        try:
+            state = checkpoint.load()
+        except CheckpointError as e:
+            logger.error(f'Cannot resume {output_mbtiles}: {e}')
+            logger.error(f'Run without --resume to write {output_mbtiles} again.')
+            conn.close()
+            sys.exit(1)
+        if state is None:
+            logger.info(f'{output_mbtiles} is already complete, nothing to resume.')
+            conn.close()
+            return
+        logger.info(f"Resuming {output_mbtiles} after tile {state['key']}.")
+    else:
+        # The output gets its checkpoint before it is renamed into place: an existing output without checkpoint is complete
+        tmp_mbtiles = output_mbtiles + '.tmp'
+        shutil.copyfile(input_mbtiles, tmp_mbtiles)    
+        with sqlite3.connect(tmp_mbtiles) as conn:
             cursor = conn.cursor()
             
             cursor.execute("SELECT name, value FROM metadata WHERE name = 'json'")
@@ -53,6 +97,10 @@ def process_mbtiles(input_mbtiles, output_mbtiles, layers_to_keep, keep_layers=T
                 cursor.execute("DELETE FROM metadata WHERE name = 'json'")
                 cursor.execute("INSERT INTO metadata (name, value) VALUES ('json', ?)", (json.dumps(processed_metadata),))
             
+            # Split tiles are gzipped
+            cursor.execute("DELETE FROM metadata WHERE name IN ('compression', ?)", (codec.DICTIONARY_METADATA,))
+            cursor.execute("INSERT INTO metadata (name, value) VALUES ('compression', 'gzip')")
+
             cursor.execute("SELECT type FROM sqlite_master WHERE name='tiles'")
             result = cursor.fetchone()
             if result:
@@ -70,53 +118,61 @@ def process_mbtiles(input_mbtiles, output_mbtiles, layers_to_keep, keep_layers=T
                 )
             """)
             cursor.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
-            
-            try:
-                with sqlite3.connect(input_mbtiles) as in_conn:
-                    in_cursor = in_conn.cursor()
-                    in_cursor.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles ORDER BY zoom_level")
-                    tiles = in_cursor.fetchall()
-                    
-                    for zoom_level, tile_column, tile_row, tile_data in tqdm(tiles, desc="Processing tiles", unit=" tiles"):
-                        if tile_data[:2] == b'\x1f\x8b':
-                            tile_data = gzip.decompress(tile_data)
-                        elif tile_data[:2] in [b'\x78\x9c', b'\x78\x01', b'\x78\xda']:
-                            tile_data = zlib.decompress(tile_data)
-                        
-                        decoded_tile = decode(tile_data)
-                        decoded_tile = fix_wkt(decoded_tile)
-                        
-                        if keep_layers:
-                            filtered_tile = [item for item in decoded_tile if item["name"] in layers_to_keep]
-                        else:
-                            filtered_tile = [item for item in decoded_tile if item["name"] not in layers_to_keep]
-                        
-                        if filtered_tile:
-                            try:
-                                encoded_tile = encode(filtered_tile)
-                                encoded_tile_gzip = gzip.compress(encoded_tile)
-                                cursor.execute("""
-                                    INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data)
-                                    VALUES (?, ?, ?, ?)""", (zoom_level, tile_column, tile_row, encoded_tile_gzip))
-                            except Exception as e:
-                                logger.error(f"Error encoding tile {zoom_level}/{tile_column}/{tile_row}: {e}")
-                
-                description = 'Splitting MBTiles file by selected layers using mbtilessplit from vtiles'
-                cursor.execute('''
-                    INSERT OR REPLACE INTO metadata (name, value)
-                    VALUES ('description', ?)
-                ''', (description,))
-                
-                conn.commit()
-                if keep_layers:
-                    logger.info(f'Successfully saved split MBTiles into {output_mbtiles}')
-                else:
-                    logger.info(f'Successfully saved remaining MBTiles into {output_mbtiles}')
-            
-            except sqlite3.Error as e:
-                logger.error(f"Database error: {e}")
-            except Exception as e:
-                logger.error(f"Unexpected error: {e}")
+            state = {'key': None}
+            MBTilesCheckpoint(conn, checkpoint_args).start(state)
+        conn.close()
+        os.replace(tmp_mbtiles, output_mbtiles)
+        conn = sqlite3.connect(output_mbtiles)
+        checkpoint = MBTilesCheckpoint(conn, checkpoint_args)
+
+    cursor = conn.cursor()
+    try:
+        with sqlite3.connect(f'file:{input_mbtiles}?mode=ro', uri=True) as in_conn:
+            in_cursor = in_conn.cursor()
+            condition, params = after_key(state['key'])
+            total = in_cursor.execute(f"SELECT COUNT(*) FROM tiles WHERE {condition}", params).fetchone()[0]
+            in_cursor.execute(f"SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles WHERE {condition} {TILE_KEY_ORDER}", params)
+
+            with tqdm(total=total, desc="Processing tiles", unit=" tiles") as pbar:
+                while True:
+                    tiles = in_cursor.fetchmany(batch_size)
+                    if not tiles:
+                        break
+                    rows = []
+                    for zoom_level, tile_column, tile_row, tile_data in tiles:
+                        try:
+                            split_tile_data = split_tile(tile_data, layers_to_keep, keep_layers, compression_type)
+                            if split_tile_data is not None:
+                                rows.append((zoom_level, tile_column, tile_row, split_tile_data))
+                        except Exception as e:
+                            logger.error(f"Error encoding tile {zoom_level}/{tile_column}/{tile_row}: {e}")
+                    cursor.executemany("""
+                        INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data)
+                        VALUES (?, ?, ?, ?)""", rows)
+                    state['key'] = list(tiles[-1][:3])
+                    checkpoint.save(state)
+                    conn.commit()  # Commit batch and checkpoint
+                    pbar.update(len(tiles))
+        
+        description = 'Splitting MBTiles file by selected layers using mbtilessplit from vtiles'
+        cursor.execute('''
+            INSERT OR REPLACE INTO metadata (name, value)
+            VALUES ('description', ?)
+        ''', (description,))
+        
+        checkpoint.clear()
+        conn.commit()
+        if keep_layers:
+            logger.info(f'Successfully saved split MBTiles into {output_mbtiles}')
+        else:
+            logger.info(f'Successfully saved remaining MBTiles into {output_mbtiles}')
+    
+    except sqlite3.Error as e:
+        logger.error(f"Database error: {e}")
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+    finally:
+        conn.close()
 
 
 def main():
@@ -124,6 +180,7 @@ def main():
     parser.add_argument('input', help='Path to the input MBTiles file.')
     parser.add_argument('-o', '--output', help='Path to the output splitted MBTiles file.')
     parser.add_argument("-l", "--layers", nargs='+', required=True, help="List of layer names to be splitted")
+    parser.add_argument('--resume', action='store_true', help='Continue an interrupted run from the checkpoints in the output files.')
 
     args = parser.parse_args()
     if not os.path.exists(args.input):
@@ -134,7 +191,7 @@ def main():
     # Determine the output filename
     if args.output:
         output_file_abspath = os.path.abspath(args.output)
-        if os.path.exists(output_file_abspath):
+        if os.path.exists(output_file_abspath) and not args.resume:
             logger.error(f'Output MBTiles  {output_file_abspath} already exists!. Please recheck and input a correct one. Ex: -o tiles.mbtiles')
             sys.exit(1)
         elif not output_file_abspath.endswith('mbtiles'):
@@ -144,14 +201,15 @@ def main():
         output_file_name = os.path.basename(input_file_abspath).replace('.mbtiles', '_splitted.mbtiles')
         output_file_abspath = os.path.join(os.path.dirname(input_file_abspath), output_file_name)
  
-        if os.path.exists(output_file_abspath): 
+        if os.path.exists(output_file_abspath) and not args.resume: 
             logger.error(f'Output MBTiles  {output_file_abspath} already exists! Please recheck and input a correct one. Ex: -o tiles.mbtiles')
             sys.exit(1)          
     
     logger.info(f'Splitting {input_file_abspath} to {output_file_abspath}')
-    process_mbtiles(input_file_abspath, output_file_name, args.layers, keep_layers=True)
-    remaining_output = os.path.basename(input_file_abspath).replace('.mbtiles', '_remained.mbtiles')
-    process_mbtiles(input_file_abspath, remaining_output, args.layers, keep_layers=False)
+    process_mbtiles(input_file_abspath, output_file_abspath, args.layers, keep_layers=True, resume=args.resume)
+    remaining_output = os.path.join(os.path.dirname(output_file_abspath),
+                                    os.path.basename(input_file_abspath).replace('.mbtiles', '_remained.mbtiles'))
+    process_mbtiles(input_file_abspath, remaining_output, args.layers, keep_layers=False, resume=args.resume)
     logger.info('Splitting MBTiles done!')
 
 if __name__ == "__main__":
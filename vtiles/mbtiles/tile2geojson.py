@@ -3,7 +3,7 @@ import argparse
 import sqlite3
 import os, sys
 from vtiles.utils.vt2geojson.tools import vt_bytes_to_geojson, _is_url
-import gzip, zlib
+from vtiles.utils.codec import decode
 import logging
 from re import search
 from urllib.request import urlopen
@@ -35,10 +35,7 @@ def process_tile_data(input_path, z, x, y, output, flipy):
     # Decompress tile data if needed
     if tile_data:
         try:
-            if tile_data[:2] == b'\x1f\x8b':  # Check for gzip magic number
-                tile_data = gzip.decompress(tile_data)
-            elif tile_data[:2] in [b'\x78\x9c', b'\x78\x01', b'\x78\xda']:  # zlib headers
-                tile_data = zlib.decompress(tile_data)
+            tile_data = decode(tile_data)
         except Exception as e:
             logger.error(f"Failed to decompress tile data: {e}")
             return
@@ -1,7 +1,6 @@
-from vtiles.utils.mapbox_vector_tile import decode
+from vtiles.utils.mapbox_vector_tile import TileView
 import sys
-import gzip
-import zlib
+from vtiles.utils.codec import sniff
 import os
 from datetime import datetime
 
@@ -10,31 +9,34 @@ def read_pbf_tile(tile_data):
         with open(tile_data, 'rb') as f:
             tile_data = f.read()
 
-        # Check for GZIP compression
-        if tile_data[:2] == b'\x1f\x8b':
-            compression_type = 'GZIP'
-            tile_data = gzip.decompress(tile_data)
-        # Check for ZLIB compression
-        elif tile_data[:2] == b'\x78\x9c' or tile_data[:2] == b'\x78\x01' or tile_data[:2] == b'\x78\xda':
-            compression_type = 'ZLIB'
-            tile_data = zlib.decompress(tile_data)
+        # Check for GZIP, ZLIB or ZSTD compression
+        codec = sniff(tile_data)
+        if codec is not None:
+            compression_type = codec.name.upper()
+            tile_data = codec.decompress(tile_data)
         else:
             compression_type = 'None'
 
-        # Decode the tile data
-        tile = decode(tile_data)
+        # Parse the tile data, the geometries are not decoded
+        tile = TileView(tile_data)
         return tile, compression_type
 
     except Exception as e:
         print(f"Error reading or decoding the PBF file: {e}")
         sys.exit(1)
 
-def count_feature_types(layer_data):
-    from collections import defaultdict
-    feature_types_count = defaultdict(int)  # Use defaultdict to count feature types
-    for feature in layer_data['features']:
-        geometry_type = feature['geometry']['type']
-        feature_types_count[geometry_type] += 1
+def count_feature_types(layer):
+    """
+    Number of features of each geometry type, as decode names them: Multi* when a feature has several parts. The
+    parts are counted from the geometry arrays, without building the geometries
+    """
+    labels = {}
+    for geometry_type, arrays in layer.geometry_arrays().items():
+        for index, parts in zip(arrays.features.tolist(), arrays.part_counts().tolist()):
+            labels[index] = geometry_type if parts == 1 else f'Multi{geometry_type}'
+    feature_types_count = {}
+    for index, feature_type in sorted(labels.items()):
+        feature_types_count[feature_type] = feature_types_count.get(feature_type, 0) + 1
     return feature_types_count
 
 def main():
@@ -57,15 +59,15 @@ def main():
     print(f"Compression type: {compression_type}")
     # Print layer information
     print("==============")
-    for layer_name, layer_data in tile_data.items():
-        num_features = len(layer_data['features'])
-        feature_types_count = count_feature_types(layer_data)
-        
-        print(f"Layer '{layer_name}':")
-        print(f"  Total features: {num_features} features")
+    for layer in tile_data:
+        print(f"Layer '{layer.name}':")
+        print(f"  Total features: {layer.feature_count} features")
         print("  Feature types:")
-        for feature_type, count in feature_types_count.items():
+        for feature_type, count in count_feature_types(layer).items():
             print(f"    {feature_type}: {count} features")
+        print("  Fields:")
+        for field, field_type in layer.fields.items():
+            print(f"    {field}: {field_type}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,183 @@
+import argparse, sys, os
+import sqlite3
+import hashlib
+import logging
+from tqdm import tqdm
+from vtiles.utils.geopreocessing import check_vector, get_tile_codec, get_tile_dictionary
+from vtiles.utils.codec import decode, get_codec, train_dictionary, DICTIONARY_SIZE, DICTIONARY_SAMPLES
+from vtiles.utils.pmtiles.reader import Reader, MmapSource, all_runs
+from vtiles.utils.pmtiles.tile import TileType
+from vtiles.utils.pmtiles.convert import recompress_pmtiles
+from vtiles.mbtiles.mbtilescompress import compress_mbtiles, read_tile_dictionary, log_throughput, MBTILESCOMPRESS_WORKERS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def sampled(index, samples, total):
+    # Picks samples of the total tiles evenly, so the samples cover all the zoom levels of the archive
+    return (index * samples) % max(total, 1) < samples
+
+def distinct_samples(tiles, samples):
+    """
+    Up to samples distinct tile contents of the tiles iterable, identical tiles (ocean, empty tiles) are kept once so
+    they do not outweigh the others in the dictionary
+    """
+    seen = set()
+    result = []
+    for tile_data in tiles:
+        digest = hashlib.blake2b(tile_data, digest_size=16).digest()
+        if digest in seen:
+            continue
+        seen.add(digest)
+        result.append(tile_data)
+        if len(result) >= samples:
+            break
+    return result
+
+def sample_mbtiles(mbtiles, samples=DICTIONARY_SAMPLES):
+    """
+    Decompressed tile contents sampled evenly from the tiles of an MBTiles
+    """
+    conn = sqlite3.connect(f"file:{mbtiles}?mode=ro", uri=True)
+    try:
+        cursor = conn.cursor()
+        tile_codec = get_tile_codec(cursor)
+        dictionary = get_tile_dictionary(cursor)
+        total = cursor.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+
+        def tiles():
+            cursor.execute("SELECT tile_data FROM tiles")
+            with tqdm(total=total, desc="Sampling tiles", unit=" tiles") as pbar:
+                index = 0
+                while True:
+                    rows = cursor.fetchmany(1000)
+                    if not rows:
+                        break
+                    for (tile_data,) in rows:
+                        if sampled(index, samples, total):
+                            yield decode(tile_data, tile_codec, dictionary)
+                        index += 1
+                    pbar.update(len(rows))
+
+        return distinct_samples(tiles(), samples)
+    finally:
+        conn.close()
+
+def sample_pmtiles(pmtiles, samples=DICTIONARY_SAMPLES):
+    """
+    Decompressed tile contents sampled evenly from the tile entries of a PMTiles
+    """
+    with open(pmtiles, "rb") as f:
+        source = MmapSource(f)
+        reader = Reader(source)
+        header = reader.header()
+        if header["tile_type"] != TileType.MVT:
+            raise ValueError(f"{pmtiles} does not hold vector tiles")
+        tile_codec = get_codec(header["tile_compression"])
+        dictionary = reader.tile_dictionary()
+        total = header["tile_entries_count"]
+
+        def tiles():
+            for index, (tile_id, run_length, offset, tile_data) in enumerate(all_runs(source)):
+                if sampled(index, samples, total):
+                    yield decode(bytes(tile_data), tile_codec, dictionary)
+
+        return distinct_samples(tiles(), samples)
+
+def sample_tiles(path, samples=DICTIONARY_SAMPLES):
+    if path.endswith('.pmtiles'):
+        return sample_pmtiles(path, samples)
+    return sample_mbtiles(path, samples)
+
+def train_tiles_dictionary(path, size=DICTIONARY_SIZE, samples=DICTIONARY_SAMPLES, level=None):
+    """
+    Train a zstd dictionary of size bytes on up to samples distinct tiles of an MBTiles or PMTiles
+    """
+    tiles = sample_tiles(path, samples)
+    logger.info(f"Training a {size} bytes zstd dictionary on {len(tiles)} tiles "
+                f"({sum(len(tile) for tile in tiles) / 1e6:.1f} MB).")
+    try:
+        return train_dictionary(tiles, size, level)
+    except Exception as e:
+        # zstd needs many more sample bytes than the dictionary size
+        raise ValueError(f"Failed to train the dictionary on {len(tiles)} tiles: {e}")
+
+def dictionary_compress(input_path, output_path, size=DICTIONARY_SIZE, samples=DICTIONARY_SAMPLES, level=None,
+                        workers=MBTILESCOMPRESS_WORKERS, resume=False):
+    """
+    Train a zstd dictionary on the tiles of input_path (MBTiles or PMTiles) and write output_path (the same format)
+    with the tiles compressed with zstd and the dictionary, stored in its metadata. With resume, an interrupted
+    MBTiles output continues with the dictionary it already holds.
+    Returns the dictionary.
+    """
+    dictionary = None
+    if resume and output_path.endswith('.mbtiles') and os.path.exists(output_path):
+        dictionary = read_tile_dictionary(output_path)
+    if dictionary is None:
+        dictionary = train_tiles_dictionary(input_path, size, samples, level)
+    if input_path.endswith('.pmtiles'):
+        stats = recompress_pmtiles(input_path, output_path, 'zstd', level, dictionary, progress=tqdm)
+        logger.info(f"{stats['addressed_tiles']} tiles, {stats['tile_contents']} unique contents.")
+    else:
+        stats = compress_mbtiles(input_path, output_path, 'zstd', level, workers, resume=resume, dictionary=dictionary)
+        if stats:
+            log_throughput(stats)
+    return dictionary
+
+def main():
+    parser = argparse.ArgumentParser(description='Train a zstd dictionary on the tiles of a vector MBTiles or PMTiles and compress them with it.')
+    parser.add_argument('input', help='Path to the input MBTiles or PMTiles file.')
+    parser.add_argument('-o', '--output', help='Path to the output file, of the same format as the input.')
+    parser.add_argument('-s', '--size', type=int, default=DICTIONARY_SIZE, help=f'Dictionary size in bytes (default: {DICTIONARY_SIZE}).')
+    parser.add_argument('-n', '--samples', type=int, default=DICTIONARY_SAMPLES, help=f'Number of distinct tiles the dictionary is trained on (default: {DICTIONARY_SAMPLES}).')
+    parser.add_argument('-l', '--level', type=int, help='zstd compression level (default: 3).')
+    parser.add_argument('-w', '--workers', type=int, default=MBTILESCOMPRESS_WORKERS, help=f'Number of compressing processes for MBTiles (default: {MBTILESCOMPRESS_WORKERS}).')
+    parser.add_argument('--resume', action='store_true', help='Continue an interrupted MBTiles run from its checkpoint in the output file.')
+
+    args = parser.parse_args()
+    if not os.path.exists(args.input):
+        logging.error('Input file does not exist! Please recheck and input a correct file path.')
+        sys.exit(1)
+
+    input_file_abspath = os.path.abspath(args.input)
+    ext = os.path.splitext(input_file_abspath)[1]
+    if ext not in ('.mbtiles', '.pmtiles'):
+        logger.error(f'Input file {input_file_abspath} must be an .mbtiles or a .pmtiles file.')
+        sys.exit(1)
+    # Determine the output filename
+    if args.output:
+        output_file_abspath = os.path.abspath(args.output)
+        if not output_file_abspath.endswith(ext):
+            logger.error(f'Output file {output_file_abspath} must end with {ext}. Please recheck and input a correct one. Ex: -o tiles{ext}')
+            sys.exit(1)
+    else:
+        output_file_name = os.path.basename(input_file_abspath).replace(ext, f'_zstd_dict{ext}')
+        output_file_abspath = os.path.join(os.path.dirname(input_file_abspath), output_file_name)
+    if os.path.exists(output_file_abspath) and not (args.resume and ext == '.mbtiles'):
+        logger.error(f'Output file {output_file_abspath} already exists! Please recheck and input a correct one. Ex: -o tiles{ext}')
+        sys.exit(1)
+
+    try:
+        get_codec('zstd').check(args.level)
+    except ValueError as e:
+        logger.error(e)
+        sys.exit(1)
+
+    if ext == '.mbtiles':
+        is_vector, _ = check_vector(input_file_abspath)
+        if not is_vector:
+            logging.warning(f'tilesdict only supports vector tiles. {input_file_abspath} is not a vector MBTiles.')
+            sys.exit(1)
+
+    logging.info(f'Compressing {input_file_abspath} to {output_file_abspath} with a trained zstd dictionary.')
+    try:
+        dictionary = dictionary_compress(input_file_abspath, output_file_abspath, args.size, args.samples, args.level,
+                                         args.workers, args.resume)
+    except ValueError as e:
+        logger.error(e)
+        sys.exit(1)
+    logging.info(f'{len(dictionary)} bytes dictionary stored in the metadata, '
+                 f'{os.path.getsize(input_file_abspath) / 1e6:.1f} MB -> {os.path.getsize(output_file_abspath) / 1e6:.1f} MB.')
+
+if __name__ == "__main__":
+    main()
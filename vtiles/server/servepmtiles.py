@@ -6,6 +6,7 @@ import json
 import re
 from socketserver import ThreadingMixIn
 from vtiles.utils.pmtiles.reader import Reader, MmapSource
+from vtiles.utils.codec import get_codec, content_encoding, without_dictionary
 import logging
 
 logger = logging.getLogger(__name__)
@@ -32,13 +33,16 @@ def main():
     input_file_abspath = os.path.abspath(args.input)
 
     with open(input_file_abspath, "r+b") as f:
-        source = MmapSource(f)
+        source = MmapSource(f, zero_copy=True)
         reader = Reader(source)
 
         # Accessing format information from reader.header() dictionary
         header = reader.header()
         fmt = header["tile_type"]
         fmt = 'pbf'
+        # Tiles are served as stored, with the codec of the header
+        tile_codec = get_codec(header["tile_compression"])
+        tile_dictionary = reader.tile_dictionary()
 
         class Handler(http.server.SimpleHTTPRequestHandler):
             def do_GET(self):
@@ -69,7 +73,11 @@ def main():
                     self.send_header("Access-Control-Allow-Origin", "*")
                 if fmt == "pbf":
                     self.send_header("Content-Type", "application/x-protobuf")
-                    self.send_header("Content-Encoding", "gzip")
+                    # Clients do not have the zstd dictionary of the archive
+                    data = without_dictionary(data, tile_codec, tile_dictionary)
+                    encoding = content_encoding(data, tile_codec)
+                    if encoding is not None:
+                        self.send_header("Content-Encoding", encoding)
                 else:
                     self.send_header("Content-Type", "image/" + fmt)
                 self.end_headers()
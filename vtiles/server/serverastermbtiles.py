@@ -9,12 +9,12 @@ https://github.com/mapbox/mbtiles-spec
 """
 import os
 import json
-import sqlite3
 import mimetypes
 import logging
 from wsgiref.util import shift_path_info
 from wsgiref.simple_server import make_server, WSGIServer
 from socketserver import ThreadingMixIn
+from vtiles.server.tilestore import MBTilesTileStore, TILESTORE_CACHE_BYTES, TILESTORE_POOL_SIZE
 
 
 logger = logging.getLogger(__name__)
@@ -51,16 +51,15 @@ class MBTilesApplication:
     https://github.com/mapbox/mbtiles-spec
     """
 
-    def __init__(self, mbtiles_filepath, tile_image_ext='.png', zoom_offset=0):
+    def __init__(self, mbtiles_filepath, tile_image_ext='.png', zoom_offset=0,
+                 pool_size=TILESTORE_POOL_SIZE, cache_bytes=TILESTORE_CACHE_BYTES):
         if mbtiles_filepath is None or not os.path.exists(mbtiles_filepath):
             raise MBTilesFileNotFound(mbtiles_filepath)
 
         if tile_image_ext not in SUPPORTED_IMAGE_EXTENSIONS:
             raise InvalidImageExtension("{} not in {}!".format(tile_image_ext, SUPPORTED_IMAGE_EXTENSIONS))
 
-        self.mbtiles_db = sqlite3.connect(
-            "file:{}?mode=ro".format(mbtiles_filepath),
-            check_same_thread=False, uri=True)
+        self.tile_store = MBTilesTileStore(mbtiles_filepath, pool_size=pool_size, cache_bytes=cache_bytes)
         self.tile_image_ext = tile_image_ext
         self.tile_content_type = mimetypes.types_map[tile_image_ext.lower()]
         self.zoom_offset = zoom_offset
@@ -77,7 +76,7 @@ class MBTilesApplication:
         """
         query = 'SELECT name, value FROM metadata WHERE name="minzoom" OR name="maxzoom";'
         # add maxzoom, minzoom to instance
-        for name, value in self.mbtiles_db.execute(query):
+        for name, value in self.tile_store.execute(query):
             setattr(self, name.lower(), max(int(value) - self.zoom_offset, 0))
 
     def __call__(self, environ, start_response):
@@ -88,7 +87,7 @@ class MBTilesApplication:
             # handle 'metadata' requests
             if base_uri == 'metadata':
                 query = 'SELECT * FROM metadata;'
-                metadata_results = self.mbtiles_db.execute(query).fetchall()
+                metadata_results = self.tile_store.execute(query)
                 if metadata_results:
                     status = '200 OK'
                     response_headers = [('Content-type', 'application/json')]
@@ -123,16 +122,13 @@ class MBTilesApplication:
                     start_response(status, response_headers)
                     return ['Unable to parse PATH_INFO({}), expecting "z/x/y.(png|jpg)"'.format(environ['PATH_INFO']).encode('utf8'), ' '.join(i for i in e.args).encode('utf8')]
 
-                query = 'SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?;'
                 if not USE_OSGEO_TMS_TILE_ADDRESSING:
                     # adjust y to use XYZ google addressing
                     ymax = 1 << zoom
                     y = ymax - y - 1
-                values = (zoom, x, y)
-                tile_results = self.mbtiles_db.execute(query, values).fetchone()
+                tile_result = self.tile_store.get_tile(zoom, x, y)
 
-                if tile_results:
-                    tile_result = tile_results[0]
+                if tile_result is not None:
                     status = '200 OK'
                     response_headers = [('Content-type', self.tile_content_type)]
                     start_response(status, response_headers)
@@ -173,6 +169,14 @@ def main():
                         default=MBTILES_ZOOM_OFFSET,
                         type=int,
                         help="mbtiles zoom offset [DEFAULT={}]\n(Defaults to environment variable, 'MBTILES_ZOOM_OFFSET')".format(MBTILES_ZOOM_OFFSET))
+    parser.add_argument('--pool-size',
+                        default=TILESTORE_POOL_SIZE,
+                        type=int,
+                        help="Number of read-only sqlite connections [DEFAULT={}]".format(TILESTORE_POOL_SIZE))
+    parser.add_argument('--cache-mb',
+                        default=TILESTORE_CACHE_BYTES // (1024 * 1024),
+                        type=int,
+                        help="Size of the in-memory tile cache in MB, 0 to disable [DEFAULT={}]".format(TILESTORE_CACHE_BYTES // (1024 * 1024)))
     args = parser.parse_args()
     args.filepath = os.path.abspath(args.filepath)
 
@@ -192,7 +196,8 @@ def main():
 
         class ThreadingWSGIServer(ThreadingMixIn, WSGIServer): pass
 
-        mbtiles_app = MBTilesApplication(mbtiles_filepath=args.filepath, tile_image_ext=args.ext, zoom_offset=args.zoom_offset)
+        mbtiles_app = MBTilesApplication(mbtiles_filepath=args.filepath, tile_image_ext=args.ext, zoom_offset=args.zoom_offset,
+                                         pool_size=args.pool_size, cache_bytes=args.cache_mb * 1024 * 1024)
         server = make_server(args.address, args.port, mbtiles_app, ThreadingWSGIServer)
         try:
             server.serve_forever()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+ASGI tile server
+
+Serves several tilesets (.mbtiles, .pmtiles and tiles folders) from one process:
+    /                               list of mounted tilesets
+    /{tileset}/metadata             tileset metadata as JSON
+    /{tileset}/{z}/{x}/{y}.{ext}    tile (XYZ tiling scheme)
+
+Storage is read in a bounded thread pool so the event loop never blocks on sqlite or disk I/O.
+Run it with any ASGI server, e.g. `uvicorn`, which keeps HTTP/1.1 connections alive between requests.
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from vtiles.server.tilestore import MBTilesTileStore, TileCache, TILESTORE_CACHE_BYTES, TILESTORE_POOL_SIZE
+from vtiles.utils.pmtiles.reader import Reader, MmapSource
+from vtiles.utils.pmtiles.tile import TileType, Compression
+from vtiles.utils.codec import get_codec, recode, decode, content_encoding, accepts_encoding, uses_dictionary, CODEC_NAMES
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Default settings
+SERVETILES_HOST = '0.0.0.0'
+SERVETILES_PORT = 8080
+SERVETILES_WORKERS = TILESTORE_POOL_SIZE
+SERVETILES_MAX_PENDING = 1024
+# Codec of the tiles compressed with a zstd dictionary, which clients cannot decode
+SERVETILES_DICTIONARY_CODEC = 'gzip'
+
+CONTENT_TYPES = {
+    'pbf': 'application/x-protobuf',
+    'mvt': 'application/x-protobuf',
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+    'avif': 'image/avif',
+}
+VECTOR_EXTS = ('pbf', 'mvt')
+
+
+class InvalidTileset(Exception):
+    pass
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(range_header, size):
+    """
+    Parse a single "bytes=start-end" range into (start, end) inclusive, None if the header should be ignored
+    """
+    unit, _, ranges = range_header.partition('=')
+    if unit.strip() != 'bytes' or ',' in ranges:
+        # Multipart ranges are not supported, answer with the full tile
+        return None
+    start, _, end = ranges.strip().partition('-')
+    try:
+        if start == '':
+            length = int(end)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(size - length, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+class MBTilesTileset:
+    def __init__(self, path, pool_size=TILESTORE_POOL_SIZE, cache_bytes=TILESTORE_CACHE_BYTES):
+        self.store = MBTilesTileStore(path, pool_size=pool_size, cache_bytes=cache_bytes)
+        metadata = self.metadata()
+        self.ext = metadata.get('format', 'pbf')
+        # Declared codec, needed for brotli tiles which cannot be sniffed
+        self.codec = self.store.tile_codec()
+        self.dictionary = self.store.tile_dictionary()
+
+    def metadata(self):
+        return {name: value for name, value in self.store.execute('SELECT name, value FROM metadata;')}
+
+    def get_tile(self, z, x, y):
+        return self.store.get_tile(z, x, (1 << z) - 1 - y)
+
+    def close(self):
+        self.store.close()
+
+
+class PMTilesTileset:
+    def __init__(self, path):
+        self.f = open(path, 'rb')
+        self.reader = Reader(MmapSource(self.f, zero_copy=True))
+        tile_type = self.reader.header()['tile_type']
+        self.codec = get_codec(self.reader.header()['tile_compression'])
+        self.dictionary = self.reader.tile_dictionary()
+        self.ext = {TileType.MVT: 'pbf', TileType.PNG: 'png', TileType.JPEG: 'jpg',
+                    TileType.WEBP: 'webp', TileType.AVIF: 'avif'}.get(tile_type, 'pbf')
+
+    def metadata(self):
+        header = {k: (v.name if isinstance(v, (TileType, Compression)) else v) for k, v in self.reader.header().items()}
+        return {'header': header, 'metadata': self.reader.metadata()}
+
+    def get_tile(self, z, x, y):
+        return self.reader.get(z, x, y)
+
+    def close(self):
+        self.f.close()
+
+
+class FolderTileset:
+    def __init__(self, path, ext='pbf'):
+        self.path = path
+        self.ext = ext
+        self.codec = None
+        self.dictionary = None
+
+    def metadata(self):
+        metadata_path = os.path.join(self.path, 'metadata.json')
+        if not os.path.exists(metadata_path):
+            return {}
+        with open(metadata_path, 'r') as f:
+            return json.load(f)
+
+    def get_tile(self, z, x, y):
+        try:
+            with open(os.path.join(self.path, str(z), str(x), f'{y}.{self.ext}'), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def close(self):
+        pass
+
+
+def open_tileset(path, pool_size=TILESTORE_POOL_SIZE, cache_bytes=TILESTORE_CACHE_BYTES, folder_ext='pbf'):
+    if os.path.isdir(path):
+        return FolderTileset(path, folder_ext)
+    elif path.endswith('.mbtiles'):
+        return MBTilesTileset(path, pool_size, cache_bytes)
+    elif path.endswith('.pmtiles'):
+        return PMTilesTileset(path)
+    raise InvalidTileset(f'{path} is not a tiles folder, an .mbtiles or a .pmtiles file')
+
+
+class TileServerApplication:
+    """
+    ASGI application serving the given {name: tileset} mapping.
+
+    Tiles are served as stored, or with codec ("none" to serve them uncompressed) vector tiles are recompressed,
+    recompressed tiles are kept in a TileCache of cache_bytes. Without codec, tiles compressed with the zstd dictionary
+    of their archive are recompressed with SERVETILES_DICTIONARY_CODEC. The Content-Encoding header follows the codec
+    of the tile, and tiles are decompressed for clients whose Accept-Encoding does not allow it, so compressed tiles are
+    sent with Vary: Accept-Encoding.
+    """
+    def __init__(self, tilesets, workers=SERVETILES_WORKERS, max_pending=SERVETILES_MAX_PENDING, cors=False,
+                 codec=None, cache_bytes=TILESTORE_CACHE_BYTES):
+        self.tilesets = tilesets
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='servetiles')
+        self.max_pending = max_pending
+        self.cors = cors
+        self.codec = codec
+        self.recoded = TileCache(cache_bytes) if cache_bytes else None
+        self._pending = None
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        for tileset in self.tilesets.values():
+            tileset.close()
+
+    def read_tile(self, tileset, z, x, y, accept_encoding=None):
+        """
+        Return the tile bytes to send, their Content-Encoding and whether they depend on accept_encoding (the tile is
+        compressed, so it is sent decompressed to some clients), (None, None, False) if there is no tile
+        """
+        tile_data = tileset.get_tile(z, x, y)
+        if not tile_data:
+            return None, None, False
+        tile_codec = tileset.codec
+        codec = self.codec
+        if codec is None and tileset.dictionary is not None and uses_dictionary(tile_data, tile_codec):
+            codec = SERVETILES_DICTIONARY_CODEC
+        if codec is not None and tileset.ext in VECTOR_EXTS:
+            key = (id(tileset), z, x, y)
+            recoded = self.recoded.get(key) if self.recoded is not None else None
+            if recoded is None:
+                recoded = recode(tile_data, codec, source_codec=tile_codec, source_dictionary=tileset.dictionary)
+                if self.recoded is not None:
+                    self.recoded.put(key, recoded)
+            tile_data, tile_codec = recoded, codec
+        encoding = content_encoding(tile_data, tile_codec)
+        if encoding and not accepts_encoding(accept_encoding, encoding):
+            return decode(tile_data, tile_codec, tileset.dictionary), None, True
+        return tile_data, encoding, bool(encoding)
+
+    async def run_blocking(self, func, *args):
+        # Bound the number of reads waiting for the executor, extra requests wait here
+        if self._pending is None:
+            self._pending = asyncio.Semaphore(self.max_pending)
+        async with self._pending:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+
+    async def send_response(self, send, status, body, headers=(), head=False):
+        response_headers = [(b'content-length', str(len(body)).encode())]
+        if self.cors:
+            response_headers.append((b'access-control-allow-origin', b'*'))
+        response_headers.extend((k.encode(), v.encode()) for k, v in headers)
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+        # Tiles may be memoryview slices of a PMTiles mapping, ASGI messages carry bytes
+        await send({'type': 'http.response.body', 'body': b'' if head else bytes(body)})
+
+    async def send_text(self, send, status, text, head=False):
+        await self.send_response(send, status, text.encode('utf8'), [('content-type', 'text/plain; charset=utf-8')], head)
+
+    async def send_json(self, send, data, head=False):
+        body = json.dumps(data, ensure_ascii=False).encode('utf8')
+        await self.send_response(send, 200, body, [('content-type', 'application/json')], head)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        method = scope['method']
+        head = method == 'HEAD'
+        if method not in ('GET', 'HEAD'):
+            await self.send_text(send, 405, 'Method Not Allowed')
+            return
+
+        parts = scope['path'].strip('/').split('/')
+        if parts == ['']:
+            await self.send_json(send, {name: f'/{name}/{{z}}/{{x}}/{{y}}.{tileset.ext}' for name, tileset in self.tilesets.items()}, head)
+            return
+
+        tileset = self.tilesets.get(parts[0])
+        if tileset is None:
+            await self.send_text(send, 404, f'Tileset {parts[0]} not found', head)
+            return
+
+        if parts[1:] == ['metadata']:
+            metadata = await self.run_blocking(tileset.metadata)
+            await self.send_json(send, metadata, head)
+            return
+
+        try:
+            if len(parts) != 4:
+                raise ValueError()
+            z, x = int(parts[1]), int(parts[2])
+            y, _, ext = parts[3].partition('.')
+            y = int(y)
+            if not (0 <= x < (1 << z) and 0 <= y < (1 << z)):
+                raise ValueError()
+        except ValueError:
+            await self.send_text(send, 400, f'Unable to parse {scope["path"]}, expecting "/{{tileset}}/{{z}}/{{x}}/{{y}}.{{ext}}"', head)
+            return
+
+        request_headers = dict(scope.get('headers', []))
+        accept_encoding = request_headers.get(b'accept-encoding')
+        try:
+            tile_data, encoding, negotiated = await self.run_blocking(
+                self.read_tile, tileset, z, x, y, accept_encoding.decode('latin-1') if accept_encoding is not None else None)
+        except Exception as e:
+            logger.error(f"Error reading tile {parts[0]}/{z}/{x}/{y}: {e}")
+            await self.send_text(send, 500, 'Internal Server Error', head)
+            return
+        if not tile_data:
+            await self.send_text(send, 404, f'No data found for request location: {scope["path"]}', head)
+            return
+
+        headers = [('content-type', CONTENT_TYPES.get(ext or tileset.ext, 'application/octet-stream')),
+                   ('accept-ranges', 'bytes')]
+        if encoding:
+            headers.append(('content-encoding', encoding))
+        if negotiated:
+            # Shared caches must not send a compressed body to clients that do not accept it
+            headers.append(('vary', 'accept-encoding'))
+
+        range_header = request_headers.get(b'range')
+        if range_header:
+            size = len(tile_data)
+            try:
+                byte_range = parse_range(range_header.decode('latin-1'), size)
+            except RangeNotSatisfiable:
+                await self.send_response(send, 416, b'', [('content-range', f'bytes */{size}')], head)
+                return
+            if byte_range:
+                start, end = byte_range
+                headers.append(('content-range', f'bytes {start}-{end}/{size}'))
+                await self.send_response(send, 206, memoryview(tile_data)[start:end + 1], headers, head)
+                return
+
+        await self.send_response(send, 200, tile_data, headers, head)
+
+
+def parse_tileset_args(tileset_args):
+    """
+    Parse "name=path" (or just "path", named after the file) arguments into {name: path}
+    """
+    tilesets = {}
+    for arg in tileset_args:
+        name, sep, path = arg.partition('=')
+        if not sep:
+            path = name
+            name = os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+        if name in tilesets:
+            raise InvalidTileset(f'Tileset name {name} is used more than once')
+        tilesets[name] = os.path.abspath(path)
+    return tilesets
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ASGI server for MBTiles, PMTiles and tiles folders.')
+    parser.add_argument('tilesets', nargs='+', help='Tilesets to serve as name=path (.mbtiles, .pmtiles or tiles folder). The name defaults to the file name.')
+    parser.add_argument('-a', '--address', default=SERVETILES_HOST, help=f'Address to bind to (default: {SERVETILES_HOST})')
+    parser.add_argument('-p', '--port', type=int, default=SERVETILES_PORT, help=f'Port to bind to (default: {SERVETILES_PORT})')
+    parser.add_argument('-w', '--workers', type=int, default=SERVETILES_WORKERS, help=f'Threads reading tiles from storage (default: {SERVETILES_WORKERS})')
+    parser.add_argument('--cache-mb', type=int, default=TILESTORE_CACHE_BYTES // (1024 * 1024), help='In-memory tile cache size in MB per MBTiles tileset, 0 to disable')
+    parser.add_argument('--folder-ext', default='pbf', help='Tile file extension of tiles folders (default: pbf)')
+    parser.add_argument('-c', '--codec', choices=['none'] + CODEC_NAMES, help='Recompress vector tiles with this codec before serving them, "none" to serve them uncompressed (default: as stored)')
+    parser.add_argument('--cors-allow-all', action='store_true', help='Return Access-Control-Allow-Origin:* header')
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError:
+        logger.error('servetiles needs an ASGI server. Please install uvicorn: pip install uvicorn')
+        sys.exit(1)
+
+    try:
+        tileset_paths = parse_tileset_args(args.tilesets)
+        tilesets = {}
+        for name, path in tileset_paths.items():
+            if not os.path.exists(path):
+                raise InvalidTileset(f'{path} does not exist')
+            tilesets[name] = open_tileset(path, args.workers, args.cache_mb * 1024 * 1024, args.folder_ext)
+            logger.info(f'Serving {path} at /{name}/{{z}}/{{x}}/{{y}}.{tilesets[name].ext}')
+    except InvalidTileset as e:
+        logger.error(e)
+        sys.exit(1)
+
+    if args.codec not in (None, 'none'):
+        try:
+            get_codec(args.codec).check()
+        except ValueError as e:
+            logger.error(e)
+            sys.exit(1)
+
+    app = TileServerApplication(tilesets, workers=args.workers, cors=args.cors_allow_all, codec=args.codec,
+                                cache_bytes=args.cache_mb * 1024 * 1024)
+    uvicorn.run(app, host=args.address, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
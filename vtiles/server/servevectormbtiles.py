@@ -3,6 +3,8 @@ import json
 import sqlite3
 import logging
 from wsgiref.util import shift_path_info
+from vtiles.server.tilestore import MBTilesTileStore, TILESTORE_CACHE_BYTES, TILESTORE_POOL_SIZE
+from vtiles.utils.codec import content_encoding, without_dictionary
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARNING)
@@ -28,19 +30,19 @@ class MBTilesApplication:
     """
     Serves vector tiles within the given .mbtiles (sqlite3) file
     """
-    def __init__(self, mbtiles_filepath, tile_image_ext='.pbf', zoom_offset=0):
+    def __init__(self, mbtiles_filepath, tile_image_ext='.pbf', zoom_offset=0,
+                 pool_size=TILESTORE_POOL_SIZE, cache_bytes=TILESTORE_CACHE_BYTES):
         if mbtiles_filepath is None or not os.path.exists(mbtiles_filepath):
             raise MBTilesFileNotFound(mbtiles_filepath)
 
         if tile_image_ext not in SUPPORTED_IMAGE_EXTENSIONS:
             raise InvalidImageExtension(f"{tile_image_ext} not in {SUPPORTED_IMAGE_EXTENSIONS}!")
 
-        self.mbtiles_db = sqlite3.connect(
-            f"file:{mbtiles_filepath}?mode=ro",
-            check_same_thread=False, uri=True)
+        self.tile_store = MBTilesTileStore(mbtiles_filepath, pool_size=pool_size, cache_bytes=cache_bytes)
         self.tile_image_ext = tile_image_ext
         self.tile_content_type = 'application/x-protobuf'
-        # self.tile_content_encoding = 'gzip'
+        self.tile_codec = self.tile_store.tile_codec()
+        self.tile_dictionary = self.tile_store.tile_dictionary()
         self.zoom_offset = zoom_offset
         self.maxzoom = None
         self.minzoom = None
@@ -53,7 +55,7 @@ class MBTilesApplication:
         setting to self.minzoom, self.maxzoom as integers
         """
         query = 'SELECT name, value FROM metadata WHERE name="minzoom" OR name="maxzoom";'
-        for name, value in self.mbtiles_db.execute(query):
+        for name, value in self.tile_store.execute(query):
             setattr(self, name.lower(), max(int(value) - self.zoom_offset, 0))
 
     def __call__(self, environ, start_response):
@@ -64,7 +66,7 @@ class MBTilesApplication:
             if base_uri == 'metadata':
                 query = 'SELECT * FROM metadata;'
                 try:
-                    metadata_results = self.mbtiles_db.execute(query).fetchall()
+                    metadata_results = self.tile_store.execute(query)
                     status = '200 OK'
                     response_headers = [('Content-type', 'application/json')]
                     start_response(status, response_headers)
@@ -96,17 +98,18 @@ class MBTilesApplication:
                     start_response(status, response_headers)
                     return [f'Unable to parse PATH_INFO({environ["PATH_INFO"]}), expecting "z/x/y.pbf"'.encode('utf8'), ' '.join(i for i in e.args).encode('utf8')]
 
-                query = 'SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?;'
                 ymax = 1 << zoom
                 y = ymax - y - 1
-                values = (zoom, x, y)
                 try:
-                    tile_results = self.mbtiles_db.execute(query, values).fetchone()
-                    if tile_results:
-                        tile_data = tile_results[0]
+                    tile_data = self.tile_store.get_tile(zoom, x, y)
+                    if tile_data is not None:
                         status = '200 OK'
                         response_headers = [('Content-type', self.tile_content_type),]
-                                            #  ('Content-Encoding', self.tile_content_encoding)]
+                        # Clients do not have the zstd dictionary of the archive
+                        tile_data = without_dictionary(tile_data, self.tile_codec, self.tile_dictionary)
+                        encoding = content_encoding(tile_data, self.tile_codec)
+                        if encoding:
+                            response_headers.append(('Content-Encoding', encoding))
                         start_response(status, response_headers)
                         return [tile_data]
                     else:
@@ -150,6 +153,14 @@ def main():
                         default=MBTILES_ZOOM_OFFSET,
                         type=int,
                         help="mbtiles zoom offset [DEFAULT={}]\n(Defaults to environment variable, 'MBTILES_ZOOM_OFFSET')".format(MBTILES_ZOOM_OFFSET))
+    parser.add_argument('--pool-size',
+                        default=TILESTORE_POOL_SIZE,
+                        type=int,
+                        help="Number of read-only sqlite connections [DEFAULT={}]".format(TILESTORE_POOL_SIZE))
+    parser.add_argument('--cache-mb',
+                        default=TILESTORE_CACHE_BYTES // (1024 * 1024),
+                        type=int,
+                        help="Size of the in-memory tile cache in MB, 0 to disable [DEFAULT={}]".format(TILESTORE_CACHE_BYTES // (1024 * 1024)))
     args = parser.parse_args()
     args.filepath = os.path.abspath(args.filepath)
 
@@ -174,7 +185,7 @@ def main():
         class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
             pass
 
-        httpd = make_server(args.address, args.port, MBTilesApplication(args.filepath, args.ext, args.zoom_offset), ThreadingWSGIServer)
+        httpd = make_server(args.address, args.port, MBTilesApplication(args.filepath, args.ext, args.zoom_offset, args.pool_size, args.cache_mb * 1024 * 1024), ThreadingWSGIServer)
         logger.info("Serving on {}:{}".format(args.address, args.port))
         try:
             httpd.serve_forever()
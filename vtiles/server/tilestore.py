@@ -0,0 +1,159 @@
+import os
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from vtiles.utils.codec import get_codec, load_dictionary, DICTIONARY_METADATA
+
+# Default settings
+TILESTORE_CACHE_BYTES = 64 * 1024 * 1024
+TILESTORE_MMAP_SIZE = 1024 * 1024 * 1024
+TILESTORE_POOL_SIZE = os.cpu_count() or 4
+
+TILE_QUERY = 'SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?;'
+
+
+class TileCache:
+    """
+    Thread safe LRU cache of tile bytes, bounded by the total size of the cached tiles
+    """
+    def __init__(self, max_bytes=TILESTORE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            tile_data = self._tiles.get(key)
+            if tile_data is None:
+                self.misses += 1
+                return None
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            return tile_data
+
+    def put(self, key, tile_data):
+        size = len(tile_data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._tiles:
+                return
+            self._tiles[key] = tile_data
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._tiles.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+    def info(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'tiles': len(self._tiles),
+                    'bytes': self.current_bytes, 'max_bytes': self.max_bytes}
+
+
+class MBTilesTileStore:
+    """
+    Read-only tile lookup on an .mbtiles file, shared by servembtiles, servevectormbtiles and serverastermbtiles.
+
+    Requests check out one of a pool of read-only connections (memory mapped with PRAGMA mmap_size), so concurrent
+    requests do not serialize on a single connection. The tile SELECT is always the same SQL string, so every
+    connection prepares it once and reuses it from its statement cache. Hot tiles are served from a TileCache.
+    """
+    def __init__(self, mbtiles_filepath, pool_size=TILESTORE_POOL_SIZE, cache_bytes=TILESTORE_CACHE_BYTES,
+                 mmap_size=TILESTORE_MMAP_SIZE):
+        self.mbtiles_filepath = mbtiles_filepath
+        self.pool_size = max(int(pool_size), 1)
+        self.mmap_size = mmap_size
+        self.cache = TileCache(cache_bytes) if cache_bytes else None
+        self._pool = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(f"file:{self.mbtiles_filepath}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)};')
+        conn.execute('PRAGMA query_only=1;')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection from the pool, opening a new one while the pool is below pool_size
+        """
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if self._created < self.pool_size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    def execute(self, query, values=()):
+        with self.connection() as conn:
+            return conn.execute(query, values).fetchall()
+
+    def tile_codec(self):
+        """
+        Codec of the "compression" metadata, None if it is missing (gzip, zlib and zstd tiles are sniffed anyway)
+        """
+        try:
+            rows = self.execute("SELECT value FROM metadata WHERE name = 'compression';")
+            return get_codec(rows[0][0]) if rows else None
+        except (sqlite3.Error, ValueError):
+            return None
+
+    def tile_dictionary(self):
+        """
+        Zstd dictionary of the metadata, None if there is none. It is registered, so the tiles decode transparently.
+        """
+        try:
+            rows = self.execute("SELECT value FROM metadata WHERE name = ?;", (DICTIONARY_METADATA,))
+            return load_dictionary({DICTIONARY_METADATA: rows[0][0]}) if rows else None
+        except sqlite3.Error:
+            return None
+
+    def get_tile(self, zoom, column, row):
+        """
+        Return tile_data for the given zoom_level, tile_column and tile_row (TMS), or None if there is no tile
+        """
+        key = (zoom, column, row)
+        if self.cache is not None:
+            tile_data = self.cache.get(key)
+            if tile_data is not None:
+                return tile_data
+
+        with self.connection() as conn:
+            result = conn.execute(TILE_QUERY, key).fetchone()
+        if result is None:
+            return None
+
+        tile_data = result[0]
+        if self.cache is not None and tile_data is not None:
+            self.cache.put(key, tile_data)
+        return tile_data
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
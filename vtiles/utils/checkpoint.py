@@ -0,0 +1,110 @@
+"""
+Checkpoints of long-running conversions, so an interrupted run can continue where it stopped with --resume.
+
+A checkpoint holds the signature of the run (inputs and options) and a JSON state, usually the last committed
+(zoom_level, tile_column, tile_row) key in TILE_KEY_ORDER or a batch id. It only exists while the conversion is in
+progress: an output without checkpoint is complete.
+"""
+import os
+import json
+
+CHECKPOINT_TABLE = "vtiles_checkpoint"
+TILE_KEY_ORDER = "ORDER BY zoom_level, tile_column, tile_row"
+
+
+class CheckpointError(Exception):
+    pass
+
+
+def checkpoint_signature(inputs, **options):
+    # Normalized through JSON, so it compares equal to the signature loaded back from a checkpoint
+    return json.loads(json.dumps({"inputs": [os.path.abspath(path) for path in inputs], "options": options}))
+
+
+def after_key(key, inclusive=False):
+    """
+    SQL condition and parameters selecting the tiles after key in TILE_KEY_ORDER (all the tiles if key is None)
+    """
+    if key is None:
+        return "1", ()
+    return f"(zoom_level, tile_column, tile_row) {'>=' if inclusive else '>'} (?, ?, ?)", tuple(key)
+
+
+class MBTilesCheckpoint:
+    """
+    Checkpoint stored in a sidecar table of the output MBTiles.
+    save() does not commit: the caller commits it in the same transaction as the tiles it covers, so the checkpoint
+    never runs ahead of the data. clear() drops the table once the output is complete.
+    """
+    def __init__(self, conn, signature):
+        self.conn = conn
+        self.signature = signature
+
+    def exists(self):
+        return self.conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+                                 (CHECKPOINT_TABLE,)).fetchone() is not None
+
+    def start(self, state=None):
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (name text PRIMARY KEY, value text);")
+        self.conn.execute(f"INSERT OR REPLACE INTO {CHECKPOINT_TABLE} VALUES ('signature', ?)",
+                          (json.dumps(self.signature),))
+        self.save(state or {})
+
+    def load(self):
+        """
+        Return the saved state, or None if there is no checkpoint.
+        Raises CheckpointError if the checkpoint was made with other inputs or options.
+        """
+        if not self.exists():
+            return None
+        values = dict(self.conn.execute(f"SELECT name, value FROM {CHECKPOINT_TABLE}").fetchall())
+        if json.loads(values.get("signature", "null")) != self.signature:
+            raise CheckpointError(f"The checkpoint was made with other inputs or options: {values.get('signature')}")
+        return json.loads(values.get("state", "{}"))
+
+    def save(self, state):
+        self.conn.execute(f"INSERT OR REPLACE INTO {CHECKPOINT_TABLE} VALUES ('state', ?)", (json.dumps(state),))
+
+    def clear(self):
+        self.conn.execute(f"DROP TABLE IF EXISTS {CHECKPOINT_TABLE};")
+
+
+class FileCheckpoint:
+    """
+    Checkpoint stored in a JSON sidecar file, for outputs that are not MBTiles (PMTiles, S3).
+    save() replaces the file atomically, call it once the data it covers is durable.
+    """
+    def __init__(self, path, signature):
+        self.path = path
+        self.signature = signature
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def start(self, state=None):
+        self.save(state or {})
+
+    def load(self):
+        """
+        Return the saved state, or None if there is no checkpoint.
+        Raises CheckpointError if the checkpoint was made with other inputs or options.
+        """
+        if not self.exists():
+            return None
+        with open(self.path, "r") as f:
+            values = json.load(f)
+        if values.get("signature") != self.signature:
+            raise CheckpointError(f"The checkpoint {self.path} was made with other inputs or options: {values.get('signature')}")
+        return values.get("state", {})
+
+    def save(self, state):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"signature": self.signature, "state": state}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,406 @@
+"""
+Tile compression codecs shared by the MBTiles, PMTiles and server tools: gzip, zlib, brotli and zstd.
+
+sniff() recognises gzip, zlib and zstd data by their first bytes. Brotli has no magic number, so brotli tiles are
+only decoded when the codec is declared (MBTiles metadata "compression", PMTiles header tile_compression, --codec).
+brotli and zstd need the optional brotli and zstandard packages. zlib and zstd accept a shared dictionary.
+
+A zstd dictionary trained on the tiles of an archive (train_dictionary(), tilesdict) is stored base64 encoded in its
+metadata under DICTIONARY_METADATA. load_dictionary() registers it by its dictionary id: zstd frames record the id of
+their dictionary, so once the archive metadata is loaded its tiles decode without passing the dictionary around.
+"""
+import gzip
+import base64
+import zlib
+import threading
+from functools import lru_cache
+from vtiles.utils.pmtiles.tile import Compression
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Metadata key of the zstd dictionary of an archive (MBTiles metadata table, PMTiles JSON metadata)
+DICTIONARY_METADATA = 'zstd_dictionary'
+# Default dictionary size (the zstd default, 110 KB) and number of sampled tiles: zstd recommends sampling about
+# 100 times the dictionary size
+DICTIONARY_SIZE = 112640
+DICTIONARY_SAMPLES = 10000
+
+# Loaded zstd dictionaries by dictionary id
+_dictionaries = {}
+
+
+def is_zlib(data):
+    # CMF 0x78 (deflate, 32K window) and the FCHECK of the header: all levels, with or without dictionary
+    return len(data) >= 2 and data[0] == 0x78 and (0x7800 | data[1]) % 31 == 0
+
+
+class Codec:
+    """
+    A tile compression: name (as in the --codec options and the MBTiles "compression" metadata), HTTP
+    Content-Encoding, PMTiles Compression, accepted and default levels.
+    """
+    name = None
+    content_encoding = None
+    compression = Compression.UNKNOWN
+    levels = range(0)
+    default_level = None
+    supports_dictionary = False
+    sniffable = True
+    module = True
+    package = None
+
+    def available(self):
+        return self.module is not None
+
+    def check(self, level=None, dictionary=None):
+        if not self.available():
+            raise ValueError(f"The {self.name} codec needs the {self.package} package: pip install {self.package}")
+        if level is not None and level not in self.levels:
+            raise ValueError(f"{self.name} compression level must be between {self.levels[0]} and {self.levels[-1]}")
+        if dictionary is not None and not self.supports_dictionary:
+            raise ValueError(f"{self.name} does not support dictionaries")
+
+    def match(self, data):
+        return False
+
+    def compress(self, data, level=None, dictionary=None):
+        raise NotImplementedError
+
+    def decompress(self, data, dictionary=None):
+        raise NotImplementedError
+
+    def frame_dictionary_id(self, data):
+        # Id of the dictionary data was compressed with, 0 if none or unknown
+        return 0
+
+    def dictionary_id(self, dictionary):
+        return None
+
+
+class GzipCodec(Codec):
+    name = 'gzip'
+    content_encoding = 'gzip'
+    compression = Compression.GZIP
+    levels = range(0, 10)
+    default_level = 9
+
+    def match(self, data):
+        return data[:2] == GZIP_MAGIC
+
+    def compress(self, data, level=None, dictionary=None):
+        # mtime=0: identical tiles compress to identical bytes
+        return gzip.compress(data, compresslevel=self.default_level if level is None else level, mtime=0)
+
+    def decompress(self, data, dictionary=None):
+        return gzip.decompress(data)
+
+
+class ZlibCodec(Codec):
+    name = 'zlib'
+    content_encoding = 'deflate'
+    levels = range(0, 10)
+    default_level = 6
+    supports_dictionary = True
+
+    def match(self, data):
+        return is_zlib(data)
+
+    def compress(self, data, level=None, dictionary=None):
+        level = self.default_level if level is None else level
+        if dictionary is None:
+            return zlib.compress(data, level)
+        compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, zdict=dictionary)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data, dictionary=None):
+        if dictionary is None:
+            return zlib.decompress(data)
+        decompressor = zlib.decompressobj(zdict=dictionary)
+        return decompressor.decompress(data) + decompressor.flush()
+
+
+class BrotliCodec(Codec):
+    name = 'brotli'
+    content_encoding = 'br'
+    compression = Compression.BROTLI
+    levels = range(0, 12)
+    default_level = 11
+    sniffable = False
+    module = brotli
+    package = 'brotli'
+
+    def compress(self, data, level=None, dictionary=None):
+        return brotli.compress(data, quality=self.default_level if level is None else level)
+
+    def decompress(self, data, dictionary=None):
+        return brotli.decompress(data)
+
+
+@lru_cache(maxsize=16)
+def zstd_dictionary(dictionary):
+    return zstandard.ZstdCompressionDict(dictionary)
+
+
+class ZstdCodec(Codec):
+    name = 'zstd'
+    content_encoding = 'zstd'
+    compression = Compression.ZSTD
+    levels = range(1, 23)
+    default_level = 3
+    supports_dictionary = True
+    module = zstandard
+    package = 'zstandard'
+
+    def __init__(self):
+        # zstandard compressors and decompressors must not be shared between threads
+        self._local = threading.local()
+
+    def _get(self, kind, level, dictionary):
+        cache = self._local.__dict__.setdefault(kind, {})
+        key = (level, dictionary)
+        if key not in cache:
+            dict_data = zstd_dictionary(dictionary) if dictionary is not None else None
+            if kind == 'compressor':
+                cache[key] = zstandard.ZstdCompressor(level=level, dict_data=dict_data)
+            else:
+                cache[key] = zstandard.ZstdDecompressor(dict_data=dict_data)
+        return cache[key]
+
+    def match(self, data):
+        return data[:4] == ZSTD_MAGIC
+
+    def compress(self, data, level=None, dictionary=None):
+        level = self.default_level if level is None else level
+        return self._get('compressor', level, dictionary).compress(data)
+
+    def decompress(self, data, dictionary=None):
+        if dictionary is None:
+            dictionary = loaded_dictionary(self.frame_dictionary_id(data))
+        return self._get('decompressor', None, dictionary).decompress(data)
+
+    def frame_dictionary_id(self, data):
+        return zstandard.get_frame_parameters(data).dict_id
+
+    def dictionary_id(self, dictionary):
+        return zstd_dictionary(dictionary).dict_id()
+
+
+def load_dictionary(metadata):
+    """
+    Zstd dictionary stored in archive metadata (a {name: value} dict), None if there is none.
+    The dictionary is registered, so the tiles compressed with it are decoded without passing it.
+    """
+    value = metadata.get(DICTIONARY_METADATA) if metadata else None
+    if not value:
+        return None
+    dictionary = base64.b64decode(value)
+    register_dictionary(dictionary)
+    return dictionary
+
+
+def dictionary_metadata(dictionary):
+    # Metadata value of a dictionary, see load_dictionary()
+    return base64.b64encode(dictionary).decode('ascii')
+
+
+def register_dictionary(dictionary):
+    """
+    Register a zstd dictionary by its id, returns the id. Raw content dictionaries have no id and are not registered.
+    """
+    if zstandard is None:
+        raise ValueError("Zstd dictionaries need the zstandard package: pip install zstandard")
+    dict_id = zstd_dictionary(dictionary).dict_id()
+    if dict_id:
+        _dictionaries[dict_id] = dictionary
+    return dict_id
+
+
+def loaded_dictionaries():
+    """
+    The registered dictionaries, to register them in worker processes with
+    ProcessPoolExecutor(initializer=register_dictionaries, initargs=(loaded_dictionaries(),))
+    """
+    return list(_dictionaries.values())
+
+
+def register_dictionaries(dictionaries):
+    for dictionary in dictionaries:
+        register_dictionary(dictionary)
+
+
+def loaded_dictionary(dict_id):
+    if not dict_id:
+        return None
+    if dict_id not in _dictionaries:
+        raise ValueError(f"Tile compressed with the zstd dictionary {dict_id}, which is not loaded: it is stored in the "
+                         f"{DICTIONARY_METADATA} metadata of its archive")
+    return _dictionaries[dict_id]
+
+
+def train_dictionary(samples, size=DICTIONARY_SIZE, level=None):
+    """
+    Train a zstd dictionary of size bytes on samples, a list of uncompressed tiles. level is the compression level
+    the dictionary is tuned for (the zstd default if None). Returns the dictionary bytes.
+    """
+    codec = CODECS['zstd']
+    codec.check(level)
+    dictionary = zstandard.train_dictionary(size, samples, level=codec.default_level if level is None else level)
+    return dictionary.as_bytes()
+
+
+CODECS = {codec.name: codec for codec in (GzipCodec(), ZlibCodec(), BrotliCodec(), ZstdCodec())}
+CODEC_NAMES = list(CODECS)
+# Codecs with a PMTiles Compression value (PMTiles has no zlib)
+PMTILES_CODEC_NAMES = [name for name, codec in CODECS.items() if codec.compression != Compression.UNKNOWN]
+CODEC_ALIASES = {'deflate': 'zlib', 'br': 'brotli', 'zstandard': 'zstd'}
+
+
+def get_codec(codec):
+    """
+    Codec from a name (case insensitive, also HTTP Content-Encoding names), a PMTiles Compression or a Codec.
+    Returns None for no compression ("none", "", None), raises ValueError for an unknown codec.
+    """
+    if codec is None or isinstance(codec, Codec):
+        return codec
+    if isinstance(codec, Compression):
+        if codec in (Compression.NONE, Compression.UNKNOWN):
+            return None
+        for candidate in CODECS.values():
+            if candidate.compression == codec:
+                return candidate
+        raise ValueError(f"Unknown tile compression {codec}")
+    name = str(codec).strip().lower()
+    if name in ('', 'none', 'identity'):
+        return None
+    name = CODEC_ALIASES.get(name, name)
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec {codec}, expecting one of {', '.join(CODEC_NAMES)}")
+    return CODECS[name]
+
+
+def sniff(data):
+    """
+    Codec of compressed tile data recognised by its first bytes (gzip, zlib, zstd), None otherwise
+    """
+    for codec in CODECS.values():
+        if codec.match(data):
+            return codec
+    return None
+
+
+def detect(data, codec=None):
+    """
+    Codec of tile data: the sniffed one, else the declared codec when it cannot be sniffed (brotli).
+    None means the data is not compressed.
+    """
+    found = sniff(data)
+    if found is None:
+        declared = get_codec(codec)
+        if declared is not None and not declared.sniffable:
+            found = declared
+    return found
+
+
+def decode(data, codec=None, dictionary=None):
+    """
+    Decompress tile data, codec is the declared codec used when the data cannot be sniffed.
+    dictionary is the dictionary of the archive, ignored by the codecs without dictionary (an archive may mix codecs).
+    Uncompressed data is returned as is.
+    """
+    found = detect(data, codec)
+    if found is None:
+        return data
+    found.check()
+    return found.decompress(data, dictionary if found.supports_dictionary else None)
+
+
+def encode(data, codec='gzip', level=None, dictionary=None):
+    """
+    Compress tile data with codec (returned as is for "none")
+    """
+    codec = get_codec(codec)
+    if codec is None:
+        return data
+    codec.check(level, dictionary)
+    return codec.compress(data, level, dictionary)
+
+
+def recode(data, codec='gzip', level=None, dictionary=None, source_codec=None, source_dictionary=None):
+    """
+    Return tile data compressed with codec, decompressing it first if it is compressed with another codec.
+    Data already compressed with codec and dictionary is kept as is, unless a level is given.
+    """
+    codec = get_codec(codec)
+    found = detect(data, source_codec)
+    if found is None and codec is None:
+        return data
+    if found is codec and level is None:
+        if found.frame_dictionary_id(data) == (0 if dictionary is None else found.dictionary_id(dictionary)):
+            return data
+    if found is not None:
+        data = decode(data, found, source_dictionary)
+    return encode(data, codec, level, dictionary)
+
+
+def codec_name(codec):
+    # Name written to the MBTiles "compression" metadata, "none" for no compression
+    codec = get_codec(codec)
+    return codec.name if codec is not None else 'none'
+
+
+def uses_dictionary(data, codec=None):
+    """
+    Whether tile data was compressed with a dictionary: clients cannot decode it, it has to be recoded before it is
+    served
+    """
+    found = detect(data, codec)
+    return found is not None and found.frame_dictionary_id(data) != 0
+
+
+def without_dictionary(data, codec=None, dictionary=None, fallback='gzip'):
+    """
+    Tile data clients can decode without the dictionary of the archive: tiles compressed with a dictionary are
+    recompressed with fallback, other tiles are returned as is
+    """
+    if not uses_dictionary(data, codec):
+        return data
+    return encode(decode(data, codec, dictionary), fallback)
+
+
+def content_encoding(data, codec=None):
+    """
+    HTTP Content-Encoding of tile data (see detect()), None if it is not compressed
+    """
+    found = detect(data, codec)
+    return found.content_encoding if found is not None else None
+
+
+def accepts_encoding(accept_encoding, encoding):
+    """
+    Whether an Accept-Encoding request header allows encoding. Without header any encoding is accepted.
+    """
+    if accept_encoding is None:
+        return True
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        if name in (encoding, '*'):
+            q = params.strip()
+            if q.startswith('q='):
+                try:
+                    return float(q[2:]) > 0
+                except ValueError:
+                    return True
+            return True
+    return False
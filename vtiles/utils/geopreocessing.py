@@ -13,8 +13,8 @@ import math
 import boto3
 import requests
 import sqlite3
-from vtiles.utils.mapbox_vector_tile import decode
-import zlib, gzip
+from vtiles.utils.mapbox_vector_tile import decode, TileView
+from vtiles.utils import codec
 import vtiles.utils.mercantile as mercantile
 import binascii
 CHUNK_SIZE = 1024
@@ -122,6 +122,42 @@ def fix_wkt(data):
     return result
 
 
+def decode_tile_layers(tile, names=None, trusted=False):
+    """
+    Layers of a TileView as encode() takes them, only the layers in names if given, and the extent of each layer.
+    The geometries are decoded in bulk with NumPy into shapely geometries, holes and feature ids included.
+    If trusted, the layers hold the geometry arrays instead, encode() writes them again without shapely.
+    """
+    if trusted:
+        layers = [
+            {"name": name, "features": tile[name].attributes(), "geometry_arrays": arrays}
+            for name, arrays in tile.geometry_arrays(names=names).items()
+        ]
+    else:
+        layers = [{"name": name, "features": features} for name, features in tile.features(names=names).items()]
+    return layers, {layer["name"]: tile[layer["name"]].extent for layer in layers}
+
+
+def get_tile_codec(cursor):
+    """Codec declared in the MBTiles "compression" metadata, None if it is missing or unknown."""
+    try:
+        row = cursor.execute("SELECT value FROM metadata WHERE name = 'compression'").fetchone()
+        return codec.get_codec(row[0]) if row else None
+    except (sqlite3.Error, ValueError):
+        return None
+
+
+def get_tile_dictionary(cursor):
+    """
+    Zstd dictionary stored in the MBTiles metadata (see codec.load_dictionary), None if there is none.
+    It is registered, so the tiles compressed with it decode transparently in this process.
+    """
+    try:
+        row = cursor.execute("SELECT value FROM metadata WHERE name = ?", (codec.DICTIONARY_METADATA,)).fetchone()
+        return codec.load_dictionary({codec.DICTIONARY_METADATA: row[0]}) if row else None
+    except sqlite3.Error:
+        return None
+
 # Check if mbtiles is vector
 def check_vector(mbtiles):   
     compression_type = None
@@ -130,14 +166,15 @@ def check_vector(mbtiles):
         cursor = conn.cursor()
         cursor.execute("SELECT tile_data FROM tiles LIMIT 1")
         tile_data = cursor.fetchone()[0]
-                  
-        if tile_data[:2] == b'\x1f\x8b':
-            compression_type = 'GZIP'
-            tile_data = gzip.decompress(tile_data)
-        elif tile_data[:2] == b'\x78\x9c' or tile_data[:2] == b'\x78\x01' or tile_data[:2] == b'\x78\xda':
-            compression_type = 'ZLIB'
-            tile_data = zlib.decompress(tile_data)
-        decode(tile_data)
+        get_tile_dictionary(cursor)
+        # Brotli cannot be sniffed, it has to be declared in the metadata
+        tile_codec = codec.detect(tile_data, get_tile_codec(cursor))
+        if tile_codec is not None:
+            compression_type = tile_codec.name.upper()
+            tile_data = tile_codec.decompress(tile_data)
+        # Parsing the tile and its layer tables is enough, the geometries are not decoded
+        for layer in TileView(tile_data):
+            layer.value_types
         return True, compression_type
     except:
         return False, compression_type
@@ -180,18 +217,25 @@ def determine_tileformat(mbtiles):
 
     return tile_format  # Return the determined tile_format
 
-def decode_tile_data(tile_data):   
+def decode_tile_data(tile_data, tile_codec=None):   
     try:
-        if tile_data[:2] == b'\x1f\x8b':  # GZip compressed
-            tile_data = gzip.decompress(tile_data)
-        elif tile_data[:2] in (b'\x78\x9c', b'\x78\x01', b'\x78\xda'):  # Zlib compressed
-            tile_data = zlib.decompress(tile_data)
+        tile_data = codec.decode(tile_data, tile_codec)
         decoded_tile = decode(tile_data)    
     except Exception as e:
         print(f"Error decoding tile data: {e}")
         return None  # Handle failure gracefully
     return decoded_tile
 
+def view_tile_data(tile_data, tile_codec=None):
+    """
+    Lazy TileView of a stored tile for inspection (layers, feature counts, fields), without decoding the geometries
+    """
+    try:
+        return TileView(codec.decode(tile_data, tile_codec))
+    except Exception as e:
+        print(f"Error decoding tile data: {e}")
+        return None
+
 
 def count_tiles(mbtiles):
     """Count the number of tiles in the MBTiles file."""
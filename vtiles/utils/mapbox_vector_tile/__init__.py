@@ -1,6 +1,8 @@
 import warnings
 
-from . import decoder, encoder
+from . import decoder, encoder, merger
+from .arrays import GeometryArrays, concat_arrays, decode_arrays, decode_layer_arrays, encode_arrays
+from .view import LayerView, TileView
 
 
 def decode(tile, per_layer_options=None, default_options=None, **kwargs):
@@ -45,7 +47,9 @@ def encode(layers, per_layer_options=None, default_options=None, **kwargs):
 
     Args:
         layers:
-            The layer data to encode.
+            The layer data to encode: a layer, or a list of layers, as a dictionary with the `name` and the `features`
+            of the layer. A layer may also hold `geometry_arrays`, the trusted geometries of its features, see
+            `VectorTile.add_layer`.
 
         per_layer_options:
             An optional dictionary containing per layer options. The keys are the layer names and the values are
@@ -89,10 +93,38 @@ def encode(layers, per_layer_options=None, default_options=None, **kwargs):
         for layer in layers:
             layer_name = layer["name"]
             layer_options = per_layer_options.get(layer_name, None)
-            vector_tile.add_layer(features=layer["features"], name=layer_name, options=layer_options)
+            vector_tile.add_layer(
+                features=layer["features"],
+                name=layer_name,
+                options=layer_options,
+                geometry_arrays=layer.get("geometry_arrays"),
+            )
     else:
         layer_name = layers["name"]
         layer_options = per_layer_options.get(layer_name, None)
-        vector_tile.add_layer(features=layers["features"], name=layer_name, options=layer_options)
+        vector_tile.add_layer(
+            features=layers["features"],
+            name=layer_name,
+            options=layer_options,
+            geometry_arrays=layers.get("geometry_arrays"),
+        )
 
     return vector_tile.tile.SerializeToString()
+
+
+def merge(tiles):
+    """Merge the encoded MVT `tiles` into a single tile without decoding their geometries.
+
+    Args:
+        tiles:
+            The list of encoded (uncompressed) tiles to merge.
+
+    Returns:
+        The encoded merged tile.
+
+    Notes:
+        When the layer names of the tiles are disjoint, the merged tile is the concatenation of the tiles. When a
+        layer exists in several tiles, the features are appended to the first layer with that name, and their tags
+        are remapped onto its keys and values. A `ValueError` is raised if those layers have different extents.
+    """
+    return merger.merge_tiles(tiles)
@@ -0,0 +1,424 @@
+from itertools import chain
+
+import numpy as np
+import shapely
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+
+from .Mapbox import vector_tile_pb2 as vector_tile
+from .utils import CMD_BITS, CMD_LINE_TO, CMD_MOVE_TO, CMD_SEG_END, LINESTRING, POINT, POLYGON
+
+CMD_MASK = (1 << CMD_BITS) - 1
+
+
+def _packed_geometry_tile():
+    # The tile message of vector_tile.proto with the packed geometry of the features read as bytes, so the commands
+    # are decoded with NumPy instead of being turned into Python integers one at a time
+    file_proto = descriptor_pb2.FileDescriptorProto()
+    vector_tile.DESCRIPTOR.CopyToProto(file_proto)
+    file_proto.name = "vector_tile_packed_geometry.proto"
+    (tile,) = file_proto.message_type
+    feature = next(message for message in tile.nested_type if message.name == "feature")
+    geometry = next(field for field in feature.field if field.name == "geometry")
+    geometry.type = descriptor_pb2.FieldDescriptorProto.TYPE_BYTES
+    geometry.label = descriptor_pb2.FieldDescriptorProto.LABEL_OPTIONAL
+    geometry.ClearField("options")
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file_proto)
+    return message_factory.GetMessageClass(pool.FindMessageTypeByName(f"{file_proto.package}.tile"))
+
+
+PackedGeometryTile = _packed_geometry_tile()
+PACKED_GEOMETRY_LAYER = PackedGeometryTile.DESCRIPTOR.nested_types_by_name["layer"]
+
+ARRAY_TYPES = {"Point": POINT, "LineString": LINESTRING, "Polygon": POLYGON}
+
+RAGGED_TYPES = {
+    "Point": shapely.GeometryType.MULTIPOINT,
+    "LineString": shapely.GeometryType.MULTILINESTRING,
+    "Polygon": shapely.GeometryType.MULTIPOLYGON,
+}
+
+
+class GeometryArrays:
+    """Geometries of the features of a layer with the same MVT type, in the GeoArrow ragged array layout.
+
+    `coords` is a (n, 2) int32 array of tile coordinates and `offsets` the offset arrays of the multi geometry type,
+    innermost first as `shapely.from_ragged_array` takes them:
+        * `Point`: (points per feature,)
+        * `LineString`: (coordinates per line, lines per feature)
+        * `Polygon`: (coordinates per ring, rings per polygon, polygons per feature), rings are closed.
+    `features` holds the indices, in the layer, of the features the geometries belong to.
+    """
+
+    def __init__(self, geometry_type, coords, offsets, features):
+        self.geometry_type = geometry_type
+        self.coords = coords
+        self.offsets = offsets
+        self.features = features
+
+    def __len__(self):
+        return len(self.features)
+
+    def slice(self, start, stop):
+        """The geometries of the features from position `start` to `stop` in `features`."""
+        features = self.features[start:stop]
+        offsets = []
+        for offset in reversed(self.offsets):
+            offset = offset[start : stop + 1]
+            start, stop = offset[0], offset[-1]
+            offsets.append(offset - start)
+        return GeometryArrays(self.geometry_type, self.coords[start:stop], tuple(reversed(offsets)), features)
+
+    def part_counts(self):
+        return np.diff(self.offsets[-1])
+
+    def to_shapely(self):
+        """Shapely geometries built in bulk, single part ones as `Point`, `LineString` or `Polygon` like `decode`."""
+        geometries = shapely.from_ragged_array(RAGGED_TYPES[self.geometry_type], self.coords, self.offsets)
+        single = self.part_counts() == 1
+        geometries[single] = shapely.get_geometry(geometries[single], 0)
+        return geometries
+
+    def coordinates(self, coords=None):
+        """Nested coordinate lists of the features: the points of a feature, its lines, or its polygons as lists of
+        rings, with `coords` (a list of [x, y]) instead of the tile coordinates if given."""
+        if coords is None:
+            coords = self.coords.tolist()
+        offsets = [offset.tolist() for offset in self.offsets]
+        if self.geometry_type == "Point":
+            (points,) = offsets
+            return [coords[start:end] for start, end in zip(points, points[1:])]
+        if self.geometry_type == "LineString":
+            parts, lines = offsets
+            return [[coords[parts[i] : parts[i + 1]] for i in range(start, end)] for start, end in zip(lines, lines[1:])]
+        rings, parts, polygons = offsets
+        return [
+            [[coords[rings[r] : rings[r + 1]] for r in range(parts[p], parts[p + 1])] for p in range(start, end)]
+            for start, end in zip(polygons, polygons[1:])
+        ]
+
+    def geojson_geometries(self, coords=None):
+        """GeoJSON geometry dictionaries of the features, with `coords` (a list of [x, y], e.g. projected coordinates)
+        instead of the tile coordinates if given."""
+        geometry_type = self.geometry_type
+        geometries = []
+        for coordinates in self.coordinates(coords):
+            if geometry_type == "LineString" and len(coordinates) <= 1:
+                geometries.append({"type": "LineString", "coordinates": coordinates[0] if coordinates else []})
+            elif len(coordinates) == 1:
+                geometries.append({"type": geometry_type, "coordinates": coordinates[0]})
+            else:
+                geometries.append({"type": f"Multi{geometry_type}", "coordinates": coordinates})
+        return geometries
+
+
+def _ranges(starts, lengths, step=1):
+    # Concatenation of range(start, start + length * step, step) for each start and length
+    lengths = np.asarray(lengths, dtype=np.int64)
+    firsts = np.cumsum(lengths) - lengths
+    local = np.arange(lengths.sum()) - np.repeat(firsts, lengths)
+    return np.repeat(np.asarray(starts, dtype=np.int64), lengths) + step * local
+
+
+def _offsets(counts):
+    return np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+
+def _zig_zag_decode(values):
+    return (values >> 1) ^ -(values & 1)
+
+
+def _zig_zag_encode(values):
+    return (values << 1) ^ (values >> 63)
+
+
+def concat_arrays(layers_arrays, feature_counts):
+    """Concatenate the `GeometryArrays` by type of several layers whose features are put one after the other, e.g. to
+    merge layers: the features of a layer are shifted by the counts of `feature_counts` before it."""
+    feature_offsets = _offsets(feature_counts)
+    arrays = {}
+    for geometry_type in RAGGED_TYPES:
+        parts = [(layer_arrays[geometry_type], feature_offsets[index])
+                 for index, layer_arrays in enumerate(layers_arrays) if geometry_type in layer_arrays]
+        if not parts:
+            continue
+        offsets = []
+        for level in range(len(parts[0][0].offsets)):
+            level_offsets = [part.offsets[level] for part, _ in parts]
+            shifts = _offsets([offset[-1] for offset in level_offsets])
+            offsets.append(np.concatenate(
+                [level_offsets[0]] + [offset[1:] + shift for offset, shift in zip(level_offsets[1:], shifts[1:])]
+            ))
+        coords = np.concatenate([part.coords for part, _ in parts])
+        features = np.concatenate([part.features + shift for part, shift in parts])
+        arrays[geometry_type] = GeometryArrays(geometry_type, coords, tuple(offsets), features)
+    return arrays
+
+
+def parse_tile(pbf_data):
+    """Parse an encoded tile into a `PackedGeometryTile`, or into a regular `tile` message when it is not encoded the
+    canonical way the encoders write it (geometry not packed or in several chunks, unknown fields): the packed
+    geometry bytes could not be trusted then.
+    """
+    tile = PackedGeometryTile()
+    tile.ParseFromString(pbf_data)
+    tile.DiscardUnknownFields()
+    if tile.ByteSize() == len(pbf_data):
+        return tile
+    tile = vector_tile.tile()
+    tile.ParseFromString(pbf_data)
+    return tile
+
+
+def _geometry_stream(layers, features, layer_name):
+    # Command integers of the geometries of the features, and the index each geometry starts at
+    if any(layer.DESCRIPTOR is not PACKED_GEOMETRY_LAYER for layer in layers):
+        feature_starts = _offsets([len(feature.geometry) for feature in features])
+        stream = chain.from_iterable(feature.geometry for feature in features)
+        return np.fromiter(stream, dtype=np.int64, count=int(feature_starts[-1])), feature_starts
+
+    geometries = [feature.geometry for feature in features]
+    byte_ends = np.cumsum(np.fromiter(map(len, geometries), dtype=np.int64, count=len(geometries)))
+    data = np.frombuffer(b"".join(geometries), dtype=np.uint8)
+    if not len(data):
+        return np.zeros(0, dtype=np.int64), np.zeros(len(geometries) + 1, dtype=np.int64)
+    # The last byte of a varint has no continuation bit, and a geometry can not end in the middle of one
+    ends = np.flatnonzero(data < 0x80)
+    truncated = np.flatnonzero((data[byte_ends - 1] >= 0x80) & (np.diff(byte_ends, prepend=0) > 0))
+    if len(truncated):
+        raise ValueError(f"Truncated geometry in layer {layer_name(truncated[0])!r}")
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = 7 * (np.arange(len(data)) - np.repeat(starts, ends - starts + 1))
+    stream = np.add.reduceat((data & 0x7F).astype(np.int64) << shifts, starts)
+    return stream, np.concatenate(([0], np.searchsorted(ends, byte_ends - 1, side="right")))
+
+
+def decode_arrays(layers, y_coord_down=False):
+    """Decode the geometries of layer messages into a dictionary of `GeometryArrays` per MVT geometry type for each
+    layer.
+
+    The layers of a tile are decoded together, so that the NumPy work is done once per tile rather than per layer.
+    Only the command integers are visited in Python, to follow the command stream: the parts, the zig-zag decoding
+    and the cursor deltas are computed with NumPy. Like `decode`, the y coordinates are flipped unless
+    `y_coord_down`, polygons are split on the winding order of their rings and zero area rings are dropped. Lines of
+    less than two points are dropped too.
+    """
+    layers = list(layers)
+    layer_offsets = _offsets([len(layer.features) for layer in layers])
+
+    def layer_name(feature_index):
+        return layers[np.searchsorted(layer_offsets, feature_index, side="right") - 1].name
+
+    features = [feature for layer in layers for feature in layer.features]
+    feature_types = np.array([feature.type for feature in features], dtype=np.int64)
+    unknown = np.flatnonzero((feature_types < POINT) | (feature_types > POLYGON))
+    if len(unknown):
+        raise ValueError(f"Unknown geometry type: {feature_types[unknown[0]]} in layer {layer_name(unknown[0])!r}")
+    stream, feature_starts = _geometry_stream(layers, features, layer_name)
+    size = len(stream)
+
+    # Position of the next command if the integer at each position is a command
+    cmds = stream & CMD_MASK
+    has_params = (cmds == CMD_MOVE_TO) | (cmds == CMD_LINE_TO)
+    following = (np.arange(1, size + 1) + np.where(has_params, 2 * (stream >> CMD_BITS), 0)).tolist()
+    commands = []
+    position = 0
+    while position < size:
+        commands.append(position)
+        position = following[position]
+    commands = np.array(commands, dtype=np.int64)
+    # The commands of a valid geometry end exactly where the geometry of the next feature starts
+    is_command = np.zeros(size + 1, dtype=bool)
+    is_command[commands] = True
+    is_command[size] = position == size
+    truncated = np.flatnonzero(~is_command[feature_starts])
+    if len(truncated):
+        raise ValueError(f"Truncated geometry in layer {layer_name(max(truncated[0] - 1, 0))!r}")
+
+    counts = np.where(has_params[commands], stream[commands] >> CMD_BITS, 0)
+    command_vertices = _offsets(counts)
+    feature_vertices = command_vertices[np.searchsorted(commands, feature_starts)]
+    vertex_counts = np.diff(feature_vertices)
+
+    # Zig-zag decode the parameters and accumulate the deltas, the cursor starts at (0, 0) for each feature
+    positions = _ranges(commands + 1, counts, step=2)
+    xy = np.empty((len(positions), 2), dtype=np.int64)
+    for axis in (0, 1):
+        summed = np.concatenate(([0], np.cumsum(_zig_zag_decode(stream[positions + axis]))))
+        xy[:, axis] = summed[1:] - np.repeat(summed[feature_vertices[:-1]], vertex_counts)
+    if not y_coord_down:
+        extents = np.repeat([layer.extent for layer in layers], np.diff(layer_offsets))
+        xy[:, 1] = np.repeat(extents, vertex_counts) - xy[:, 1]
+
+    # A MoveTo or a ClosePath ends the current part of lines and polygons
+    command_features = np.searchsorted(feature_starts, commands, side="right") - 1
+    breaks = (cmds[commands] == CMD_MOVE_TO) | (cmds[commands] == CMD_SEG_END)
+    breaks &= feature_types[command_features] != POINT
+    boundaries = np.unique(np.concatenate((command_vertices[:-1][breaks], feature_vertices)))
+    part_lengths = np.diff(boundaries)
+    part_starts = boundaries[:-1][part_lengths > 0]
+    part_lengths = part_lengths[part_lengths > 0]
+    part_features = np.searchsorted(feature_vertices, part_starts, side="right") - 1
+    part_types = feature_types[part_features]
+
+    arrays = {}
+
+    points = np.flatnonzero(feature_types == POINT)
+    if len(points):
+        coords = xy[_ranges(feature_vertices[points], vertex_counts[points])]
+        arrays["Point"] = GeometryArrays("Point", coords.astype(np.int32), (_offsets(vertex_counts[points]),), points)
+
+    lines = np.flatnonzero(feature_types == LINESTRING)
+    if len(lines):
+        selected = (part_types == LINESTRING) & (part_lengths > 1)
+        coords = xy[_ranges(part_starts[selected], part_lengths[selected])]
+        lines_per_feature = np.bincount(part_features[selected], minlength=len(features))[lines]
+        offsets = (_offsets(part_lengths[selected]), _offsets(lines_per_feature))
+        arrays["LineString"] = GeometryArrays("LineString", coords.astype(np.int32), offsets, lines)
+
+    polygons = np.flatnonzero(feature_types == POLYGON)
+    if len(polygons):
+        selected = part_types == POLYGON
+        starts, lengths, ring_features = part_starts[selected], part_lengths[selected], part_features[selected]
+        # Close the rings
+        closed = (xy[starts] == xy[starts + lengths - 1]).all(axis=1)
+        closed_lengths = lengths + ~closed
+        local = np.arange(closed_lengths.sum()) - np.repeat(_offsets(closed_lengths)[:-1], closed_lengths)
+        coords = xy[np.repeat(starts, closed_lengths) + np.where(local < np.repeat(lengths, closed_lengths), local, 0)]
+        # Signed area of the rings
+        ring_ids = np.repeat(np.arange(len(starts)), closed_lengths)
+        same_ring = ring_ids[:-1] == ring_ids[1:]
+        cross = coords[:-1, 0] * coords[1:, 1] - coords[1:, 0] * coords[:-1, 1]
+        area = np.bincount(ring_ids[:-1][same_ring], weights=cross[same_ring], minlength=len(starts))
+        signs = np.sign(area).astype(np.int64)
+        kept = signs != 0
+        coords = coords[kept[ring_ids]]
+        signs, closed_lengths, ring_features = signs[kept], closed_lengths[kept], ring_features[kept]
+        # A ring with the winding of the first ring of its feature starts a new polygon, the others are its holes
+        firsts = np.flatnonzero(np.diff(ring_features, prepend=-1))
+        winding = np.repeat(signs[firsts], np.diff(np.append(firsts, len(signs))))
+        exteriors = signs == winding
+        polygons_per_feature = np.bincount(ring_features[exteriors], minlength=len(features))[polygons]
+        offsets = (
+            _offsets(closed_lengths),
+            np.append(np.flatnonzero(exteriors), len(signs)).astype(np.int64),
+            _offsets(polygons_per_feature),
+        )
+        arrays["Polygon"] = GeometryArrays("Polygon", coords.astype(np.int32), offsets, polygons)
+
+    # Split the geometries of the tile between its layers
+    layers_arrays = [{} for _ in layers]
+    for geometry_type, tile_arrays in arrays.items():
+        bounds = np.searchsorted(tile_arrays.features, layer_offsets).tolist()
+        for index, (start, stop) in enumerate(zip(bounds, bounds[1:])):
+            if stop > start:
+                layer_arrays = tile_arrays.slice(start, stop)
+                layer_arrays.features -= layer_offsets[index]
+                layers_arrays[index][geometry_type] = layer_arrays
+    return layers_arrays
+
+
+def decode_layer_arrays(layer, y_coord_down=False):
+    """Decode the geometries of a layer message into a `GeometryArrays` per MVT geometry type, see `decode_arrays`."""
+    return decode_arrays([layer], y_coord_down=y_coord_down)[0]
+
+
+def encode_arrays(geometry_arrays, extents, y_coord_down=False):
+    """Encode trusted geometries, already integer tile coordinates and valid (e.g. decoded from a tile), into MVT
+    commands with NumPy.
+
+    The `GeometryArrays` of a layer are encoded together, whatever their geometry type. The commands are the ones
+    `GeometryEncoder` writes for the same shapely geometries once oriented: the y coordinates are flipped unless
+    `y_coord_down`, the closing point of the rings and the repeated points are dropped, a line or a ring left without
+    segment is dropped (with its holes for an exterior ring) and the rings are reversed where needed for the exterior
+    ones to have a positive area and the holes a negative one. Nothing is validated.
+
+    Returns:
+        The commands of all the geometries as a list, and the offsets of the commands of each geometry, in the order
+        of `geometry_arrays` and of their features: a geometry with no command has nothing left.
+    """
+    geometry_arrays = list(geometry_arrays)
+    geometry_offsets = _offsets([len(arrays) for arrays in geometry_arrays])
+    polygon_offsets = _offsets([
+        len(arrays.offsets[1]) - 1 if arrays.geometry_type == "Polygon" else 0 for arrays in geometry_arrays
+    ])
+
+    # Every geometry is made of parts: all its points, a line or a ring
+    part_lengths, part_geometries, part_types, part_polygons = [], [], [], []
+    for arrays, first_geometry, first_polygon in zip(geometry_arrays, geometry_offsets, polygon_offsets):
+        lengths = np.diff(arrays.offsets[0])
+        geometries = np.arange(len(arrays))
+        polygons = np.full(len(lengths), -1)
+        if arrays.geometry_type != "Point":
+            geometries = np.repeat(geometries, np.diff(arrays.offsets[-1]))
+        if arrays.geometry_type == "Polygon":
+            polygons = np.repeat(np.arange(len(arrays.offsets[1]) - 1), np.diff(arrays.offsets[1]))
+            geometries = geometries[polygons]
+            polygons += first_polygon
+        part_lengths.append(lengths)
+        part_geometries.append(geometries + first_geometry)
+        part_types.append(np.full(len(lengths), ARRAY_TYPES[arrays.geometry_type]))
+        part_polygons.append(polygons)
+    if not geometry_arrays:
+        return [], [0]
+    part_lengths = np.concatenate(part_lengths)
+    part_geometries = np.concatenate(part_geometries)
+    part_types = np.concatenate(part_types)
+    part_polygons = np.concatenate(part_polygons)
+    part_starts = _offsets(part_lengths)
+    points = part_types == POINT
+    rings = part_types == POLYGON
+    # The first ring of a polygon is its exterior ring
+    exteriors = rings & (np.diff(part_polygons, prepend=-1) != 0)
+
+    xy = np.concatenate([arrays.coords for arrays in geometry_arrays]).astype(np.int64)
+    if not y_coord_down:
+        xy[:, 1] = extents - xy[:, 1]
+    vertex_parts = np.repeat(np.arange(len(part_lengths)), part_lengths)
+    local = np.arange(len(xy)) - part_starts[vertex_parts]
+
+    # Reverse the rings with the wrong winding
+    same_part = vertex_parts[:-1] == vertex_parts[1:]
+    cross = xy[:-1, 0] * xy[1:, 1] - xy[1:, 0] * xy[:-1, 1]
+    area = np.bincount(vertex_parts[:-1][same_part], weights=cross[same_part], minlength=len(part_lengths))
+    reversed_rings = rings & (area != 0) & ((area > 0) != exteriors)
+    if reversed_rings.any():
+        reversed_vertices = reversed_rings[vertex_parts]
+        xy = xy[np.where(reversed_vertices, part_starts[vertex_parts + 1] - 1 - local, part_starts[vertex_parts] + local)]
+
+    # Vertices left once the closing points of the rings and the repeated points of lines and rings are dropped
+    kept = np.ones(len(xy), dtype=bool)
+    kept[1:] = ~same_part | (xy[1:] != xy[:-1]).any(axis=1)
+    kept[part_starts[1:][rings & (part_lengths > 0)] - 1] = False
+    kept |= points[vertex_parts]
+    kept_lengths = np.bincount(vertex_parts[kept], minlength=len(part_lengths))
+    kept_parts = points | (kept_lengths > 1)
+    polygon_kept = np.zeros(polygon_offsets[-1], dtype=bool)
+    polygon_kept[part_polygons[exteriors]] = kept_parts[exteriors]
+    kept_parts[rings] &= polygon_kept[part_polygons[rings]]
+    kept &= kept_parts[vertex_parts]
+    xy, vertex_parts = xy[kept], vertex_parts[kept]
+    lengths = np.bincount(vertex_parts, minlength=len(part_lengths))
+
+    # A part is MoveTo(n) for points, MoveTo(1) and LineTo(n - 1) for lines, followed by ClosePath for rings
+    sizes = np.where(lengths > 0, 2 * lengths + np.where(points, 1, 2 + rings), 0)
+    starts = _offsets(sizes)[:-1]
+    commands = np.empty(sizes.sum(), dtype=np.int64)
+    commands[starts[points & (lengths > 0)]] = (lengths[points & (lengths > 0)] << CMD_BITS) | CMD_MOVE_TO
+    lines = ~points & (lengths > 0)
+    commands[starts[lines]] = (1 << CMD_BITS) | CMD_MOVE_TO
+    commands[starts[lines] + 3] = ((lengths[lines] - 1) << CMD_BITS) | CMD_LINE_TO
+    commands[starts[rings & lines] + 2 * lengths[rings & lines] + 2] = (1 << CMD_BITS) | CMD_SEG_END
+
+    # The cursor starts at (0, 0) for each geometry and moves from part to part
+    local = np.arange(len(xy)) - np.repeat(_offsets(lengths)[:-1], lengths)
+    positions = starts[vertex_parts] + 1 + 2 * local + ((local > 0) & ~points[vertex_parts])
+    vertex_geometries = part_geometries[vertex_parts]
+    deltas = xy.copy()
+    moved = np.flatnonzero(vertex_geometries[1:] == vertex_geometries[:-1]) + 1
+    deltas[moved] -= xy[moved - 1]
+    commands[positions] = _zig_zag_encode(deltas[:, 0])
+    commands[positions + 1] = _zig_zag_encode(deltas[:, 1])
+
+    geometry_sizes = np.bincount(part_geometries, weights=sizes, minlength=geometry_offsets[-1]).astype(np.int64)
+    return commands.tolist(), _offsets(geometry_sizes).tolist()
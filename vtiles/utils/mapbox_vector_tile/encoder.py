@@ -8,11 +8,15 @@ from shapely.ops import transform
 from shapely.wkb import loads as load_wkb
 from shapely.wkt import loads as load_wkt
 
+from .arrays import ARRAY_TYPES, encode_arrays
 from .geom_encoder import GeometryEncoder
 from .Mapbox import vector_tile_pb2 as vector_tile
 from .polygon import make_it_valid
 from .utils import get_encode_options
 
+# Number of vertices from which the trusted geometries of a layer are encoded with NumPy
+ARRAY_ENCODE_MIN_VERTICES = 256
+
 
 def on_invalid_geometry_raise(shape):
     raise ValueError(f"Invalid geometry: {shape.wkt}")
@@ -40,7 +44,15 @@ class VectorTile:
         self.seen_values_bool_idx = {}
         self.seen_layer_names = set()
 
-    def add_layer(self, name, features, options=None):
+    def add_layer(self, name, features, options=None, geometry_arrays=None):
+        """Add a layer with the `features` to the tile.
+
+        With `geometry_arrays`, a `GeometryArrays` per geometry type like `TileView.geometry_arrays` returns, the
+        geometries of the features are taken from the arrays and trusted: they are integer tile coordinates of valid
+        geometries, e.g. decoded from a tile. They are encoded without going through shapely, with NumPy unless the
+        layer is small: only the ring winding is fixed, the `transformer`, `quantize_bounds` and `on_invalid_geometry`
+        options are not applied, and the `geometry` of the features is ignored.
+        """
         if not name:
             raise ValueError(f"A layer name can not be empty. {name!r} was provided.")
         if name in self.seen_layer_names:
@@ -58,6 +70,10 @@ class VectorTile:
         self.seen_values_idx = {}
         self.seen_values_bool_idx = {}
 
+        if geometry_arrays is not None:
+            self.add_trusted_features(features, geometry_arrays)
+            return
+
         for feature in features:
             # skip missing or empty geometries
             geometry_spec = feature.get("geometry")
@@ -188,6 +204,35 @@ class VectorTile:
         else:
             return transform(self.layer_options["transformer"], geom)
 
+    def add_trusted_features(self, features, geometry_arrays):
+        features = list(features)
+        geometry_arrays = list(geometry_arrays.values())
+        geometries = [None] * len(features)
+        if sum(len(arrays.coords) for arrays in geometry_arrays) < ARRAY_ENCODE_MIN_VERTICES:
+            # NumPy costs more than it saves on small layers, their coordinates are encoded in Python
+            for arrays in geometry_arrays:
+                feature_type = ARRAY_TYPES[arrays.geometry_type]
+                for index, coordinates in zip(arrays.features.tolist(), arrays.coordinates()):
+                    geom_encoder = GeometryEncoder(self.layer_options["y_coord_down"], self.layer_options["extents"])
+                    geometry = geom_encoder.encode_coordinates(arrays.geometry_type, coordinates)
+                    if geometry:
+                        geometries[index] = (feature_type, geometry)
+        else:
+            commands, offsets = encode_arrays(
+                geometry_arrays, self.layer_options["extents"], y_coord_down=self.layer_options["y_coord_down"]
+            )
+            starts = iter(zip(offsets, offsets[1:]))
+            for arrays in geometry_arrays:
+                feature_type = ARRAY_TYPES[arrays.geometry_type]
+                for index, (start, end) in zip(arrays.features.tolist(), starts):
+                    if end > start:
+                        geometries[index] = (feature_type, commands[start:end])
+
+        for feature, geometry in zip(features, geometries):
+            # skip the features without geometry left
+            if geometry is not None:
+                self._add_encoded_feature(feature, *geometry)
+
     def add_feature(self, feature, shape):
         geom_encoder = GeometryEncoder(self.layer_options["y_coord_down"], self.layer_options["extents"])
         geometry = geom_encoder.encode(shape)
@@ -196,6 +241,9 @@ class VectorTile:
         if len(geometry) == 0:
             # Don't add geometry if it's too small
             return
+        self._add_encoded_feature(feature, feature_type, geometry)
+
+    def _add_encoded_feature(self, feature, feature_type, geometry):
         f = self.layer.features.add()
 
         fid = feature.get("id")
@@ -44,6 +44,19 @@ class GeometryEncoder:
             last_x = x
             last_y = y
 
+    def encode_multipoint_coordinates(self, points):
+        if not points:
+            return
+        self._geometry = [self.encode_cmd_length(CMD_MOVE_TO, len(points))]
+        last_x = 0
+        last_y = 0
+        for point in points:
+            x, y = self.coords_on_grid(*point)
+            self._geometry.append(zig_zag_encode(x - last_x))
+            self._geometry.append(zig_zag_encode(y - last_y))
+            last_x = x
+            last_y = y
+
     def encode_arc(self, coords):
         """Appends commands to _geometry to create an arc.
         - Returns False if nothing was added
@@ -98,6 +111,35 @@ class GeometryEncoder:
         for polygon in shape.geoms:
             self.encode_polygon(polygon)
 
+    def encode_trusted_polygon(self, rings):
+        # The exterior ring must have a positive area in tile coordinates and the holes a negative one
+        for index, ring in enumerate(rings):
+            area = sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:]))
+            if not self._y_coord_down:
+                area = -area
+            if area != 0 and (area > 0) != (index == 0):
+                ring = ring[::-1]
+            if not self.encode_arc(self.omit_last(iter(ring))):
+                if index == 0:
+                    return
+                continue
+            self._geometry.append(self.encode_cmd_length(CMD_SEG_END, 1))
+
+    def encode_coordinates(self, geometry_type, coordinates):
+        """Encode the trusted integer coordinates of a geometry, as `GeometryArrays.coordinates` returns them, without
+        shapely: the result is the one of `encode` for the same geometry once oriented."""
+        if geometry_type == "Point":
+            self.encode_multipoint_coordinates(coordinates)
+        elif geometry_type == "LineString":
+            for line in coordinates:
+                self.encode_arc(iter(line))
+        elif geometry_type == "Polygon":
+            for rings in coordinates:
+                self.encode_trusted_polygon(rings)
+        else:
+            raise NotImplementedError(f"Can't do {geometry_type} geometries")
+        return self._geometry
+
     def encode(self, shape):
         if shape.geom_type == "GeometryCollection":
             # do nothing
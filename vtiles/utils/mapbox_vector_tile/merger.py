@@ -0,0 +1,90 @@
+from .Mapbox import vector_tile_pb2 as vector_tile
+
+
+class TileMerger:
+    """Merge encoded tiles at the protobuf level, without decoding any geometry.
+
+    Layers with a name not seen yet are copied as they are. Features of a layer that already exists are appended to
+    it, with their tags remapped onto the key and value tables of the existing layer.
+    """
+
+    def __init__(self):
+        self.tile = vector_tile.tile()
+        self.layers = {}
+
+    def add_tile(self, pbf_data):
+        tile = vector_tile.tile()
+        tile.ParseFromString(pbf_data)
+        for layer in tile.layers:
+            self.add_layer(layer)
+
+    def add_layer(self, layer):
+        if layer.name not in self.layers:
+            merged_layer = self.tile.layers.add()
+            merged_layer.CopyFrom(layer)
+            keys_idx = {}
+            for idx, key in enumerate(merged_layer.keys):
+                keys_idx.setdefault(key, idx)
+            values_idx = {}
+            for idx, value in enumerate(merged_layer.values):
+                values_idx.setdefault(value.SerializeToString(), idx)
+            self.layers[layer.name] = (merged_layer, keys_idx, values_idx)
+            return
+
+        merged_layer, keys_idx, values_idx = self.layers[layer.name]
+        if merged_layer.extent != layer.extent:
+            # Coordinates would have to be rescaled, which means touching the geometry
+            raise ValueError(
+                f"Can not merge layer {layer.name!r} with extents {merged_layer.extent} and {layer.extent}."
+            )
+
+        key_map = []
+        for key in layer.keys:
+            if key not in keys_idx:
+                keys_idx[key] = len(merged_layer.keys)
+                merged_layer.keys.append(key)
+            key_map.append(keys_idx[key])
+
+        value_map = []
+        for value in layer.values:
+            value_key = value.SerializeToString()
+            if value_key not in values_idx:
+                values_idx[value_key] = len(merged_layer.values)
+                merged_layer.values.add().CopyFrom(value)
+            value_map.append(values_idx[value_key])
+
+        if key_map == list(range(len(key_map))) and value_map == list(range(len(value_map))):
+            # Same key/value tables, tags are valid as they are
+            merged_layer.features.extend(layer.features)
+            return
+
+        for feature in layer.features:
+            merged_feature = merged_layer.features.add()
+            merged_feature.CopyFrom(feature)
+            del merged_feature.tags[:]
+            tags = feature.tags
+            for key_idx, val_idx in zip(tags[::2], tags[1::2]):
+                merged_feature.tags.append(key_map[key_idx])
+                merged_feature.tags.append(value_map[val_idx])
+
+    def get_message(self):
+        return self.tile.SerializeToString()
+
+
+def merge_tiles(tiles):
+    parsed = []
+    for pbf_data in tiles:
+        tile = vector_tile.tile()
+        tile.ParseFromString(pbf_data)
+        parsed.append(tile)
+
+    names = [layer.name for tile in parsed for layer in tile.layers]
+    if len(names) == len(set(names)):
+        # Disjoint layer names: concatenating serialized messages concatenates their repeated `layers` field
+        return b"".join(tiles)
+
+    merger = TileMerger()
+    for tile in parsed:
+        for layer in tile.layers:
+            merger.add_layer(layer)
+    return merger.get_message()
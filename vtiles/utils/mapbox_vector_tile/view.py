@@ -0,0 +1,181 @@
+from functools import cached_property
+
+from .arrays import decode_arrays, decode_layer_arrays, parse_tile
+from .utils import LINESTRING, POINT, POLYGON, UNKNOWN
+
+GEOMETRY_TYPES = {UNKNOWN: "Unknown", POINT: "Point", LINESTRING: "LineString", POLYGON: "Polygon"}
+
+# Python type of the decoded value for each field of the Value message, as `decode` returns it
+VALUE_TYPES = {
+    "string_value": "str",
+    "float_value": "float",
+    "double_value": "float",
+    "int_value": "int",
+    "uint_value": "int",
+    "sint_value": "int",
+    "bool_value": "bool",
+}
+
+
+class LayerView:
+    """Read-only view of an encoded layer, computed from its protobuf message without decoding any geometry.
+
+    The geometry types are the ones of the MVT specification (`Point`, `LineString`, `Polygon`, `Unknown`): telling a
+    `MultiPolygon` from a `Polygon` needs the ring winding, hence the coordinates.
+    """
+
+    def __init__(self, layer):
+        self.layer = layer
+
+    @property
+    def name(self):
+        return self.layer.name
+
+    @property
+    def version(self):
+        return self.layer.version
+
+    @property
+    def extent(self):
+        return self.layer.extent
+
+    @property
+    def feature_count(self):
+        return len(self.layer.features)
+
+    @cached_property
+    def keys(self):
+        return list(self.layer.keys)
+
+    @cached_property
+    def value_types(self):
+        """Python type name of each entry of the value table."""
+        types = []
+        for value in self.layer.values:
+            fields = value.ListFields()
+            if not fields:
+                raise ValueError(f"{value} is an unknown value")
+            types.append(VALUE_TYPES[fields[0][0].name])
+        return types
+
+    @cached_property
+    def values(self):
+        return [value.ListFields()[0][1] for value in self.layer.values]
+
+    @cached_property
+    def geometry_types(self):
+        """Number of features of each geometry type."""
+        counts = {}
+        for feature in self.layer.features:
+            name = GEOMETRY_TYPES.get(feature.type, "Unknown")
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    @cached_property
+    def fields(self):
+        """Type name of each property key, taken from the first feature it is set on, in the order the keys appear."""
+        keys = self.keys
+        value_types = self.value_types
+        fields = {}
+        for feature in self.layer.features:
+            tags = feature.tags
+            if len(tags) % 2:
+                raise ValueError("Unexpected number of tags")
+            for key_idx, val_idx in zip(tags[::2], tags[1::2]):
+                key = keys[key_idx]
+                if key not in fields:
+                    fields[key] = value_types[val_idx]
+            if len(fields) == len(keys):
+                break
+        return fields
+
+    @cached_property
+    def properties(self):
+        """Properties of each feature, as `decode` returns them."""
+        keys = self.keys
+        values = self.values
+        properties = []
+        for feature in self.layer.features:
+            tags = feature.tags
+            properties.append({keys[key_idx]: values[val_idx] for key_idx, val_idx in zip(tags[::2], tags[1::2])})
+        return properties
+
+    @property
+    def feature_ids(self):
+        """Id of each feature, None for the features without one."""
+        return [feature.id if feature.HasField("id") else None for feature in self.layer.features]
+
+    def geometry_arrays(self, y_coord_down=False):
+        """Geometries of the features as NumPy coordinate and offset arrays, a `GeometryArrays` per geometry type."""
+        return decode_layer_arrays(self.layer, y_coord_down=y_coord_down)
+
+    def shapes(self, y_coord_down=False, geometry_arrays=None):
+        """Shapely geometry of each feature, built in bulk from the geometry arrays (None for dropped geometries)."""
+        if geometry_arrays is None:
+            geometry_arrays = self.geometry_arrays(y_coord_down=y_coord_down)
+        shapes = [None] * self.feature_count
+        for arrays in geometry_arrays.values():
+            for index, shape in zip(arrays.features.tolist(), arrays.to_shapely()):
+                shapes[index] = shape
+        return shapes
+
+    def attributes(self):
+        """Features without geometry, to be encoded again with `encode` along with their geometry arrays."""
+        return [
+            {"properties": properties, "id": feature_id}
+            for properties, feature_id in zip(self.properties, self.feature_ids)
+        ]
+
+    def features(self, y_coord_down=False, geometry_arrays=None):
+        """Features with shapely geometries, ready to be encoded again with `encode`."""
+        shapes = self.shapes(y_coord_down=y_coord_down, geometry_arrays=geometry_arrays)
+        features = self.attributes()
+        for feature, shape in zip(features, shapes):
+            feature["geometry"] = shape
+        return features
+
+
+class TileView:
+    """Lazy, read-only view of an encoded (uncompressed) tile for inspection.
+
+    The tile is parsed once, and the layer views only read the layer metadata, the key and value tables and the
+    feature types and tags: the geometry commands are only decoded, into NumPy arrays, when `geometry_arrays`,
+    `shapes` or `features` are asked for.
+    """
+
+    def __init__(self, pbf_data):
+        self.tile = parse_tile(pbf_data)
+
+    @cached_property
+    def layers(self):
+        return {layer.name: LayerView(layer) for layer in self.tile.layers}
+
+    @property
+    def layer_names(self):
+        return list(self.layers)
+
+    def geometry_arrays(self, y_coord_down=False, names=None):
+        """`LayerView.geometry_arrays` of every layer (or of the layers in `names`) by name, decoded together."""
+        layers = [layer for layer in self.layers.values() if names is None or layer.name in names]
+        arrays = decode_arrays([layer.layer for layer in layers], y_coord_down=y_coord_down)
+        return {layer.name: layer_arrays for layer, layer_arrays in zip(layers, arrays)}
+
+    def features(self, y_coord_down=False, names=None):
+        """`LayerView.features` of every layer (or of the layers in `names`) by name, decoded together."""
+        geometry_arrays = self.geometry_arrays(y_coord_down=y_coord_down, names=names)
+        return {
+            name: self.layers[name].features(y_coord_down=y_coord_down, geometry_arrays=layer_arrays)
+            for name, layer_arrays in geometry_arrays.items()
+        }
+
+    def __getitem__(self, name):
+        return self.layers[name]
+
+    def __contains__(self, name):
+        return name in self.layers
+
+    def __iter__(self):
+        return iter(self.layers.values())
+
+    def __len__(self):
+        return len(self.tile.layers)
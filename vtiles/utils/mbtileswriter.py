@@ -0,0 +1,190 @@
+import os
+import json
+import hashlib
+import sqlite3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Default settings
+MBTILESWRITER_BATCH_SIZE = 10000
+MBTILESWRITER_WORKERS = min(os.cpu_count() or 4, 8)
+MBTILESWRITER_CACHE_KB = 256 * 1024
+IMAGE_ID_SIZE = 16
+
+METADATA_SCHEMA = [
+    "CREATE TABLE metadata (name text, value text);",
+    "CREATE UNIQUE INDEX name on metadata (name);",
+]
+
+# Deduplicated MBTiles layout: each tile content is stored once in images, map points tiles at it
+DEDUP_SCHEMA = [
+    "CREATE TABLE map (zoom_level integer, tile_column integer, tile_row integer, tile_id text);",
+    "CREATE TABLE images (tile_data blob, tile_id text);",
+    "CREATE UNIQUE INDEX images_id on images (tile_id);",
+]
+DEDUP_INDEX = "CREATE UNIQUE INDEX map_index on map (zoom_level, tile_column, tile_row);"
+DEDUP_VIEW = """CREATE VIEW tiles AS
+    SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column, map.tile_row AS tile_row, images.tile_data AS tile_data
+    FROM map JOIN images ON images.tile_id = map.tile_id;"""
+
+TILES_SCHEMA = [
+    "CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob);",
+]
+TILES_INDEX = "CREATE UNIQUE INDEX tile_index on tiles (zoom_level, tile_column, tile_row);"
+
+
+def image_id(tile_data):
+    # Content key of the images table, the same tile_data always gets the same id
+    return hashlib.blake2b(tile_data, digest_size=IMAGE_ID_SIZE).hexdigest()
+
+
+def image_ids(batch):
+    return [image_id(tile[3]) for tile in batch]
+
+
+class MBTilesWriter:
+    """
+    Writes a new MBTiles file, either with a plain tiles table or, with dedup, in the images/map layout where each
+    distinct tile content is stored once and tiles is a view joining map and images.
+
+    Tiles are (zoom_level, tile_column, tile_row, tile_data) rows in the TMS scheme, inserted in batches of
+    batch_size within a single transaction per write_tiles call. In dedup mode the contents are hashed in a pool of
+    worker threads (hashlib releases the GIL on large buffers) while the previous batches are inserted. The unique
+    indexes and the view are created by close(), after the bulk load. A tile written twice is resolved there as
+    INSERT OR REPLACE would: the last one written is kept.
+
+    Nothing is synced and the rollback journal is only kept in memory, so the output of an interrupted process is
+    incomplete and possibly corrupt: it must be discarded and written again.
+    """
+    def __init__(self, path, dedup=True, workers=MBTILESWRITER_WORKERS, batch_size=MBTILESWRITER_BATCH_SIZE,
+                 cache_kb=MBTILESWRITER_CACHE_KB):
+        self.path = path
+        self.dedup = dedup
+        self.batch_size = batch_size
+        self.tiles = 0
+        self.tile_bytes = 0
+        self.conn = sqlite3.connect(path)
+        # New file written in one go: no fsync and the rollback journal in memory, which is cheap as pages appended to
+        # the file are not journaled, but lets a failed statement (the unique index in close()) be rolled back
+        self.conn.execute("PRAGMA synchronous=OFF;")
+        self.conn.execute("PRAGMA journal_mode=MEMORY;")
+        # Large page cache, so building the indexes after the bulk load sorts in memory as much as possible
+        self.conn.execute(f"PRAGMA cache_size=-{int(cache_kb)};")
+        for statement in METADATA_SCHEMA + (DEDUP_SCHEMA if dedup else TILES_SCHEMA):
+            self.conn.execute(statement)
+        self.executor = ThreadPoolExecutor(max_workers=workers) if dedup and workers else None
+        self.max_pending = 2 * workers if workers else 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write_metadata(self, metadata):
+        """
+        Insert or replace the given {name: value} metadata, values that are not strings are written as JSON
+        """
+        rows = [(name, value if isinstance(value, str) else json.dumps(value, ensure_ascii=False))
+                for name, value in metadata.items()]
+        self.conn.executemany("INSERT OR REPLACE INTO metadata VALUES(?,?)", rows)
+        self.conn.commit()
+
+    def write_tiles(self, tiles, progress=None):
+        """
+        Write an iterable of (zoom_level, tile_column, tile_row, tile_data) tiles, returns the number of tiles written.
+        progress, if given, is called with the size of every batch once it is written.
+        """
+        count = 0
+        pending = deque()
+        for batch in self._batches(tiles):
+            if self.executor is None:
+                count += self._insert(batch, image_ids(batch) if self.dedup else None, progress)
+                continue
+            pending.append((batch, self.executor.submit(image_ids, batch)))
+            if len(pending) >= self.max_pending:
+                batch, future = pending.popleft()
+                count += self._insert(batch, future.result(), progress)
+        while pending:
+            batch, future = pending.popleft()
+            count += self._insert(batch, future.result(), progress)
+        self.conn.commit()
+        return count
+
+    def _batches(self, tiles):
+        batch = []
+        for tile in tiles:
+            batch.append(tile)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _insert(self, batch, ids, progress):
+        if self.dedup:
+            images = {}
+            for tile, tile_id in zip(batch, ids):
+                images.setdefault(tile_id, tile[3])
+            self.conn.executemany("INSERT OR IGNORE INTO images VALUES(?,?)",
+                                  ((tile_data, tile_id) for tile_id, tile_data in images.items()))
+            self.conn.executemany("INSERT INTO map VALUES(?,?,?,?)",
+                                  ((tile[0], tile[1], tile[2], tile_id) for tile, tile_id in zip(batch, ids)))
+        else:
+            self.conn.executemany("INSERT INTO tiles VALUES(?,?,?,?)", batch)
+        self.tiles += len(batch)
+        self.tile_bytes += sum(len(tile[3]) for tile in batch)
+        if progress is not None:
+            progress(len(batch))
+        return len(batch)
+
+    def stats(self):
+        """
+        Number of tiles and of stored contents, and the bytes of tile data written and actually stored
+        """
+        if self.dedup:
+            images, stored_bytes = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(tile_data)), 0) FROM images").fetchone()
+        else:
+            images, stored_bytes = self.tiles, self.tile_bytes
+        return {"tiles": self.tiles, "images": images, "tile_bytes": self.tile_bytes, "stored_bytes": stored_bytes}
+
+    def close(self):
+        """
+        Build the tile index (and the tiles view in dedup mode), returns stats()
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+        if self.dedup:
+            self._create_index(DEDUP_INDEX, "map")
+            self.conn.execute(DEDUP_VIEW)
+        else:
+            self._create_index(TILES_INDEX, "tiles")
+        self.conn.commit()
+        stats = self.stats()
+        self.conn.close()
+        return stats
+
+    def _create_index(self, index, table):
+        try:
+            self.conn.execute(index)
+            return
+        except sqlite3.IntegrityError:
+            pass
+        # Some tiles were written more than once: keep the last one written of each, then drop the unused images
+        self.tiles -= self.conn.execute(f"""DELETE FROM {table} WHERE rowid NOT IN
+            (SELECT MAX(rowid) FROM {table} GROUP BY zoom_level, tile_column, tile_row);""").rowcount
+        if self.dedup:
+            self.conn.execute("DELETE FROM images WHERE tile_id NOT IN (SELECT tile_id FROM map);")
+            self.tile_bytes = self.conn.execute("""SELECT COALESCE(SUM(LENGTH(images.tile_data)), 0)
+                FROM map JOIN images ON images.tile_id = map.tile_id;""").fetchone()[0]
+        else:
+            self.tile_bytes = self.conn.execute("SELECT COALESCE(SUM(LENGTH(tile_data)), 0) FROM tiles;").fetchone()[0]
+        self.conn.execute(index)
+
+    def abort(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+        self.conn.close()
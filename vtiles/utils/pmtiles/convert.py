@@ -1,14 +1,26 @@
 # pmtiles to files
-import gzip
-import json
+import mmap
 import os
+import shutil
 import sqlite3
-from pmtiles.writer import write
-from pmtiles.reader import Reader, MmapSource, all_tiles
-from .tile import zxy_to_tileid, tileid_to_zxy, TileType, Compression
+from .writer import write
+from .reader import Reader, MmapSource, all_runs
+import numpy as np
+from .tile import zxy_to_tileid_batch, TileType, Compression
+from ..checkpoint import FileCheckpoint, checkpoint_signature, after_key, TILE_KEY_ORDER
+from ..codec import get_codec, recode, codec_name, load_dictionary, dictionary_metadata, DICTIONARY_METADATA
 
 
-def mbtiles_to_header_json(mbtiles_metadata):
+def pmtiles_compression(codec):
+    tile_codec = get_codec(codec)
+    if tile_codec is None:
+        return Compression.NONE
+    if tile_codec.compression == Compression.UNKNOWN:
+        raise ValueError(f"PMTiles does not support {tile_codec.name} tile compression")
+    return tile_codec.compression
+
+
+def mbtiles_to_header_json(mbtiles_metadata, codec="gzip"):
     header = {}
 
     header["min_zoom"] = int(mbtiles_metadata["minzoom"])
@@ -40,7 +52,13 @@ def mbtiles_to_header_json(mbtiles_metadata):
     else:
         header["tile_type"] = TileType.UNKNOWN
 
-    if tile_format == "pbf" or mbtiles_metadata.get("compression") == "gzip":
+    if tile_format == "pbf":
+        # vector tiles are recompressed with codec, only zstd tiles keep the dictionary
+        header["tile_compression"] = pmtiles_compression(codec)
+        mbtiles_metadata["compression"] = codec_name(codec)
+        if codec_name(codec) != "zstd":
+            mbtiles_metadata.pop(DICTIONARY_METADATA, None)
+    elif mbtiles_metadata.get("compression") == "gzip":
         header["tile_compression"] = Compression.GZIP
     else:
         header["tile_compression"] = Compression.NONE
@@ -48,135 +66,203 @@ def mbtiles_to_header_json(mbtiles_metadata):
     return header, mbtiles_metadata
 
 
-def mbtiles_to_pmtiles(input, output, maxzoom):
-    conn = sqlite3.connect(input)
-    cursor = conn.cursor()
+SPILL_DTYPE = np.dtype([("tile_id", "<u8"), ("offset", "<u8"), ("length", "<u8")])
+
+
+def file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
 
-    with write(output) as writer:
 
-        # collect a set of all tile IDs
-        tileid_set = []
-        for row in cursor.execute(
-            "SELECT zoom_level,tile_column,tile_row FROM tiles WHERE zoom_level <= ?",
-            (maxzoom or 99,),
-        ):
-            flipped = (1 << row[0]) - 1 - row[2]
-            tileid_set.append(zxy_to_tileid(row[0], row[1], flipped))
+def work_files_match(state, data_path, spill_path):
+    # The work files may hold a batch written after the checkpoint, which is truncated, but never less than it records
+    return file_size(data_path) >= state["offset"] and file_size(spill_path) >= state["count"] * SPILL_DTYPE.itemsize
 
-        tileid_set.sort()
 
+def mbtiles_to_pmtiles(input, output, maxzoom=None, batch_size=10000, progress=None, dedup_max_size=None, resume=False,
+                       codec="gzip"):
+    """
+    Convert in two sequential passes instead of one indexed SELECT per tile:
+    1. scan the tiles table in (zoom_level, tile_column, tile_row) order, append the tile bytes to a data file and
+       spill (tile_id, offset, length) records to a spill file, computing the tile ids of each batch at once
+    2. memory map the spilled records, sort them by tile id and feed the Writer in tile id order (clustered)
+    Only the sort order of the tile ids is held in memory. The data and spill files are kept in a work directory
+    next to the output, with a checkpoint saved after every batch of pass 1 once both files are synced. With resume,
+    an interrupted conversion truncates them to the checkpoint and continues the scan after its last tile, or starts
+    over when they are shorter than the checkpoint records.
+    progress is an optional tqdm-like class used to report both passes. dedup_max_size is passed to the Writer.
+    Vector tiles are compressed with codec (gzip, zlib, brotli, zstd or "none"), recorded as the tile_compression
+    of the header. With zstd, the zstd dictionary of the MBTiles is kept in the metadata and used for every tile.
+    Returns the Writer stats, or None when resuming a conversion that is already complete.
+    """
+    pmtiles_compression(codec)
+    work_dir = os.path.abspath(output) + ".work"
+    checkpoint = FileCheckpoint(
+        os.path.join(work_dir, "checkpoint.json"),
+        checkpoint_signature([input], task="mbtiles2pmtiles", maxzoom=maxzoom, codec=codec_name(codec)),
+    )
+    data_path = os.path.join(work_dir, "tiles.data")
+    spill_path = os.path.join(work_dir, "tiles.spill")
+    state = checkpoint.load() if resume else None
+    if state is not None and not work_files_match(state, data_path, spill_path):
+        # The checkpoint and the work files disagree (deleted or truncated files): discard them and start over
+        state = None
+        resume = False
+    if state is None:
+        if resume and os.path.exists(output):
+            return None
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+        state = {"key": None, "count": 0, "offset": 0, "scanned": False}
+        checkpoint.start(state)
+
+    conn = sqlite3.connect(f"file:{input}?mode=ro", uri=True)
+    cursor = conn.cursor()
+    try:
         mbtiles_metadata = {}
         for row in cursor.execute("SELECT name,value FROM metadata"):
             mbtiles_metadata[row[0]] = row[1]
         is_pbf = mbtiles_metadata["format"] == "pbf"
-
-        # query the db in ascending tile order
-        for tileid in tileid_set:
-            z, x, y = tileid_to_zxy(tileid)
-            flipped = (1 << z) - 1 - y
-            res = cursor.execute(
-                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
-                (z, x, flipped),
-            )
-            data = res.fetchone()[0]
-            # force gzip compression only for vector
-            if is_pbf and data[0:2] != b"\x1f\x8b":
-                data = gzip.compress(data)
-            writer.write_tile(tileid, data)
-
-        pmtiles_header, pmtiles_metadata = mbtiles_to_header_json(mbtiles_metadata)
+        try:
+            source_codec = get_codec(mbtiles_metadata.get("compression"))
+        except ValueError:
+            source_codec = None
+        source_dictionary = load_dictionary(mbtiles_metadata)
+        dictionary = source_dictionary if codec_name(codec) == "zstd" else None
+        max_level = int(maxzoom) if maxzoom else 99
+
+        # Pass 1: sequential scan, resumed after the last checkpointed tile
+        if not state["scanned"]:
+            condition, params = after_key(state["key"])
+            total = cursor.execute(
+                f"SELECT COUNT(*) FROM tiles WHERE zoom_level <= ? AND {condition}", (max_level, *params)
+            ).fetchone()[0]
+            with open(data_path, "r+b" if os.path.exists(data_path) else "w+b") as data_f, \
+                    open(spill_path, "r+b" if os.path.exists(spill_path) else "w+b") as spill_f:
+                # Drop whatever was written after the checkpoint
+                data_f.truncate(state["offset"])
+                data_f.seek(state["offset"])
+                spill_f.truncate(state["count"] * SPILL_DTYPE.itemsize)
+                spill_f.seek(state["count"] * SPILL_DTYPE.itemsize)
+                cursor.execute(
+                    f"SELECT zoom_level,tile_column,tile_row,tile_data FROM tiles WHERE zoom_level <= ? AND {condition} {TILE_KEY_ORDER}",
+                    (max_level, *params),
+                )
+                bar = progress(total=total, desc="Scanning tiles") if progress else None
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    zooms = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+                    columns = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+                    tile_rows = np.fromiter((r[2] for r in rows), dtype=np.int64, count=len(rows))
+
+                    records = np.empty(len(rows), dtype=SPILL_DTYPE)
+                    records["tile_id"] = zxy_to_tileid_batch(zooms, columns, (1 << zooms) - 1 - tile_rows)
+                    lengths = records["length"]
+                    chunks = []
+                    for i, row in enumerate(rows):
+                        data = row[3]
+                        # recompress only vector tiles, tiles already compressed with codec are kept
+                        if is_pbf:
+                            data = recode(data, codec, dictionary=dictionary, source_codec=source_codec,
+                                          source_dictionary=source_dictionary)
+                        chunks.append(data)
+                        lengths[i] = len(data)
+                    records["offset"] = state["offset"] + np.cumsum(lengths) - lengths
+
+                    data_f.write(b"".join(chunks))
+                    spill_f.write(records.tobytes())
+                    data_f.flush()
+                    spill_f.flush()
+                    os.fsync(data_f.fileno())
+                    os.fsync(spill_f.fileno())
+                    state["offset"] += int(lengths.sum())
+                    state["count"] += len(rows)
+                    state["key"] = list(rows[-1][:3])
+                    checkpoint.save(state)
+                    if bar:
+                        bar.update(len(rows))
+                if bar:
+                    bar.close()
+            state["scanned"] = True
+            checkpoint.save(state)
+
+        count = state["count"]
+        offset = state["offset"]
+        pmtiles_header, pmtiles_metadata = mbtiles_to_header_json(mbtiles_metadata, codec)
         if maxzoom:
             pmtiles_header["max_zoom"] = int(maxzoom)
             mbtiles_metadata["maxzoom"] = maxzoom
-        result = writer.finalize(pmtiles_header, pmtiles_metadata)
-
-    conn.close()
-
 
-def pmtiles_to_mbtiles(input, output):
-    conn = sqlite3.connect(output)
-    cursor = conn.cursor()
-    cursor.execute("CREATE TABLE metadata (name text, value text);")
-    cursor.execute("""create unique index name on metadata (name);""")
-    cursor.execute(
-        "CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob);"
-    )
-    cursor.execute(
-        "CREATE UNIQUE INDEX tile_index on tiles (zoom_level, tile_column, tile_row);"
-    )
-
-
-    with open(input, "r+b") as f:
+        # Pass 2: clustered rewrite in tile id order
+        with write(output, dedup_max_size) as writer:
+            if count:
+                records = np.memmap(spill_path, dtype=SPILL_DTYPE, mode="r", shape=(count,))
+                order = np.argsort(records["tile_id"], kind="stable")
+                with open(data_path, "rb") as data_f:
+                    data = mmap.mmap(data_f.fileno(), 0, access=mmap.ACCESS_READ) if offset else b""
+                    bar = progress(total=count, desc="Writing tiles") if progress else None
+                    for start in range(0, count, batch_size):
+                        batch = records[order[start : start + batch_size]]
+                        for tileid, tile_offset, length in zip(
+                            batch["tile_id"].tolist(), batch["offset"].tolist(), batch["length"].tolist()
+                        ):
+                            writer.write_tile(tileid, data[tile_offset : tile_offset + length])
+                        if bar:
+                            bar.update(len(batch))
+                    if bar:
+                        bar.close()
+                    del records
+                    if offset:
+                        data.close()
+            writer.finalize(pmtiles_header, pmtiles_metadata)
+            stats = writer.stats()
+        shutil.rmtree(work_dir, ignore_errors=True)
+        return stats
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def recompress_pmtiles(input, output, codec="zstd", level=None, dictionary=None, progress=None, dedup_max_size=None):
+    """
+    Write output with the tiles of the input PMTiles compressed with codec at level, and with dictionary (zstd only),
+    which is stored in the metadata. Tile entries are read in tile id order, each stored content is recompressed once
+    and written again for every tile of its run, where the Writer deduplicates it.
+    Returns the Writer stats.
+    """
+    tile_compression = pmtiles_compression(codec)
+    if dictionary is not None and codec_name(codec) != "zstd":
+        raise ValueError("Only zstd tiles are compressed with a dictionary")
+    with open(input, "rb") as f:
         source = MmapSource(f)
-
         reader = Reader(source)
         header = reader.header()
         metadata = reader.metadata()
-
-        if "minzoom" not in metadata:
-            metadata["minzoom"] = header["min_zoom"]
-
-        if "maxzoom" not in metadata:
-            metadata["maxzoom"] = header["max_zoom"]
-
-        if "bounds" not in metadata:
-            min_lon = header["min_lon_e7"] / 10000000
-            min_lat = header["min_lat_e7"] / 10000000
-            max_lon = header["max_lon_e7"] / 10000000
-            max_lat = header["max_lat_e7"] / 10000000
-            metadata["bounds"] = f"{min_lon},{min_lat},{max_lon},{max_lat}"
-
-        if "center" not in metadata:
-            center_lon = header["center_lon_e7"] / 10000000
-            center_lat = header["center_lat_e7"] / 10000000
-            center_zoom = header["center_zoom"]
-            metadata["center"] = f"{center_lon},{center_lat},{center_zoom}"
-
-        if "format" not in metadata:
-            if header["tile_type"] == TileType.MVT:
-                metadata["format"] = "pbf"
-
-        json_metadata = {}
-        for k, v in metadata.items():
-            if k == "vector_layers":
-                json_metadata["vector_layers"] = v
-                continue
-            elif k == "tilestats":
-                json_metadata["tilestats"] = v
-                continue
-            elif not isinstance(v, str):
-                v = json.dumps(v, ensure_ascii=False)
-            cursor.execute("INSERT INTO metadata VALUES(?,?)", (k, v))
-
-        if len(json_metadata) > 0:
-            cursor.execute(
-                "INSERT INTO metadata VALUES(?,?)",
-                ("json", json.dumps(json_metadata, ensure_ascii=False)),
-            )
-
-        for zxy, tile_data in all_tiles(source):
-            flipped_y = (1 << zxy[0]) - 1 - zxy[2]
-            cursor.execute(
-                "INSERT INTO tiles VALUES(?,?,?,?)",
-                (zxy[0], zxy[1], flipped_y, tile_data),
-            )
-
-    conn.commit()
-    conn.close()
-
-
-def pmtiles_to_dir(input, output):
-    os.makedirs(output)
-    with open(input, "r+b") as f:
-        source = MmapSource(f)
-
-        reader = Reader(source)
-        with open(os.path.join(output, "metadata.json"), "w") as f:
-            f.write(json.dumps(reader.metadata()))
-
-        for zxy, tile_data in all_tiles(source):
-            directory = os.path.join(output, str(zxy[0]), str(zxy[1]))
-            path = os.path.join(directory, str(zxy[2]) + "." + "mvt")
-            os.makedirs(directory, exist_ok=True)
-            with open(path, "wb") as f:
-                f.write(tile_data)
+        if header["tile_type"] != TileType.MVT:
+            raise ValueError(f"{input} does not hold vector tiles")
+        source_codec = get_codec(header["tile_compression"])
+        source_dictionary = reader.tile_dictionary()
+
+        header["tile_compression"] = tile_compression
+        metadata["compression"] = codec_name(codec)
+        metadata.pop(DICTIONARY_METADATA, None)
+        if dictionary is not None:
+            metadata[DICTIONARY_METADATA] = dictionary_metadata(dictionary)
+
+        with write(output, dedup_max_size) as writer:
+            bar = progress(total=header["addressed_tiles_count"], desc="Compressing tiles") if progress else None
+            last_offset, recoded = None, None
+            for tile_id, run_length, offset, tile_data in all_runs(source):
+                # Entries sharing a content are usually consecutive (runs of ocean tiles)
+                if offset != last_offset:
+                    recoded = recode(bytes(tile_data), codec, level, dictionary, source_codec, source_dictionary)
+                    last_offset = offset
+                for i in range(run_length):
+                    writer.write_tile(tile_id + i, recoded)
+                if bar:
+                    bar.update(run_length)
+            if bar:
+                bar.close()
+            writer.finalize(header, metadata)
+            return writer.stats()
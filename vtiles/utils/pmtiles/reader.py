@@ -1,18 +1,39 @@
+import os
 import json
 import mmap
+import hashlib
+import numpy as np
+import requests
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from .tile import (
     deserialize_header,
     deserialize_directory,
     zxy_to_tileid,
-    tileid_to_zxy,
+    tileid_to_zxy_batch,
     find_tile,
     Compression,
 )
 import gzip
+from ..codec import load_dictionary
 
 
-def MmapSource(f):
+def MmapSource(f, zero_copy=False):
+    """
+    With zero_copy, reads return memoryview slices of the mapping instead of new bytes objects.
+    They are valid as long as the source is referenced and are accepted by sqlite3, gzip, file and socket writes.
+    """
     mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if zero_copy:
+        view = memoryview(mapping)
+
+        def get_bytes(offset, length):
+            return view[offset : offset + length]
+
+        return get_bytes
 
     def get_bytes(offset, length):
         return mapping[offset : offset + length]
@@ -20,54 +41,359 @@ def MmapSource(f):
     return get_bytes
 
 
-def MemorySource(buf):
+def MemorySource(buf, zero_copy=False):
+    if zero_copy:
+        buf = memoryview(buf)
+
     def get_bytes(offset, length):
         return buf[offset : offset + length]
 
     return get_bytes
 
 
+# Default settings
+READER_LEAF_CACHE_ENTRIES = 262144
+RANGE_BLOCK_SIZE = 16384
+RANGE_MEMORY_BLOCKS = 4096
+RANGE_MERGE_GAP = 4
+RANGE_POOL_SIZE = 10
+RANGE_TIMEOUT = 60
+
+
+class DirectoryCache:
+    """
+    Thread safe LRU of deserialized leaf directories keyed by their offset, bounded by the total number of entries
+    """
+    def __init__(self, max_entries=READER_LEAF_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.current_entries = 0
+        self.hits = 0
+        self.misses = 0
+        self._directories = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, offset):
+        with self._lock:
+            directory = self._directories.get(offset)
+            if directory is None:
+                self.misses += 1
+                return None
+            self._directories.move_to_end(offset)
+            self.hits += 1
+            return directory
+
+    def put(self, offset, directory):
+        size = len(directory)
+        if size > self.max_entries:
+            return
+        with self._lock:
+            if offset in self._directories:
+                return
+            self._directories[offset] = directory
+            self.current_entries += size
+            while self.current_entries > self.max_entries:
+                _, evicted = self._directories.popitem(last=False)
+                self.current_entries -= len(evicted)
+
+    def info(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'directories': len(self._directories),
+                    'entries': self.current_entries, 'max_entries': self.max_entries}
+
+
+class RangeSource:
+    """
+    get_bytes over HTTP(S) Range requests, or ranged GetObject calls for s3://bucket/key URLs.
+
+    Reads are rounded to blocks of block_size bytes and all the blocks missing for one read are fetched with a single
+    request. Runs of missing blocks separated by up to merge_gap cached blocks are merged as well, so a directory and
+    the tiles stored next to it usually come in together. Blocks are kept in an in-memory LRU of memory_blocks blocks
+    and, with cache_dir, in one file per block under a directory named after the URL and its ETag (or Last-Modified),
+    so later runs reuse them. A source that changes while it is read raises a ValueError.
+    """
+    def __init__(self, url, block_size=RANGE_BLOCK_SIZE, cache_dir=None, memory_blocks=RANGE_MEMORY_BLOCKS,
+                 merge_gap=RANGE_MERGE_GAP, pool_size=RANGE_POOL_SIZE, timeout=RANGE_TIMEOUT, session=None):
+        self.url = url
+        self.block_size = int(block_size)
+        self.cache_dir = cache_dir
+        self.memory_blocks = memory_blocks
+        self.merge_gap = merge_gap
+        self.timeout = timeout
+        self.size = None
+        self.version = None
+        self.requests = 0
+        self.bytes_fetched = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self._block_dir = None
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+        parsed = urlparse(url)
+        if parsed.scheme == 's3':
+            import boto3
+            self._s3 = boto3.client('s3')
+            self._bucket = parsed.netloc
+            self._key = parsed.path.lstrip('/')
+            self.session = None
+        else:
+            self._s3 = None
+            if session is None:
+                session = requests.Session()
+                retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+            self.session = session
+
+    def __call__(self, offset, length):
+        if length <= 0:
+            return b""
+        first = offset // self.block_size
+        last = (offset + length - 1) // self.block_size
+        blocks = self.get_blocks(first, last)
+        start = offset - first * self.block_size
+        if len(blocks) == 1:
+            return blocks[0][start : start + length]
+        return b"".join(blocks)[start : start + length]
+
+    def get_blocks(self, first, last):
+        """
+        Return the blocks first to last (inclusive), fetching the missing ones with as few requests as possible
+        """
+        blocks = {}
+        missing = []
+        for index in range(first, last + 1):
+            block = self._cached_block(index)
+            if block is None:
+                missing.append(index)
+            else:
+                blocks[index] = block
+
+        for run_first, run_last in self._merge_runs(missing):
+            data = self._fetch(run_first * self.block_size, (run_last + 1) * self.block_size - 1)
+            for index in range(run_first, run_last + 1):
+                start = (index - run_first) * self.block_size
+                block = data[start : start + self.block_size]
+                blocks[index] = block
+                self._store_block(index, block)
+        return [blocks[index] for index in range(first, last + 1)]
+
+    def _merge_runs(self, missing):
+        runs = []
+        for index in missing:
+            if runs and index - runs[-1][1] <= self.merge_gap + 1:
+                runs[-1][1] = index
+            else:
+                runs.append([index, index])
+        return runs
+
+    def _cached_block(self, index):
+        with self._lock:
+            block = self._blocks.get(index)
+            if block is not None:
+                self._blocks.move_to_end(index)
+                self.memory_hits += 1
+                return block
+            block_dir = self._block_dir
+        if block_dir is None:
+            return None
+        try:
+            with open(os.path.join(block_dir, f"{index}.block"), "rb") as f:
+                block = f.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        self._remember_block(index, block)
+        return block
+
+    def _remember_block(self, index, block):
+        with self._lock:
+            self._blocks[index] = block
+            self._blocks.move_to_end(index)
+            while len(self._blocks) > self.memory_blocks:
+                self._blocks.popitem(last=False)
+
+    def _store_block(self, index, block):
+        self._remember_block(index, block)
+        if self._block_dir is None:
+            return
+        path = os.path.join(self._block_dir, f"{index}.block")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(block)
+        # Atomic, so concurrent readers of the same cache directory never see a partial block
+        os.replace(tmp_path, path)
+
+    def _fetch(self, start, end):
+        byte_range = f"bytes={start}-{end}"
+        if self._s3 is not None:
+            from botocore.exceptions import ClientError
+            try:
+                response = self._s3.get_object(Bucket=self._bucket, Key=self._key, Range=byte_range)
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') != 'InvalidRange':
+                    raise
+                data, version, content_range = b"", None, None
+            else:
+                data = response['Body'].read()
+                version = response.get('ETag') or response.get('LastModified')
+                content_range = response.get('ContentRange')
+        else:
+            response = self.session.get(self.url, headers={'Range': byte_range, 'Accept-Encoding': 'identity'},
+                                        timeout=self.timeout)
+            if response.status_code == 416:
+                # Range starting past the end of the archive
+                data, version, content_range = b"", None, None
+            else:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    response.close()
+                    raise ValueError(f"{self.url} does not support HTTP Range requests")
+                data = response.content
+                version = response.headers.get('ETag') or response.headers.get('Last-Modified')
+                content_range = response.headers.get('Content-Range')
+
+        with self._lock:
+            self.requests += 1
+            self.bytes_fetched += len(data)
+            if content_range and '/' in content_range:
+                total = content_range.rsplit('/', 1)[1]
+                if total.isdigit():
+                    self.size = int(total)
+            if version is not None:
+                self._set_version(str(version))
+        return data
+
+    def _set_version(self, version):
+        if self.version is None:
+            self.version = version
+            if self.cache_dir:
+                key = hashlib.blake2b(f"{self.url}\n{version}".encode(), digest_size=16).hexdigest()
+                self._block_dir = os.path.join(self.cache_dir, key)
+                os.makedirs(self._block_dir, exist_ok=True)
+        elif version != self.version:
+            raise ValueError(f"{self.url} changed while reading it ({self.version} -> {version})")
+
+    def info(self):
+        with self._lock:
+            return {'requests': self.requests, 'bytes_fetched': self.bytes_fetched, 'memory_hits': self.memory_hits,
+                    'disk_hits': self.disk_hits, 'blocks': len(self._blocks), 'size': self.size,
+                    'block_dir': self._block_dir}
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+
+
 class Reader:
-    def __init__(self, get_bytes):
+    """
+    The header is parsed and the root directory deserialized once, when the Reader is created.
+    Leaf directories are kept in a DirectoryCache, leaf_cache_entries=0 disables it.
+    """
+    def __init__(self, get_bytes, leaf_cache_entries=READER_LEAF_CACHE_ENTRIES):
         self.get_bytes = get_bytes
+        self._header = deserialize_header(self.get_bytes(0, 127))
+        self._root = deserialize_directory(
+            self.get_bytes(self._header["root_offset"], self._header["root_length"])
+        )
+        self.leaf_cache = DirectoryCache(leaf_cache_entries) if leaf_cache_entries else None
+        self._dictionary = None
 
     def header(self):
-        return deserialize_header(self.get_bytes(0, 127))
+        return dict(self._header)
 
     def metadata(self):
-        header = self.header()
+        header = self._header
         metadata = self.get_bytes(header["metadata_offset"], header["metadata_length"])
         if header["internal_compression"] == Compression.GZIP:
             metadata = gzip.decompress(metadata)
-        return json.loads(metadata)
+        return json.loads(bytes(metadata))
+
+    def tile_dictionary(self):
+        """
+        Zstd dictionary stored in the metadata, None if there is none. It is registered (see codec.load_dictionary),
+        so the tiles decode transparently.
+        """
+        if self._dictionary is None:
+            self._dictionary = load_dictionary(self.metadata()) or b""
+        return self._dictionary or None
+
+    def leaf_directory(self, offset, length):
+        if self.leaf_cache is not None:
+            directory = self.leaf_cache.get(offset)
+            if directory is not None:
+                return directory
+        directory = deserialize_directory(
+            self.get_bytes(self._header["leaf_directory_offset"] + offset, length)
+        )
+        if self.leaf_cache is not None:
+            self.leaf_cache.put(offset, directory)
+        return directory
+
+    def cache_info(self):
+        if self.leaf_cache is None:
+            return None
+        return self.leaf_cache.info()
 
     def get(self, z, x, y):
         tile_id = zxy_to_tileid(z, x, y)
-        header = self.header()
-        dir_offset = header["root_offset"]
-        dir_length = header["root_length"]
+        header = self._header
+        directory = self._root
         for depth in range(0, 4):  # max depth
-            directory = deserialize_directory(self.get_bytes(dir_offset, dir_length))
             result = find_tile(directory, tile_id)
-            if result:
-                if result.run_length == 0:
-                    dir_offset = header["leaf_directory_offset"] + result.offset
-                    dir_length = result.length
-                else:
-                    return self.get_bytes(
-                        header["tile_data_offset"] + result.offset, result.length
-                    )
+            if not result:
+                return None
+            if result.run_length == 0:
+                directory = self.leaf_directory(result.offset, result.length)
+            else:
+                return self.get_bytes(
+                    header["tile_data_offset"] + result.offset, result.length
+                )
 
 
-def traverse(get_bytes, header, dir_offset, dir_length):
+def expand_runs(tile_ids, run_lengths):
+    """
+    Tile ids addressed by runs starting at tile_ids, as one array
+    """
+    tile_ids = np.asarray(tile_ids, dtype=np.int64)
+    run_lengths = np.asarray(run_lengths, dtype=np.int64)
+    run_starts = np.repeat(np.cumsum(run_lengths) - run_lengths, run_lengths)
+    return np.repeat(tile_ids, run_lengths) + (np.arange(len(run_starts)) - run_starts)
+
+
+def traverse_runs(get_bytes, header, dir_offset, dir_length, recurse=True):
+    """
+    Yields (tile_id, run_length, offset, tile_data) once per tile entry: the tiles tile_id .. tile_id + run_length - 1
+    all share tile_data, read once. offset is the position of tile_data in the tile data section, entries with the
+    same offset have the same content.
+    """
     entries = deserialize_directory(get_bytes(dir_offset, dir_length))
     for entry in entries:
         if entry.run_length > 0:
+            tile_data = get_bytes(header["tile_data_offset"] + entry.offset, entry.length)
+            yield entry.tile_id, entry.run_length, entry.offset, tile_data
+        elif recurse:
+            yield from traverse_runs(
+                get_bytes,
+                header,
+                header["leaf_directory_offset"] + entry.offset,
+                entry.length,
+            )
+
+
+def traverse(get_bytes, header, dir_offset, dir_length, recurse=True):
+    entries = deserialize_directory(get_bytes(dir_offset, dir_length))
+    # Coordinates of every tile addressed by the entries of this directory, computed at once
+    z, x, y = tileid_to_zxy_batch(expand_runs(entries.tile_id, entries.run_length))
+    zxys = zip(z.tolist(), x.tolist(), y.tolist())
+    for entry in entries:
+        if entry.run_length > 0:
+            tile_data = get_bytes(header["tile_data_offset"] + entry.offset, entry.length)
             for i in range(entry.run_length):
-                yield tileid_to_zxy(entry.tile_id + i), get_bytes(
-                    header["tile_data_offset"] + entry.offset, entry.length
-                )
-        else:
+                yield next(zxys), tile_data
+        elif recurse:
             for t in traverse(
                 get_bytes,
                 header,
@@ -80,3 +406,30 @@ def traverse(get_bytes, header, dir_offset, dir_length):
 def all_tiles(get_bytes):
     header = deserialize_header(get_bytes(0, 127))
     return traverse(get_bytes, header, header["root_offset"], header["root_length"])
+
+
+def all_runs(get_bytes):
+    header = deserialize_header(get_bytes(0, 127))
+    return traverse_runs(get_bytes, header, header["root_offset"], header["root_length"])
+
+
+def tile_directories(get_bytes, header=None):
+    """
+    (offset, length) of every directory holding tile entries, usually the leaf directories, or just the root when
+    the archive has no leaves. traverse(..., recurse=False) over each of them visits every tile exactly once, so
+    they are the units an export is split on.
+    """
+    if header is None:
+        header = deserialize_header(get_bytes(0, 127))
+    directories = []
+    pending = [(header["root_offset"], header["root_length"])]
+    while pending:
+        dir_offset, dir_length = pending.pop()
+        entries = deserialize_directory(get_bytes(dir_offset, dir_length))
+        if (entries.run_length > 0).any():
+            directories.append((dir_offset, dir_length))
+        leaves = entries.run_length == 0
+        pending.extend(
+            zip((header["leaf_directory_offset"] + entries.offset[leaves]).tolist(), entries.length[leaves].tolist())
+        )
+    return sorted(directories)
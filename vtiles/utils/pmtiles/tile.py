@@ -1,6 +1,7 @@
 from enum import Enum
 import io
 import gzip
+import numpy as np
 
 
 class Entry:
@@ -16,28 +17,33 @@ class Entry:
         return f"id={self.tile_id} offset={self.offset} length={self.length} runlength={self.run_length}"
 
 
-def rotate(n, xy, rx, ry):
-    if ry == 0:
-        if rx == 1:
-            xy[0] = n - 1 - xy[0]
-            xy[1] = n - 1 - xy[1]
-        xy[0], xy[1] = xy[1], xy[0]
+def level_base(z):
+    # Number of tiles on the levels above z: sum of 4^i for i < z = (4^z - 1) / 3
+    return ((1 << (2 * z)) - 1) // 3
+
+
+def tileid_zoom(tile_id):
+    # Largest z with level_base(z) <= tile_id, i.e. 4^z <= 3 * tile_id + 1
+    return ((3 * tile_id + 1).bit_length() - 1) >> 1
 
 
 def t_on_level(z, pos):
-    n = 1 << z
-    rx, ry, t = pos, pos, pos
-    xy = [0, 0]
+    x = y = 0
     s = 1
+    n = 1 << z
     while s < n:
-        rx = 1 & (t // 2)
-        ry = 1 & (t ^ rx)
-        rotate(s, xy, rx, ry)
-        xy[0] += s * rx
-        xy[1] += s * ry
-        t //= 4
-        s *= 2
-    return z, xy[0], xy[1]
+        rx = (pos >> 1) & 1
+        ry = (pos ^ rx) & 1
+        if ry == 0:
+            if rx == 1:
+                x = s - 1 - x
+                y = s - 1 - y
+            x, y = y, x
+        x += s * rx
+        y += s * ry
+        pos >>= 2
+        s <<= 1
+    return z, x, y
 
 
 def zxy_to_tileid(z, x, y):
@@ -45,44 +51,96 @@ def zxy_to_tileid(z, x, y):
         raise OverflowError("tile zoom exceeds 64-bit limit")
     if x > (1 << z) - 1 or y > (1 << z) - 1:
         raise ValueError("tile x/y outside zoom level bounds")
-    acc = 0
-    tz = 0
-    while tz < z:
-        acc += (0x1 << tz) * (0x1 << tz)
-        tz += 1
-    n = 1 << z
-    rx = 0
-    ry = 0
     d = 0
-    xy = [x, y]
-    s = n // 2
+    s = 1 << z >> 1
     while s > 0:
-        if (xy[0] & s) > 0:
-            rx = 1
-        else:
-            rx = 0
-        if (xy[1] & s) > 0:
-            ry = 1
-        else:
-            ry = 0
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
         d += s * s * ((3 * rx) ^ ry)
-        rotate(s, xy, rx, ry)
-        s //= 2
-    return acc + d
+        if ry == 0:
+            if rx == 1:
+                x = s - 1 - x
+                y = s - 1 - y
+            x, y = y, x
+        s >>= 1
+    return level_base(z) + d
 
 
 def tileid_to_zxy(tile_id):
-    num_tiles = 0
-    acc = 0
-    for z in range(0,32):
-        num_tiles = (1 << z) * (1 << z)
-        if acc + num_tiles > tile_id:
-            return t_on_level(z, tile_id - acc)
-        acc += num_tiles
-    raise OverflowError("tile zoom exceeds 64-bit limit")
+    z = tileid_zoom(tile_id)
+    if z > 31:
+        raise OverflowError("tile zoom exceeds 64-bit limit")
+    return t_on_level(z, tile_id - level_base(z))
+
+
+LEVEL_BASES = np.array([level_base(z) for z in range(33)], dtype=np.uint64)
+
+
+def zxy_to_tileid_batch(z, x, y):
+    """
+    zxy_to_tileid over arrays of z, x, y, returns a uint64 array of tile ids
+    """
+    z = np.asarray(z, dtype=np.int64)
+    x = np.array(x, dtype=np.int64)
+    y = np.array(y, dtype=np.int64)
+    if len(z) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    if z.max() > 31:
+        raise OverflowError("tile zoom exceeds 64-bit limit")
+    n = np.left_shift(1, z)
+    if (x >= n).any() or (y >= n).any() or (x < 0).any() or (y < 0).any():
+        raise ValueError("tile x/y outside zoom level bounds")
+
+    d = np.zeros(len(z), dtype=np.uint64)
+    for bit in range(int(z.max()) - 1, -1, -1):
+        s = 1 << bit
+        active = s < n
+        rx = (x & s) != 0
+        ry = (y & s) != 0
+        quadrant = ((3 * rx) ^ ry).astype(np.uint64)
+        d += np.where(active, quadrant * np.uint64(s * s), np.uint64(0))
+        flip = active & ~ry & rx
+        x = np.where(flip, s - 1 - x, x)
+        y = np.where(flip, s - 1 - y, y)
+        swap = active & ~ry
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+    return LEVEL_BASES[z] + d
+
+
+def tileid_to_zxy_batch(tile_ids):
+    """
+    tileid_to_zxy over an array of tile ids, returns z, x, y int64 arrays
+    """
+    tile_ids = np.asarray(tile_ids, dtype=np.uint64)
+    z = np.searchsorted(LEVEL_BASES, tile_ids, side="right").astype(np.int64) - 1
+    if len(z) and z.max() > 31:
+        raise OverflowError("tile zoom exceeds 64-bit limit")
+    pos = (tile_ids - LEVEL_BASES[z]).astype(np.int64)
+    n = np.left_shift(1, z)
+
+    x = np.zeros(len(z), dtype=np.int64)
+    y = np.zeros(len(z), dtype=np.int64)
+    max_z = int(z.max()) if len(z) else 0
+    for bit in range(max_z):
+        s = 1 << bit
+        active = s < n
+        rx = (pos >> 1) & 1
+        ry = (pos ^ rx) & 1
+        flip = active & (ry == 0) & (rx == 1)
+        x = np.where(flip, s - 1 - x, x)
+        y = np.where(flip, s - 1 - y, y)
+        swap = active & (ry == 0)
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        x += np.where(active, s * rx, 0)
+        y += np.where(active, s * ry, 0)
+        pos >>= 2
+    return z, x, y
 
 
 def find_tile(entries, tile_id):
+    if isinstance(entries, Directory):
+        return entries.find_tile(tile_id)
+
     m = 0
     n = len(entries) - 1
     while m <= n:
@@ -102,6 +160,61 @@ def find_tile(entries, tile_id):
             return entries[n]
 
 
+class Directory:
+    """
+    Columnar directory: parallel int64 arrays of tile_id, offset, length and run_length, sorted by tile_id.
+    Indexing returns an Entry, slicing returns a Directory sharing the same arrays.
+    """
+    __slots__ = ("tile_id", "offset", "length", "run_length")
+
+    def __init__(self, tile_id, offset, length, run_length):
+        self.tile_id = np.asarray(tile_id, dtype=np.int64)
+        self.offset = np.asarray(offset, dtype=np.int64)
+        self.length = np.asarray(length, dtype=np.int64)
+        self.run_length = np.asarray(run_length, dtype=np.int64)
+
+    @classmethod
+    def from_entries(cls, entries):
+        if isinstance(entries, Directory):
+            return entries
+        return cls(
+            [e.tile_id for e in entries],
+            [e.offset for e in entries],
+            [e.length for e in entries],
+            [e.run_length for e in entries],
+        )
+
+    def __len__(self):
+        return len(self.tile_id)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return Directory(self.tile_id[i], self.offset[i], self.length[i], self.run_length[i])
+        return Entry(int(self.tile_id[i]), int(self.offset[i]), int(self.length[i]), int(self.run_length[i]))
+
+    def __iter__(self):
+        for tile_id, offset, length, run_length in zip(
+            self.tile_id.tolist(), self.offset.tolist(), self.length.tolist(), self.run_length.tolist()
+        ):
+            yield Entry(tile_id, offset, length, run_length)
+
+    def take(self, indices):
+        return Directory(
+            self.tile_id[indices], self.offset[indices], self.length[indices], self.run_length[indices]
+        )
+
+    def find_tile(self, tile_id):
+        # Index of the last entry with entry.tile_id <= tile_id
+        n = int(self.tile_id.searchsorted(tile_id, "right")) - 1
+        if n < 0:
+            return None
+        entry_id = self.tile_id.item(n)
+        run_length = self.run_length.item(n)
+        if entry_id == tile_id or run_length == 0 or tile_id - entry_id < run_length:
+            return Entry(entry_id, self.offset.item(n), self.length.item(n), run_length)
+        return None
+
+
 def read_varint(b_io):
     shift = 0
     result = 0
@@ -145,55 +258,82 @@ class TileType(Enum):
     AVIF = 5
 
 
-def deserialize_directory(buf):
-    b_io = io.BytesIO(gzip.decompress(buf))
-    entries = []
-    num_entries = read_varint(b_io)
-
-    last_id = 0
-    for i in range(num_entries):
-        tmp = read_varint(b_io)
-        entries.append(Entry(last_id + tmp, 0, 0, 0))
-        last_id += tmp
-
-    for i in range(num_entries):
-        entries[i].run_length = read_varint(b_io)
-
-    for i in range(num_entries):
-        entries[i].length = read_varint(b_io)
-
-    for i in range(num_entries):
-        tmp = read_varint(b_io)
-        if i > 0 and tmp == 0:
-            entries[i].offset = entries[i - 1].offset + entries[i - 1].length
-        else:
-            entries[i].offset = tmp - 1
-
-    return entries
+def decode_varints(buf):
+    """
+    Decode every varint of buf at once, returns a uint64 array
+    """
+    data = np.frombuffer(buf, dtype=np.uint8)
+    ends = np.flatnonzero(data < 0x80)
+    if len(ends) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    data = data[: ends[-1] + 1]
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    sizes = ends - starts + 1
+    if sizes.max() > 10:
+        raise ValueError("varint exceeds 64 bits")
+    shifts = (np.arange(len(data)) - np.repeat(starts, sizes)) * 7
+    values = (data & 0x7F).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.add.reduceat(values, starts)
+
+
+def encode_varints(values):
+    """
+    Encode an array of unsigned integers as consecutive varints
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        sizes += rest > 0
+        rest >>= np.uint64(7)
+    starts = np.cumsum(sizes) - sizes
+    positions = np.arange(int(sizes.sum())) - np.repeat(starts, sizes)
+    shifted = np.repeat(values, sizes) >> (positions * 7).astype(np.uint64)
+    out = (shifted & np.uint64(0x7F)).astype(np.uint8)
+    out[positions < np.repeat(sizes - 1, sizes)] |= 0x80
+    return out.tobytes()
 
 
-def serialize_directory(entries):
-    b_io = io.BytesIO()
-    write_varint(b_io, len(entries))
-
-    last_id = 0
-    for e in entries:
-        write_varint(b_io, e.tile_id - last_id)
-        last_id = e.tile_id
+def deserialize_directory(buf):
+    values = decode_varints(gzip.decompress(buf))
+    if len(values) == 0:
+        raise EOFError("unexpectedly reached end of varint stream")
+    num_entries = int(values[0])
+    if len(values) < 1 + 4 * num_entries:
+        raise EOFError("unexpectedly reached end of varint stream")
+    columns = values[1 : 1 + 4 * num_entries].astype(np.int64).reshape(4, num_entries)
+
+    tile_id = np.cumsum(columns[0])
+    run_length = columns[1]
+    length = columns[2]
+    raw_offset = columns[3]
+
+    # An offset of 0 means "right after the previous entry": carry the last explicit offset forward and add
+    # the lengths of the entries in between
+    explicit = np.arange(num_entries)
+    explicit[1:][raw_offset[1:] == 0] = 0
+    last_explicit = np.maximum.accumulate(explicit) if num_entries else explicit
+    length_sum = np.concatenate(([0], np.cumsum(length)))
+    offset = raw_offset[last_explicit] - 1 + length_sum[:num_entries] - length_sum[last_explicit]
+
+    return Directory(tile_id, offset, length, run_length)
 
-    for e in entries:
-        write_varint(b_io, e.run_length)
 
-    for e in entries:
-        write_varint(b_io, e.length)
+def serialize_directory(entries):
+    directory = Directory.from_entries(entries)
+    num_entries = len(directory)
 
-    for i, e in enumerate(entries):
-        if i > 0 and e.offset == entries[i - 1].offset + entries[i - 1].length:
-            write_varint(b_io, 0)
-        else:
-            write_varint(b_io, e.offset + 1)
+    tile_id_delta = np.diff(directory.tile_id, prepend=0)
+    contiguous = np.zeros(num_entries, dtype=bool)
+    contiguous[1:] = directory.offset[1:] == directory.offset[:-1] + directory.length[:-1]
+    offset = np.where(contiguous, 0, directory.offset + 1)
 
-    return gzip.compress(b_io.getvalue())
+    values = np.concatenate((
+        [num_entries], tile_id_delta, directory.run_length, directory.length, offset
+    )).astype(np.uint64)
+    return gzip.compress(encode_varints(values))
 
 class SpecVersionUnsupported(Exception):
     pass
@@ -202,7 +342,7 @@ class MagicNumberNotFound(Exception):
     pass
 
 def deserialize_header(buf):
-    if buf[0:7].decode() != "PMTiles":
+    if bytes(buf[0:7]) != b"PMTiles":
         raise MagicNumberNotFound()
 
     if buf[7] != 0x3:
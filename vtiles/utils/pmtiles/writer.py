@@ -1,10 +1,12 @@
 import json
+import hashlib
 import tempfile
 import gzip
-import shutil
 from contextlib import contextmanager
+import numpy as np
 from .tile import (
     Entry,
+    Directory,
     serialize_directory,
     Compression,
     serialize_header,
@@ -13,9 +15,14 @@ from .tile import (
 
 
 @contextmanager
-def write(fname):
+def write(fname, dedup_max_size=None, dedup_max_entries=None):
+    """
+    Yield a Writer of a new PMTiles file fname. The deduplication index is bounded by default: only tiles of at most
+    DEDUP_MAX_SIZE bytes (dedup_max_size) are deduplicated, and once DEDUP_MAX_ENTRIES distinct contents
+    (dedup_max_entries, about 120 bytes of memory each) are indexed, further tiles are only matched against them.
+    """
     f = open(fname, "wb")
-    w = Writer(f)
+    w = Writer(f, dedup_max_size, dedup_max_entries)
     try:
         yield w
     finally:
@@ -24,7 +31,8 @@ def write(fname):
 
 def build_roots_leaves(entries, leaf_size):
     root_entries = []
-    leaves_bytes = b""
+    leaves = []
+    leaves_length = 0
     num_leaves = 0
 
     i = 0
@@ -32,15 +40,17 @@ def build_roots_leaves(entries, leaf_size):
         num_leaves += 1
         serialized = serialize_directory(entries[i : i + leaf_size])
         root_entries.append(
-            Entry(entries[i].tile_id, len(leaves_bytes), len(serialized), 0)
+            Entry(entries[i].tile_id, leaves_length, len(serialized), 0)
         )
-        leaves_bytes += serialized
+        leaves.append(serialized)
+        leaves_length += len(serialized)
         i += leaf_size
 
-    return serialize_directory(root_entries), leaves_bytes, num_leaves
+    return serialize_directory(root_entries), b"".join(leaves), num_leaves
 
 
 def optimize_directories(entries, target_root_len):
+    entries = Directory.from_entries(entries)
     test_bytes = serialize_directory(entries)
     if len(test_bytes) < target_root_len:
         return test_bytes, b"", 0
@@ -53,72 +63,213 @@ def optimize_directories(entries, target_root_len):
         leaf_size *= 2
 
 
+def write_directories(f, entries, target_root_len):
+    """
+    Streaming counterpart of optimize_directories: leaf directories are written to f at its current position as they
+    are serialized, only the root entries are kept in memory. If the root does not fit, the leaves are rewritten
+    with twice as many entries each. Returns (root_bytes, leaves_length, num_leaves).
+    """
+    if len(entries) <= WRITER_SPILL_ENTRIES:
+        test_bytes = serialize_directory(entries)
+        if len(test_bytes) < target_root_len:
+            return test_bytes, 0, 0
+
+    start = f.tell()
+    leaf_size = 4096
+    while True:
+        f.seek(start)
+        f.truncate()
+        root_ids, root_offsets, root_lengths = [], [], []
+        leaves_length = 0
+        for i in range(0, len(entries), leaf_size):
+            serialized = serialize_directory(entries[i : i + leaf_size])
+            f.write(serialized)
+            root_ids.append(int(entries.tile_id[i]))
+            root_offsets.append(leaves_length)
+            root_lengths.append(len(serialized))
+            leaves_length += len(serialized)
+        root_bytes = serialize_directory(
+            Directory(root_ids, root_offsets, root_lengths, np.zeros(len(root_ids)))
+        )
+        if len(root_bytes) < target_root_len:
+            return root_bytes, leaves_length, len(root_ids)
+        leaf_size *= 2
+
+
+# Default settings
+DEDUP_DIGEST_SIZE = 16
+DEDUP_MAX_SIZE = 1024
+DEDUP_MAX_ENTRIES = 1 << 21
+WRITER_RESERVED_BYTES = 16384
+WRITER_SPILL_ENTRIES = 1 << 20
+
+ENTRY_DTYPE = np.dtype(
+    [("tile_id", "<i8"), ("offset", "<i8"), ("length", "<i8"), ("run_length", "<i8")]
+)
+
+
+def tile_digest(data):
+    # Strong, process independent content key: Python's hash() is salted per process and can collide
+    return hashlib.blake2b(data, digest_size=DEDUP_DIGEST_SIZE).digest()
+
+
 class Writer:
-    def __init__(self, f):
+    """
+    Tile data is written straight to f after WRITER_RESERVED_BYTES reserved for the header and the root directory,
+    so every tile byte is written once. Directory entries are spilled to a temporary file every
+    WRITER_SPILL_ENTRIES entries; finalize memory maps them and streams the metadata and leaf directories after the
+    tile data, then writes the header and root directory into the reserved space. f must be seekable.
+
+    Tiles with the same content are stored once. dedup_max_size limits deduplication to tiles of at most that many
+    bytes (default DEDUP_MAX_SIZE, 0: no deduplication), which keeps the digest index small: most duplicates are
+    small ocean/empty tiles. The index holds at most dedup_max_entries digests (default DEDUP_MAX_ENTRIES): those of
+    the contents seen first, which usually include the most repeated ones. stats() reports the deduplication ratio
+    and the bytes saved.
+    """
+    def __init__(self, f, dedup_max_size=None, dedup_max_entries=None):
         self.f = f
-        self.tile_entries = []
+        self.f.seek(WRITER_RESERVED_BYTES)
+        self.dedup_max_size = DEDUP_MAX_SIZE if dedup_max_size is None else dedup_max_size
+        self.dedup_max_entries = DEDUP_MAX_ENTRIES if dedup_max_entries is None else dedup_max_entries
+        # Columns of the entries not spilled yet
+        self.tile_ids = []
+        self.offsets = []
+        self.lengths = []
+        self.run_lengths = []
+        self.spill_f = tempfile.TemporaryFile()
+        self.spilled_entries = 0
+        self.last_tile_id = -1
         self.hash_to_offset = {}
-        self.tile_f = tempfile.TemporaryFile()
         self.offset = 0
         self.addressed_tiles = 0
+        self.tile_contents = 0
+        self.dedup_tiles = 0
+        self.dedup_bytes = 0
         self.clustered = True
 
     def write_tile(self, tileid, data):
-        if len(self.tile_entries) > 0 and tileid < self.tile_entries[-1].tile_id:
+        if tileid < self.last_tile_id:
             self.clustered = False
+        self.last_tile_id = tileid
+
+        if len(data) <= self.dedup_max_size:
+            hsh = tile_digest(data)
+        else:
+            hsh = None
 
-        hsh = hash(data)
-        if hsh in self.hash_to_offset:
-            last = self.tile_entries[-1]
-            found = self.hash_to_offset[hsh]
-            if tileid == last.tile_id + last.run_length and last.offset == found:
-                self.tile_entries[-1].run_length += 1
+        found = self.hash_to_offset.get(hsh) if hsh is not None else None
+        if found is not None:
+            if (
+                len(self.tile_ids) > 0
+                and tileid == self.tile_ids[-1] + self.run_lengths[-1]
+                and self.offsets[-1] == found
+            ):
+                self.run_lengths[-1] += 1
             else:
-                self.tile_entries.append(Entry(tileid, found, len(data), 1))
+                self.add_entry(tileid, found, len(data), 1)
+            self.dedup_tiles += 1
+            self.dedup_bytes += len(data)
         else:
-            self.tile_f.write(data)
-            self.tile_entries.append(Entry(tileid, self.offset, len(data), 1))
-            self.hash_to_offset[hsh] = self.offset
+            self.f.write(data)
+            self.add_entry(tileid, self.offset, len(data), 1)
+            if hsh is not None and len(self.hash_to_offset) < self.dedup_max_entries:
+                self.hash_to_offset[hsh] = self.offset
             self.offset += len(data)
+            self.tile_contents += 1
 
         self.addressed_tiles += 1
 
-    def finalize(self, header, metadata):
-        header["addressed_tiles_count"] = self.addressed_tiles
-        header["tile_entries_count"] = len(self.tile_entries)
-        header["tile_contents_count"] = len(self.hash_to_offset)
+    def stats(self):
+        return {
+            "addressed_tiles": self.addressed_tiles,
+            "tile_entries": self.spilled_entries + len(self.tile_ids),
+            "tile_contents": self.tile_contents,
+            "dedup_tiles": self.dedup_tiles,
+            "dedup_ratio": self.addressed_tiles / self.tile_contents if self.tile_contents else 1.0,
+            "bytes_written": self.offset,
+            "bytes_saved": self.dedup_bytes,
+            "dedup_index_size": len(self.hash_to_offset),
+        }
 
-        self.tile_entries = sorted(self.tile_entries, key=lambda e: e.tile_id)
+    def add_entry(self, tileid, offset, length, run_length):
+        if len(self.tile_ids) >= WRITER_SPILL_ENTRIES:
+            # Keep the last entry, its run may still grow
+            self.spill_entries(len(self.tile_ids) - 1)
+        self.tile_ids.append(tileid)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+        self.run_lengths.append(run_length)
 
-        header["min_zoom"] = tileid_to_zxy(self.tile_entries[0].tile_id)[0]
-        header["max_zoom"] = tileid_to_zxy(self.tile_entries[-1].tile_id)[0]
+    def spill_entries(self, count):
+        records = np.empty(count, dtype=ENTRY_DTYPE)
+        records["tile_id"] = self.tile_ids[:count]
+        records["offset"] = self.offsets[:count]
+        records["length"] = self.lengths[:count]
+        records["run_length"] = self.run_lengths[:count]
+        self.spill_f.write(records.tobytes())
+        self.spilled_entries += count
+        for column in (self.tile_ids, self.offsets, self.lengths, self.run_lengths):
+            del column[:count]
 
-        root_bytes, leaves_bytes, num_leaves = optimize_directories(
-            self.tile_entries, 16384 - 127
+    def spilled_directory(self):
+        """
+        Directory over the memory mapped spill file, sorted by tile id
+        """
+        self.spill_entries(len(self.tile_ids))
+        self.spill_f.flush()
+        if self.spilled_entries == 0:
+            return Directory([], [], [], [])
+        records = np.memmap(self.spill_f, dtype=ENTRY_DTYPE, mode="r")
+        if not self.clustered:
+            # Write the records again in tile id order, only the sort order is held in memory
+            order = np.argsort(records["tile_id"], kind="stable")
+            sorted_f = tempfile.TemporaryFile()
+            for start in range(0, len(order), WRITER_SPILL_ENTRIES):
+                sorted_f.write(records[order[start : start + WRITER_SPILL_ENTRIES]].tobytes())
+            sorted_f.flush()
+            del records, order
+            self.spill_f.close()
+            self.spill_f = sorted_f
+            records = np.memmap(self.spill_f, dtype=ENTRY_DTYPE, mode="r")
+        return Directory(
+            records["tile_id"], records["offset"], records["length"], records["run_length"]
         )
 
+    def finalize(self, header, metadata):
+        header["addressed_tiles_count"] = self.addressed_tiles
+        header["tile_entries_count"] = self.spilled_entries + len(self.tile_ids)
+        header["tile_contents_count"] = self.tile_contents
+
+        directory = self.spilled_directory()
+        if len(directory) > 0:
+            header["min_zoom"] = tileid_to_zxy(int(directory.tile_id[0]))[0]
+            header["max_zoom"] = tileid_to_zxy(int(directory.tile_id[-1]))[0]
+
+        # Metadata and leaf directories follow the tile data
         compressed_metadata = gzip.compress(json.dumps(metadata).encode())
         header["clustered"] = self.clustered
         header["internal_compression"] = Compression.GZIP
-        header["root_offset"] = 127
-        header["root_length"] = len(root_bytes)
-        header["metadata_offset"] = header["root_offset"] + header["root_length"]
+        header["tile_data_offset"] = WRITER_RESERVED_BYTES
+        header["tile_data_length"] = self.offset
+        header["metadata_offset"] = header["tile_data_offset"] + header["tile_data_length"]
         header["metadata_length"] = len(compressed_metadata)
         header["leaf_directory_offset"] = (
             header["metadata_offset"] + header["metadata_length"]
         )
-        header["leaf_directory_length"] = len(leaves_bytes)
-        header["tile_data_offset"] = (
-            header["leaf_directory_offset"] + header["leaf_directory_length"]
+
+        self.f.seek(header["metadata_offset"])
+        self.f.write(compressed_metadata)
+        root_bytes, leaves_length, num_leaves = write_directories(
+            self.f, directory, WRITER_RESERVED_BYTES - 127
         )
-        header["tile_data_length"] = self.offset
+        header["leaf_directory_length"] = leaves_length
+        header["root_offset"] = 127
+        header["root_length"] = len(root_bytes)
 
-        header_bytes = serialize_header(header)
+        del directory
+        self.spill_f.close()
 
-        self.f.write(header_bytes)
+        self.f.seek(0)
+        self.f.write(serialize_header(header))
         self.f.write(root_bytes)
-        self.f.write(compressed_metadata)
-        self.f.write(leaves_bytes)
-        self.tile_f.seek(0)
-        shutil.copyfileobj(self.tile_f, self.f)
-        self.tile_f.close()
+        self.f.seek(0, 2)
@@ -1,37 +1,73 @@
 import argparse
 import json
 import os,sys, logging
-from .pmtiles.reader import Reader, MmapSource, all_tiles  
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .pmtiles.reader import Reader, MmapSource, traverse, tile_directories
+from .pmtiles.tile import TileType
 from tqdm import tqdm 
 
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 logger = logging.getLogger(__name__)
 
-def pmtiles_to_folder(input_file, output_folder):   
-    with open(input_file, "r+b") as f:
+TILE_EXTENSIONS = {TileType.MVT: "pbf", TileType.PNG: "png", TileType.JPEG: "jpg", TileType.WEBP: "webp", TileType.AVIF: "avif"}
+
+# Per process state of the export workers
+_export = {}
+
+
+def init_folder_worker(input_file, output_folder, ext):
+    f = open(input_file, "rb")
+    _export["get_bytes"] = MmapSource(f, zero_copy=True)
+    _export["header"] = Reader(_export["get_bytes"], leaf_cache_entries=0).header()
+    _export["output_folder"] = output_folder
+    _export["ext"] = ext
+    _export["created"] = set()
+
+
+def export_directory(dir_offset, dir_length):
+    """
+    Write the tiles of one directory to the output folder, returns the number of tiles written
+    """
+    count = 0
+    created = _export["created"]
+    for zxy, tile_data in traverse(_export["get_bytes"], _export["header"], dir_offset, dir_length, recurse=False):
+        z, x, y = zxy
+        directory = os.path.join(_export["output_folder"], str(z), str(x))
+        if directory not in created:
+            os.makedirs(directory, exist_ok=True)
+            created.add(directory)
+        path = os.path.join(directory, f"{y}.{_export['ext']}")
+        with open(path, "wb") as tile_file:
+            tile_file.write(tile_data)
+        count += 1
+    return count
+
+
+def pmtiles_to_folder(input_file, output_folder, workers=None):
+    with open(input_file, "rb") as f:
         source = MmapSource(f)
         reader = Reader(source)
-        
+        header = reader.header()
+
         # Write metadata to a JSON file
         with open(os.path.join(output_folder, "metadata.json"), "w") as metadata_file:
             metadata_file.write(json.dumps(reader.metadata()))
 
-        # Get total number of tiles for progress bar
-        total_tiles = len(list(all_tiles(source)))
-        
-        # Iterate over all tiles and write them to the output folder
-        for zxy, tile_data in tqdm(all_tiles(source), total=total_tiles, desc="Processing tiles"):
-            z, x, y = zxy
-            directory = os.path.join(output_folder, str(z), str(x))
-            os.makedirs(directory, exist_ok=True)
-            path = os.path.join(directory, str(y) + ".pbf")  # Change extension as needed
-            with open(path, "wb") as tile_file:
-                tile_file.write(tile_data)
+        directories = tile_directories(source, header)
+
+    ext = TILE_EXTENSIONS.get(header["tile_type"], "pbf")
+    # Tile directories are split across worker processes, the tile count comes from the header
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_folder_worker, initargs=(input_file, output_folder, ext)) as executor:
+        futures = [executor.submit(export_directory, offset, length) for offset, length in directories]
+        with tqdm(total=header["addressed_tiles_count"], desc="Processing tiles") as pbar:
+            for future in as_completed(futures):
+                pbar.update(future.result())
 
 def main():
     parser = argparse.ArgumentParser(description='Convert PMTiles to tiles folder')
     parser.add_argument('input', help='Input PMTiles file path')
     parser.add_argument('-o', '--output',help='Output directory path')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Number of worker processes (default: number of CPUs)')
     args = parser.parse_args()
 
     if not os.path.exists(args.input):
@@ -54,7 +90,7 @@ def main():
 
     # Inform the user of the conversion
     logging.info(f'Converting {input_filename_abspath} to {output_folder_abspath} folder.')
-    pmtiles_to_folder(input_filename_abspath, output_folder_abspath)
+    pmtiles_to_folder(input_filename_abspath, output_folder_abspath, args.workers)
 
 
 if __name__ == "__main__":
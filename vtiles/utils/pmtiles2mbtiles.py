@@ -1,7 +1,11 @@
 import argparse, sys, os
 import json
-from .pmtiles.reader import Reader, MmapSource, all_tiles
-from .pmtiles.tile import TileType
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .pmtiles.reader import Reader, MmapSource, traverse_runs, tile_directories, expand_runs
+from .pmtiles.tile import TileType, tileid_to_zxy_batch
+from .codec import get_codec, codec_name
+from .mbtileswriter import METADATA_SCHEMA, DEDUP_SCHEMA, DEDUP_INDEX, DEDUP_VIEW, TILES_SCHEMA, TILES_INDEX
 import sqlite3
 from tqdm import tqdm
 import logging
@@ -9,19 +13,79 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def pmtiles_to_mbtiles(input, output):
+# Per process state of the export workers
+_shard = {}
+
+
+def init_shard_worker(input, shard_dir, dedup):
+    f = open(input, "rb")
+    _shard["get_bytes"] = MmapSource(f, zero_copy=True)
+    _shard["header"] = Reader(_shard["get_bytes"], leaf_cache_entries=0).header()
+    _shard["dedup"] = dedup
+    conn = sqlite3.connect(os.path.join(shard_dir, f"shard-{os.getpid()}.mbtiles"))
+    conn.execute("PRAGMA synchronous=OFF;")
+    conn.execute("PRAGMA journal_mode=OFF;")
+    for statement in DEDUP_SCHEMA if dedup else TILES_SCHEMA:
+        conn.execute(statement)
+    _shard["conn"] = conn
+
+
+def write_runs(conn, runs, dedup):
+    """
+    Insert a batch of (tile_id, run_length, offset, tile_data) runs, returns the number of tiles
+    """
+    tile_ids = expand_runs([run[0] for run in runs], [run[1] for run in runs])
+    z, x, y = tileid_to_zxy_batch(tile_ids)
+    tile_rows = ((1 << z) - 1 - y).tolist()
+    run_lengths = [run[1] for run in runs]
+    if dedup:
+        # The offset of the content in the archive identifies it
+        image_ids = [str(run[2]) for run in runs]
+        conn.executemany(
+            "INSERT OR IGNORE INTO images VALUES(?,?)", zip([run[3] for run in runs], image_ids)
+        )
+        values = [image_id for image_id, run_length in zip(image_ids, run_lengths) for _ in range(run_length)]
+        conn.executemany("INSERT INTO map VALUES(?,?,?,?)", zip(z.tolist(), x.tolist(), tile_rows, values))
+    else:
+        values = [run[3] for run in runs for _ in range(run[1])]
+        conn.executemany("INSERT INTO tiles VALUES(?,?,?,?)", zip(z.tolist(), x.tolist(), tile_rows, values))
+    return len(tile_ids)
+
+
+def export_directory(dir_offset, dir_length, batch_size=10000):
+    """
+    Write the tiles of one directory into this worker's shard, returns the number of tiles written
+    """
+    conn = _shard["conn"]
+    count = 0
+    runs = []
+    pending = 0
+    for run in traverse_runs(_shard["get_bytes"], _shard["header"], dir_offset, dir_length, recurse=False):
+        runs.append(run)
+        pending += run[1]
+        if pending >= batch_size:
+            count += write_runs(conn, runs, _shard["dedup"])
+            runs = []
+            pending = 0
+    if runs:
+        count += write_runs(conn, runs, _shard["dedup"])
+    conn.commit()
+    return count
+
+
+def pmtiles_to_mbtiles(input, output, workers=None, batch_size=10000, dedup=True):
+    """
+    The tile directories of the archive are exported in parallel, each worker process writes its own shard database
+    next to the output. The shards are then attached and copied into the output, and the tile index built last.
+    With dedup, tile contents shared by several tiles (runs and deduplicated entries of the archive) are stored
+    once in the images table, tiles is a view over map and images. Otherwise tiles is a plain table.
+    """
     conn = sqlite3.connect(output)
     cursor = conn.cursor()
-    cursor.execute("CREATE TABLE metadata (name text, value text);")
-    cursor.execute("""create unique index name on metadata (name);""")
-    cursor.execute(
-        "CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob);"
-    )
-    cursor.execute(
-        "CREATE UNIQUE INDEX tile_index on tiles (zoom_level, tile_column, tile_row);"
-    )
-
-    with open(input, "r+b") as f:
+    for statement in METADATA_SCHEMA + (DEDUP_SCHEMA if dedup else TILES_SCHEMA):
+        cursor.execute(statement)
+
+    with open(input, "rb") as f:
         source = MmapSource(f)
 
         reader = Reader(source)
@@ -48,6 +112,10 @@ def pmtiles_to_mbtiles(input, output):
         if "format" not in metadata and header["tile_type"] == TileType.MVT:
             metadata["format"] = "pbf"
 
+        if header["tile_type"] == TileType.MVT:
+            # Tiles are copied as stored, brotli tiles can only be decoded with the declared codec
+            metadata.setdefault("compression", codec_name(get_codec(header["tile_compression"])))
+
         json_metadata = {}
         for k, v in metadata.items():
             if k in ["vector_layers", "tilestats"]:
@@ -62,15 +130,32 @@ def pmtiles_to_mbtiles(input, output):
                 "INSERT INTO metadata VALUES(?,?)",
                 ("json", json.dumps(json_metadata, ensure_ascii=False)),
             )
+        conn.commit()
 
-        tile_count = sum(1 for _ in all_tiles(source))
-        for zxy, tile_data in tqdm(all_tiles(source), total=tile_count, desc="Converting tiles"):
-            flipped_y = (1 << zxy[0]) - 1 - zxy[2]
-            cursor.execute(
-                "INSERT INTO tiles VALUES(?,?,?,?)",
-                (zxy[0], zxy[1], flipped_y, tile_data),
-            )
+        directories = tile_directories(source, header)
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output))) as shard_dir:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_shard_worker, initargs=(input, shard_dir, dedup)) as executor:
+            futures = [executor.submit(export_directory, offset, length, batch_size) for offset, length in directories]
+            with tqdm(total=header["addressed_tiles_count"], desc="Converting tiles") as pbar:
+                for future in as_completed(futures):
+                    pbar.update(future.result())
 
+        for shard in sorted(os.listdir(shard_dir)):
+            cursor.execute("ATTACH DATABASE ? AS shard", (os.path.join(shard_dir, shard),))
+            if dedup:
+                cursor.execute("INSERT OR IGNORE INTO images SELECT * FROM shard.images;")
+                cursor.execute("INSERT INTO map SELECT * FROM shard.map;")
+            else:
+                cursor.execute("INSERT INTO tiles SELECT * FROM shard.tiles;")
+            conn.commit()
+            cursor.execute("DETACH DATABASE shard")
+
+    if dedup:
+        cursor.execute(DEDUP_INDEX)
+        cursor.execute(DEDUP_VIEW)
+    else:
+        cursor.execute(TILES_INDEX)
     conn.commit()
     conn.close()
 
@@ -78,6 +163,8 @@ def main():
     parser = argparse.ArgumentParser(description='Convert PMTiles to MBTiles.')
     parser.add_argument('input', help='Path to the input PMTiles file.')
     parser.add_argument('-o', '--output', help='Path to the output MBTiles file.')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Number of worker processes (default: number of CPUs).')
+    parser.add_argument('--flat', action='store_true', help='Write a plain tiles table instead of the deduplicated images/map layout.')
     
     args = parser.parse_args()
     if not os.path.exists(args.input):
@@ -103,7 +190,7 @@ def main():
             sys.exit(1)          
 
     logging.info(f'Converting {input_file_abspath} to {output_file_abspath}.')
-    pmtiles_to_mbtiles(input_file_abspath, output_file_abspath)
+    pmtiles_to_mbtiles(input_file_abspath, output_file_abspath, args.workers, dedup=not args.flat)
     logging.info(f'Converting PMTiles to MBTiles done!')
 
 if __name__ == "__main__":
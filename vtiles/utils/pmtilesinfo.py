@@ -1,10 +1,13 @@
 #!/usr/bin/env python
+import os
 import sys
 import pprint
-import requests
-from io import BytesIO
+import tempfile
 from urllib.parse import urlparse
-from .pmtiles.reader import Reader, MmapSource
+from .pmtiles.reader import Reader, MmapSource, RangeSource
+
+# Blocks of remote archives are kept here between runs
+PMTILESINFO_CACHE_DIR = os.path.join(tempfile.gettempdir(), "vtiles-pmtiles-cache")
 
 def print_usage():
     print("Usage: pmtilesinfo PMTILES_FILE_OR_URL")
@@ -12,7 +15,20 @@ def print_usage():
     exit(1)
 
 def is_url(path):
-    return urlparse(path).scheme in ("http", "https")
+    return urlparse(path).scheme in ("http", "https", "s3")
+
+def print_info(reader):
+    if len(sys.argv) == 2:
+        pprint.pprint(reader.header())
+        pprint.pprint(reader.metadata())
+    elif len(sys.argv) == 5:
+        z = int(sys.argv[2])
+        x = int(sys.argv[3])
+        y = int(sys.argv[4])
+        tile_data = reader.get(z, x, y)
+        sys.stdout.buffer.write(tile_data)
+    else:
+        print_usage()
 
 def main():
     if len(sys.argv) <= 1:
@@ -21,27 +37,16 @@ def main():
     pmtiles_path = sys.argv[1]
 
     try:
-        # Check if path is a URL and fetch data
         if is_url(pmtiles_path):
-            response = requests.get(pmtiles_path)
-            response.raise_for_status()
-            file_data = BytesIO(response.content)
+            # Only the header, the directories and the requested tile are fetched, with HTTP Range requests
+            source = RangeSource(pmtiles_path, cache_dir=PMTILESINFO_CACHE_DIR)
+            try:
+                print_info(Reader(source))
+            finally:
+                source.close()
         else:
-            file_data = open(pmtiles_path, "r+b")
-
-        with file_data as f:
-            reader = Reader(MmapSource(f))
-            if len(sys.argv) == 2:
-                pprint.pprint(reader.header())
-                pprint.pprint(reader.metadata())
-            elif len(sys.argv) == 5:
-                z = int(sys.argv[2])
-                x = int(sys.argv[3])
-                y = int(sys.argv[4])
-                tile_data = reader.get(z, x, y)
-                sys.stdout.buffer.write(tile_data)
-            else:
-                print_usage()
+            with open(pmtiles_path, "rb") as f:
+                print_info(Reader(MmapSource(f)))
 
     except Exception as e:
         print(f"Error: {e}")
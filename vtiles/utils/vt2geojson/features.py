@@ -1,6 +1,8 @@
 from enum import Enum
 from math import pi, atan, exp
 
+import numpy as np
+
 
 class GeometryType(Enum):
     UNKNOWN = 'Unknown'
@@ -82,3 +84,21 @@ class Layer:
             "features": [Feature(x=self.x, y=self.y, z=self.z, obj=f, extent=self.extent).toGeoJSON()
                          for f in self.obj['features']]
         }
+
+
+def project_coordinates(coords, x, y, z, extent=4096):
+    """
+    Project tile coordinates to longitudes and latitudes, like Feature.toGeoJSON but for a whole NumPy array at once.
+    :param coords: a (n, 2) array of tile coordinates, with the y axis down.
+    :param x: tile x coordinate.
+    :param y: tile y coordinate.
+    :param z: tile z coordinate.
+    :param extent: the extent of the layer.
+    :return: a list of [longitude, latitude].
+    """
+    size = extent * 2 ** z
+    coords = np.asarray(coords, dtype=np.float64)
+    longitudes = (coords[:, 0] + extent * x) * 360. / size - 180
+    y2 = 180 - (coords[:, 1] + extent * y) * 360. / size
+    latitudes = 360. / pi * np.arctan(np.exp(y2 * pi / 180)) - 90
+    return np.column_stack((longitudes, latitudes)).tolist()
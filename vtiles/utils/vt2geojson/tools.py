@@ -1,8 +1,8 @@
 from urllib.parse import urlparse
 
-from vtiles.utils.mapbox_vector_tile import decode
+from vtiles.utils.mapbox_vector_tile import TileView
 
-from .features import Layer
+from .features import project_coordinates
 
 
 def _is_url(uri: str) -> bool:
@@ -24,13 +24,26 @@ def vt_bytes_to_geojson(b_content: bytes, x: int, y: int, z: int, layer=None) ->
     :param layer: include only the specified layer.
     :return: a features collection (GeoJSON).
     """
-    data = decode(b_content, y_coord_down=True)
+    tile = TileView(b_content)
+    if layer is None:
+        # The geometries of all the layers are decoded together, and projected per geometry type with NumPy
+        geometry_arrays = tile.geometry_arrays(y_coord_down=True)
+    elif layer in tile:
+        geometry_arrays = {layer: tile[layer].geometry_arrays(y_coord_down=True)}
+    else:
+        geometry_arrays = {}
+
+    geojson = {}
+    for name, layer_arrays in geometry_arrays.items():
+        layer_view = tile[name]
+        geometries = [None] * layer_view.feature_count
+        for arrays in layer_arrays.values():
+            coords = project_coordinates(arrays.coords, x, y, z, layer_view.extent)
+            for index, geometry in zip(arrays.features.tolist(), arrays.geojson_geometries(coords)):
+                geometries[index] = geometry
+
+        features = [{"type": "Feature", "geometry": geometry, "properties": properties}
+                    for geometry, properties in zip(geometries, layer_view.properties)]
+        geojson[layer_view.name] = {"type": "FeatureCollection", "features": features}
 
-    features_collections = [Layer(x=x, y=y, z=z, name=layer_name, obj=layer_obj).toGeoJSON()
-                            for layer_name, layer_obj in data.items() if layer is None or layer_name == layer]
-
-    geojson = {fc["name"]: {"type": fc["type"], "features": fc["features"]} for fc in features_collections}
-
-     
     return geojson
-    